@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmark
+    ~~~~~~~~~
+
+    Helpers shared by the ControlBeast benchmark scripts.
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import time
+
+
+def measure(function, repeat=20):
+    """
+    Call a function repeatedly and measure the wall time per call.
+
+    :param function:    callable to be measured; it is called without arguments
+    :param int repeat:  number of calls
+    :return:            tuple of mean and best time per call in seconds
+    :rtype:             tuple
+    """
+    timings = []
+    for __ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return sum(timings) / len(timings), min(timings)
+
+
+def report(title, results):
+    """
+    Print a table of benchmark results.
+
+    :param str title:       title of the table
+    :param list results:    list of tuples, each consisting of a label and a (mean, best) tuple as
+                            returned by :py:func:`measure`
+    """
+    print("\n{}\n".format(title))
+    print("Operation                                          Mean [ms]    Best [ms]")
+    print("=========================================================================")
+    for label, (mean, best) in results:
+        print("{label: <48}  {mean: >10.3f}   {best: >10.3f}".format(label=label, mean=mean * 1000, best=best * 1000))
+    print("=========================================================================")
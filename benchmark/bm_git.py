@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+    ControlBeast Git Benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures the latency of repository queries issued by host operations on a repository with
+    500 host branches, comparing queries answered by running git with queries answered from the
+    repository's ref files. Also measures updating a file on 20 host branches, comparing commits
+    made by checking out each branch with commits made using git plumbing.
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+
+def main():
+    """
+    Git benchmark main function
+    """
+    # find out if running from an uninstalled version
+    # this being the case, insert the appropriate path into PYTHONPATH
+    cb_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    if os.path.isfile(cb_path + '/controlbeast/__init__.py'):
+        sys.path.insert(0, cb_path)
+
+    from benchmark import measure, report
+    from controlbeast.scm.git import Git
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as td:
+        git = Git()
+        git.init(path=td)
+        with open(os.path.join(td, 'README'), 'w') as fp:
+            fp.write('Benchmark repository')
+        git.commit(path=td, message='Initial commit')
+        sha = subprocess.check_output(['git', '-C', td, 'rev-parse', 'HEAD']).decode().strip()
+        updates = ''.join('create refs/heads/host{:03d} {}\n'.format(i, sha) for i in range(500))
+        subprocess.run(['git', '-C', td, 'update-ref', '--stdin'], input=updates.encode(), check=True)
+        # make the ref files old enough to be cached
+        for directory, __, files in os.walk(os.path.join(td, '.git')):
+            for name in files + [os.curdir]:
+                os.utime(os.path.join(directory, name), (0, 0))
+
+        uncached = Git()
+        uncached._refs.get = lambda path: None
+        uncached._refs.find = lambda path: None
+        for label, obj in (('git subprocess', uncached), ('ref cache', git)):
+            results.append(('get_branches ({})'.format(label), measure(lambda: obj.get_branches(path=td))))
+            results.append(('get_active_branch ({})'.format(label), measure(lambda: obj.get_active_branch(path=td))))
+            results.append(('get_root ({})'.format(label), measure(lambda: obj.get_root(path=td))))
+
+    report('Repository queries, 500 branches', results)
+
+    results = []
+    with tempfile.TemporaryDirectory() as td:
+        git = Git()
+        git.init(path=td)
+        with open(os.path.join(td, 'README'), 'w') as fp:
+            fp.write('Benchmark repository')
+        git.commit(path=td, message='Initial commit')
+        branches = ['host{:02d}'.format(i) for i in range(20)]
+        for name in branches:
+            git.create_branch(path=td, name=name)
+        counter = [0]
+
+        def checkout_commits():
+            counter[0] += 1
+            for name in branches:
+                git.checkout(path=td, name=name)
+                with open(os.path.join(td, 'status'), 'w') as fp:
+                    fp.write('run {}'.format(counter[0]))
+                git.commit(path=td, message='Update status')
+            git.checkout(path=td, name='master')
+
+        def plumbing_commits():
+            counter[0] += 1
+            content = 'run {}'.format(counter[0])
+            git.commit_files(path=td, message='Update status', changes=dict(
+                (name, {'status': content}) for name in branches
+            ))
+
+        results.append(('checkout, write and commit', measure(checkout_commits, repeat=3)))
+        results.append(('commit_files', measure(plumbing_commits, repeat=3)))
+
+    report('Commits to 20 branches', results)
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+else:
+    raise RuntimeError("This is an executable file. Do not try to import it!")
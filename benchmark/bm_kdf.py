@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+    ControlBeast Key Derivation Benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures the cost of key derivation for the legacy ``openssl enc`` format and for several
+    parameter choices of the key derivation functions supported by the ControlBeast key store
+    format. The time an attacker needs for testing one passphrase is roughly the derivation time
+    measured here, so the number of guesses per second and core indicates the security gained.
+    The cost for key store operations reusing a cached key is shown as well.
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import os
+import sys
+
+
+def main():
+    """
+    Key derivation benchmark main function
+    """
+    # find out if running from an uninstalled version
+    # this being the case, insert the appropriate path into PYTHONPATH
+    cb_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    if os.path.isfile(cb_path + '/controlbeast/__init__.py'):
+        sys.path.insert(0, cb_path)
+
+    from benchmark import measure, report
+    from controlbeast.keystore import cipher
+
+    passphrase = b'correct horse battery staple'
+    plaintext = '\n'.join('key{0}: value {0}'.format(i) for i in range(100)).encode()
+    settings = [
+        ('legacy openssl enc (sha256, 1 iteration)', None, None),
+        ('pbkdf2-sha256, i=10000', 'pbkdf2-sha256', {'i': 10000}),
+        ('pbkdf2-sha256, i=100000', 'pbkdf2-sha256', {'i': 100000}),
+        ('pbkdf2-sha256, i=200000', 'pbkdf2-sha256', {'i': 200000}),
+        ('pbkdf2-sha256, i=600000', 'pbkdf2-sha256', {'i': 600000}),
+        ('scrypt, n=2^14 r=8 p=1', 'scrypt', {'n': 2 ** 14, 'r': 8, 'p': 1}),
+        ('scrypt, n=2^15 r=8 p=1', 'scrypt', {'n': 2 ** 15, 'r': 8, 'p': 1}),
+        ('scrypt, n=2^16 r=8 p=1', 'scrypt', {'n': 2 ** 16, 'r': 8, 'p': 1}),
+    ]
+
+    results = []
+    guesses = []
+    for label, kdf, params in settings:
+        if kdf is None:
+
+            def derive():
+                cipher.bytes_to_key(passphrase, os.urandom(cipher.OPENSSL_SALT_LENGTH))
+
+        else:
+
+            def derive():
+                cipher.derive_key(passphrase, kdf, params, os.urandom(cipher.CBKS_SALT_LENGTH))
+
+        timing = measure(derive, repeat=5)
+        results.append(('derive: {}'.format(label), timing))
+        guesses.append((label, 1 / timing[1]))
+
+    if cipher.is_available():
+        kdf, params = cipher.default_kdf()
+        salt = os.urandom(cipher.CBKS_SALT_LENGTH)
+        ciphertext = cipher.encrypt(plaintext, passphrase, kdf, params, salt)
+
+        def encrypt_cached():
+            cipher.encrypt(plaintext, passphrase, kdf, params, salt)
+
+        def decrypt_cached():
+            cipher.decrypt(ciphertext, passphrase)
+
+        def decrypt_uncached():
+            cipher.clear_key_cache()
+            cipher.decrypt(ciphertext, passphrase)
+
+        results.append(('encrypt, configured KDF, cached key', measure(encrypt_cached)))
+        results.append(('decrypt, configured KDF, cached key', measure(decrypt_cached)))
+        results.append(('decrypt, configured KDF, key derived', measure(decrypt_uncached, repeat=5)))
+
+    report('Key derivation cost', results)
+
+    print("\nBrute force resistance\n")
+    print("Key derivation function                          Guesses per second and core")
+    print("============================================================================")
+    for label, rate in guesses:
+        print("{label: <48}  {rate: >26,.0f}".format(label=label, rate=rate))
+    print("============================================================================")
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+else:
+    raise RuntimeError("This is an executable file. Do not try to import it!")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+    ControlBeast Key Store Benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures the per-operation latency of the key store crypto backend, comparing the
+    ``openssl enc`` subprocess path with the in-process libcrypto path, and the latency of
+    opening and updating a large key store using the whole-file, per-entry and SQLite layouts.
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import os
+import sys
+import tempfile
+
+
+def main():
+    """
+    Key store benchmark main function
+    """
+    # find out if running from an uninstalled version
+    # this being the case, insert the appropriate path into PYTHONPATH
+    cb_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    if os.path.isfile(cb_path + '/controlbeast/__init__.py'):
+        sys.path.insert(0, cb_path)
+
+    from benchmark import measure, report
+    from controlbeast.keystore import CbKeyStore
+    from controlbeast.keystore import cipher
+    from controlbeast.keystore.crypto import CbKsCrypto
+
+    plaintext = '\n'.join('key{0}: value {0}'.format(i) for i in range(100))
+    results = []
+
+    with tempfile.TemporaryDirectory() as td:
+        filename = os.path.join(td, 'status.db')
+        modes = [('subprocess', False)]
+        if cipher.is_available():
+            modes.append(('in-process', True))
+        for label, in_process in modes:
+            crypto = CbKsCrypto(file=filename, passphrase='secret')
+            crypto._in_process = in_process
+
+            def encrypt():
+                crypto.plaintext = plaintext
+
+            def decrypt():
+                crypto._decrypt()
+
+            results.append(('CbKsCrypto encrypt ({})'.format(label), measure(encrypt)))
+            results.append(('CbKsCrypto decrypt ({})'.format(label), measure(decrypt)))
+
+        store = CbKeyStore(file=os.path.join(td, 'store.db'), passphrase='secret')
+        counter = iter(range(10 ** 6))
+
+        def update():
+            store['key'] = next(counter)
+
+        results.append(('CbKeyStore.__setitem__ (default backend)', measure(update)))
+
+        if cipher.is_available():
+            content = {'key{}'.format(i): {'facts': 'x' * 1000, 'index': i} for i in range(1000)}
+            for layout in ('file', 'entries', 'sqlite'):
+                filename = os.path.join(td, '{}.db'.format(layout))
+                large = CbKeyStore(file=filename, passphrase='secret', layout=layout, dict=content)
+
+                def read_one():
+                    CbKeyStore(file=filename, passphrase='secret', layout=layout)['key500']
+
+                def update_one():
+                    large['key500'] = next(counter)
+
+                results.append(('1000 entries, open and read one ({})'.format(layout), measure(read_one)))
+                results.append(('1000 entries, update one ({})'.format(layout), measure(update_one)))
+
+    report('Key store crypto backend', results)
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+else:
+    raise RuntimeError("This is an executable file. Do not try to import it!")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+    ControlBeast YAML Benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Measures YAML parsing and serialisation using PyYAML's pure Python implementation and
+    the libyaml based implementation, for the bundled master template files and a large
+    synthetic key store.
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import glob
+import os
+import sys
+
+
+def main():
+    """
+    YAML benchmark main function
+    """
+    # find out if running from an uninstalled version
+    # this being the case, insert the appropriate path into PYTHONPATH
+    cb_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    if os.path.isfile(cb_path + '/controlbeast/__init__.py'):
+        sys.path.insert(0, cb_path)
+
+    import yaml
+    from benchmark import measure, report
+    from controlbeast.conf import CbConf, get_conf
+
+    conf = CbConf.get_instance()
+    templates = []
+    for filename in sorted(glob.glob(os.path.join(get_conf('TEMPLATE_PATH'), 'master', 'base', '*.yml'))):
+        with open(filename, 'r') as fp:
+            templates.append(fp.read().format(**conf))
+
+    store = {
+        'host{:04d}'.format(i): {
+            'stage': get_conf('STAGE_INSTALLED'),
+            'address': '192.168.{}.{}'.format(i // 256, i % 256),
+            'packages': ['pkg{}'.format(j) for j in range(10)],
+            'facts': {'os': 'FreeBSD', 'version': 10.0, 'cores': 8, 'zfs': True},
+        } for i in range(2000)
+    }
+
+    implementations = [('pure Python', yaml.SafeLoader, yaml.SafeDumper)]
+    if yaml.__with_libyaml__:
+        implementations.append(('libyaml', yaml.CSafeLoader, yaml.CSafeDumper))
+
+    results = []
+    outputs = []
+    for label, loader, dumper in implementations:
+
+        def load_templates():
+            for content in templates:
+                yaml.load(content, Loader=loader)
+
+        def dump_store():
+            return yaml.dump(store, Dumper=dumper, default_flow_style=False)
+
+        document = dump_store()
+        outputs.append(document)
+
+        def load_store():
+            yaml.load(document, Loader=loader)
+
+        results.append(('master templates, load ({})'.format(label), measure(load_templates)))
+        results.append(('synthetic key store, dump ({})'.format(label), measure(dump_store, repeat=3)))
+        results.append(('synthetic key store, load ({})'.format(label), measure(load_store, repeat=3)))
+
+    report('YAML parsing and serialisation', results)
+    if len(set(outputs)) > 1:
+        print("\nSerialised output differs between implementations!\n")
+        return os.EX_SOFTWARE
+    print("\nSerialised output is identical for all implementations.\n")
+    return os.EX_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+else:
+    raise RuntimeError("This is an executable file. Do not try to import it!")
@@ -6,10 +6,12 @@
     :copyright: Copyright 2013 by the ControlBeast team, see AUTHORS.
     :license: ISC, see LICENSE for details.
 """
+import atexit
 import os
 
 from controlbeast.cli.base import CbCommand
 from controlbeast.utils import loader
+from controlbeast.utils.binary import add_sink, CbBinaryStatistics
 
 
 _commands = None
@@ -72,9 +74,16 @@ def dispatch(executable, argv):
     Function being called from the executable to launch the CLI.
     This is the initial entrance point for any ControlBeast processing.
 
+    If the environment variable ``CB_BINARY_STATISTICS`` is set, a summary of the external commands executed
+    is printed to stderr when the executable exits.
+
     :param str executable: Name of the executable
     :param list argv: vector with command line arguments
     """
+    if os.getenv('CB_BINARY_STATISTICS'):
+        statistics = CbBinaryStatistics()
+        add_sink(statistics)
+        atexit.register(statistics.report)
     if len(argv) > 1:
         cmd_class = get_command(argv[1])
         if cmd_class:
@@ -7,10 +7,13 @@
     :license: ISC, see LICENSE for details.
 """
 import os
+import sys
 import controlbeast.cli.base
 from controlbeast.conf import get_conf
+from controlbeast.core.fleet import create_hosts
 from controlbeast.keystore import CbKeyStore
-from controlbeast.scm import scm_get_root, CbSCMRepoError, scm_get_branches, scm_checkout, scm_create_branch
+from controlbeast.scm import scm_get_root, CbSCMRepoError, scm_get_branches, scm_get_workspace, scm_create_branch
+from controlbeast.scm import CbSCMBranchError, CbSCMCheckoutError, CbSCMCommitError
 
 
 class NewCommand(controlbeast.cli.base.CbCommand):
@@ -19,7 +22,6 @@ class NewCommand(controlbeast.cli.base.CbCommand):
     """
 
     _usg_message_1 = "usage: {executable} {command} [options] <name>"
-    _arg_limits = (2, -1)
 
     _help = 'Create a new host within the ControlBeast repository'
     _arg_list = (
@@ -34,6 +36,17 @@ class NewCommand(controlbeast.cli.base.CbCommand):
                 'default': get_conf('SCM_BRANCH'),
                 'action': 'store'
             }
+        ),
+        (
+            ('-f', '--file'),
+            {
+                'help': 'File listing identifiers of hosts to be created, one per line (- for standard input)',
+                'action': 'store'
+            }
+        ),
+        (
+            ('name', ),
+            {'help': 'Identifier for the host to be created', 'nargs': '?'}
         )
     )
 
@@ -41,9 +54,12 @@ class NewCommand(controlbeast.cli.base.CbCommand):
         """
         Command handler for the add command
         """
+        if 'file' in self._args and self._args.file:
+            return self._handle_file()
+
         # get identifier, either form arguments or from direct input
-        if len(self._argv) > 2:
-            name = self._argv[-1]
+        if 'name' in self._args and self._args.name:
+            name = self._args.name
         else:
             name = ''
             while name == '':
@@ -78,17 +94,56 @@ class NewCommand(controlbeast.cli.base.CbCommand):
         except CbSCMRepoError as err:
             return self._terminate(err, os.EX_IOERR)
 
-        # Switch to source branch, create host branch from it and activate it
-        scm_checkout(path=path, name=source)
-        scm_create_branch(path=path, name=name)
-        scm_checkout(path=path, name=name)
+        # Create host branch from source branch and get a work space for it, leaving the repository's
+        # working tree untouched
+        try:
+            scm_create_branch(path=scm_get_workspace(path=repository, name=source), name=name)
+            workspace = scm_get_workspace(path=repository, name=name)
+        except CbSCMCheckoutError as err:
+            return self._terminate(err, os.EX_IOERR)
 
-        # Create key store
+        # Create key store; empty directories of the template are not tracked, so they are missing in work spaces
+        filename = os.path.join(workspace, get_conf('HOST_KEY_STORE'))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
         ks = CbKeyStore(
-            file=os.path.join(repository, get_conf('HOST_KEY_STORE')),
+            file=filename,
             dict={
                 'stage': get_conf('STAGE_UNDEFINED')
             }
         )
 
         self._status = os.EX_OK
+
+    def _handle_file(self):
+        """
+        Command handler for creating all hosts listed within a file at once
+        """
+        if self._args.dir:
+            path = self._args.dir
+        else:
+            path = os.path.abspath(os.getcwd())
+
+        # read identifiers, skipping empty lines and comments
+        try:
+            if self._args.file == '-':
+                lines = sys.stdin.readlines()
+            else:
+                with open(self._args.file, 'r') as fp:
+                    lines = fp.readlines()
+        except OSError as err:
+            return self._terminate(err, os.EX_NOINPUT)
+        names = [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
+        if self._args.name:
+            names.append(self._args.name)
+
+        try:
+            hosts = create_hosts(path=path, names=names, source=self._args.source)
+        except CbSCMRepoError as err:
+            return self._terminate(err, os.EX_IOERR)
+        except CbSCMBranchError as err:
+            return self._terminate(err, os.EX_DATAERR)
+        except CbSCMCommitError as err:
+            return self._terminate(err, os.EX_IOERR)
+
+        print('Created {} hosts.'.format(len(hosts)))
+        self._status = os.EX_OK
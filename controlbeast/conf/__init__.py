@@ -53,7 +53,7 @@ class CbConf(CbDynamicIterable):
     def __init__(self):
 
         # ensure the constructor of the CbDynamicIterable parent side is called
-        super(CbDynamicIterable, self).__init__(dict=None)
+        super(CbDynamicIterable, self).__init__(None)
 
         # convert all upper case configuration values from :py:module:`~controlbeast.conf.default`
         for setting in dir(default):
@@ -22,6 +22,26 @@ DEFAULT_CHARSET = 'utf-8'
 # Default location for templates
 TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'templates')
 
+# Maximum number of compiled and parsed templates to be cached
+TEMPLATE_CACHE_SIZE = 256
+
+# File caching compiled and parsed templates across invocations (None disables persisting the cache)
+TEMPLATE_CACHE_FILE = None
+
+# Number of threads deploying template files (None chooses according to the number of processors)
+TEMPLATE_DEPLOY_WORKERS = None
+
+# File caching the paths and versions of external binaries across invocations (None disables persisting the cache)
+BINARY_CACHE_FILE = os.path.join(
+    os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'controlbeast', 'binaries.yml'
+)
+
+# Maximum size in bytes of the chunks read from external binaries whose output is streamed
+BINARY_STREAM_CHUNK = 64 * 1024
+
+# Maximum number of bytes kept from the error output of external binaries whose output is streamed
+BINARY_STDERR_LIMIT = 64 * 1024
+
 
 # REPOSITORY Settings
 #####################
@@ -32,6 +52,12 @@ SCM_CLASS = 'Git'
 # Default branch to be used for creating new host systems
 SCM_BRANCH = 'master'
 
+# Directory, relative to the repository's root, holding the work spaces of branches checked out as git worktrees
+SCM_WORKSPACE_PATH = os.path.join('.git', 'controlbeast', 'worktrees')
+
+# Time in seconds after which unused work spaces may be removed
+SCM_WORKSPACE_IDLE = 3600
+
 
 # HOST Settings
 ###############
@@ -55,6 +81,63 @@ HOST_SERVICE_FILE = os.path.join('base', 'service.yml')
 HOST_KEY_STORE = os.path.join('store', 'status.db')
 
 
+# KEY STORE Settings
+####################
+
+# Time window in seconds within which key store updates are coalesced into one write (0 writes every update at once)
+KEY_STORE_WRITE_BEHIND = 0
+
+# Layout of key stores: 'file' (encrypted as a whole), 'entries' (each entry encrypted on its own, if encrypted)
+# or 'sqlite' (kept within an SQLite database)
+KEY_STORE_LAYOUT = 'file'
+
+# File name extensions of key stores to be kept within an SQLite database
+KEY_STORE_SQLITE_EXTENSIONS = ['.sqlite', '.sqlite3']
+
+# Key derivation function for encrypted key stores, either 'pbkdf2-sha256' or 'scrypt'
+KEY_STORE_KDF = 'pbkdf2-sha256'
+
+# Number of PBKDF2 iterations
+KEY_STORE_PBKDF2_ITERATIONS = 200000
+
+# scrypt CPU/memory cost, block size and parallelisation parameters
+KEY_STORE_SCRYPT_N = 2 ** 15
+KEY_STORE_SCRYPT_R = 8
+KEY_STORE_SCRYPT_P = 1
+
+# Name of the directory, next to the key store file, holding the key store's attachments
+KEY_STORE_ATTACHMENT_DIR = 'attachments'
+
+# Size in bytes of the chunks attachments are read and written in
+KEY_STORE_ATTACHMENT_CHUNK = 64 * 1024
+
+
+# SSH Settings
+##############
+
+# Number of ssh-keygen instances generating key pairs at once (None chooses according to the number of processors)
+SSH_KEYGEN_WORKERS = None
+
+# Number of seconds the list of identities held by the SSH agent is cached
+SSH_AGENT_CACHE_TTL = 5
+
+
+# FLEET Settings
+################
+
+# Name of the file, relative to the repository's root, caching the fleet index
+FLEET_INDEX_FILE = os.path.join('.git', 'controlbeast', 'fleet.yml')
+
+# Key store entries recorded within the fleet index (they are cached in plain text)
+FLEET_INDEX_KEYS = ['stage']
+
+# Maximum number of parsed YAML files read from branches or commits to be cached
+FLEET_YAML_CACHE_SIZE = 1024
+
+# Number of threads decrypting key stores for the fleet index (None chooses according to the number of processors)
+FLEET_INDEX_WORKERS = None
+
+
 # STAGE CODES
 #############
 
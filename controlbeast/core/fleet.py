@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+    controlbeast.core.fleet
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+from collections import UserDict
+from concurrent.futures import ThreadPoolExecutor
+import os
+import tempfile
+import yaml
+from controlbeast.conf import get_conf
+from controlbeast.keystore.crypto import CbKsCrypto
+from controlbeast.keystore.entries import CbKsEntries, ENTRIES_MAGIC
+from controlbeast.keystore.exception import CbKsPasswordError
+from controlbeast.keystore.plain import CbKsPlain
+from controlbeast.scm.base import CbSCMBranchError
+from controlbeast.scm.git import Git, GitCatFile
+from controlbeast.utils.file import CbFile
+from controlbeast.utils.yaml import safe_dump, safe_load
+
+
+class CbFleetIndex(UserDict):
+    """
+    Index of the key store content of all hosts within a ControlBeast repository.
+
+    The index maps each host branch to a dictionary containing selected entries of the host's
+    key store, e. g. the host's stage. The key stores are read straight from the git objects
+    committed on each branch through one ``git cat-file --batch`` process, so no branch needs
+    to be checked out. Encrypted key stores are decrypted in parallel. Example::
+
+       index = CbFleetIndex(path='/my/repository', passphrase='secret_password')
+       index.refresh()
+       for host, status in index.items():
+           print(host, status['stage'])
+
+    The index is cached in a file within the repository's ``.git`` directory, together with the
+    commit each branch pointed to when its key store was read. Refreshing the index only reads the
+    key stores of branches which have been created or changed since. Branches without a committed
+    key store, e. g. the master branch, do not show up in the index.
+
+    .. warning::
+
+       The cache file contains the selected key store entries in plain text. Only select entries
+       which are not secret.
+
+    :param str path:        Path on the file system where the repository resides. If not specified,
+                            it defaults to the current work directory.
+    :param str passphrase:  Passphrase the key stores are encrypted with. If not specified, the key stores
+                            are expected to be stored in plain text.
+    :param list keys:       Key store entries to be recorded within the index. Defaults to ``FLEET_INDEX_KEYS``.
+    :param str cache:       Path to the cache file. Defaults to ``FLEET_INDEX_FILE`` within the repository.
+    """
+
+    #: Root directory of the repository
+    _root = ''
+
+    #: Passphrase to be used for decrypting the key stores
+    _passphrase = ''
+
+    #: Key store entries recorded within the index
+    _keys = []
+
+    #: Path of the key store within each branch, as used by git
+    _store = ''
+
+    #: Path to the cache file
+    _cache = ''
+
+    #: Commits the branches pointed to when the index was refreshed
+    _tips = {}
+
+    def __init__(self, path=None, passphrase='', keys=None, cache=None):
+        super(CbFleetIndex, self).__init__()
+        self._scm = Git()
+        self._root = self._scm.get_root(path=path or os.path.abspath(os.getcwd()))
+        self._passphrase = passphrase
+        self._keys = list(keys or get_conf('FLEET_INDEX_KEYS'))
+        self._store = get_conf('HOST_KEY_STORE').replace(os.sep, '/')
+        if cache is None:
+            cache = os.path.join(self._root, get_conf('FLEET_INDEX_FILE'))
+        self._cache = cache
+        self._tips = {}
+        self._load_cache()
+
+    def _load_cache(self):
+        """
+        Restore the index from the cache file.
+
+        The cache is discarded if it has been written for another key store path or another
+        selection of key store entries.
+        """
+        try:
+            with open(self._cache, 'r') as fp:
+                content = safe_load(fp)
+        except (OSError, yaml.YAMLError):
+            return
+        if not isinstance(content, dict) or content.get('store') != self._store or content.get('keys') != self._keys:
+            return
+        for branch, entry in content.get('branches', {}).items():
+            self._tips[branch] = entry['sha']
+            if entry['status'] is not None:
+                self.data[branch] = entry['status']
+
+    def _save_cache(self):
+        """
+        Write the index into the cache file
+        """
+        content = {
+            'store': self._store,
+            'keys': self._keys,
+            'branches': {
+                branch: {'sha': sha, 'status': self.data.get(branch)} for branch, sha in self._tips.items()
+            }
+        }
+        try:
+            os.makedirs(os.path.dirname(self._cache), exist_ok=True)
+            CbFile._write_atomic(self._cache, safe_dump(content).encode())
+        except OSError:
+            pass
+
+    def _decode(self, branch, blob):
+        """
+        Decrypt and parse a key store read from a branch.
+
+        :param str branch:  name of the branch the key store has been read from
+        :param blob:        key store blob as returned by :py:meth:`~controlbeast.scm.git.GitCatFile.read`
+        :return:            selected key store entries, or ``None`` if the branch has no key store
+        :rtype:             dict
+        """
+        if blob is None or blob.type != 'blob':
+            return None
+        if self._passphrase and blob.content.startswith(ENTRIES_MAGIC):
+            # per-entry encrypted key store: only the selected entries are decrypted
+            try:
+                content = CbKsEntries(passphrase=self._passphrase).parse(blob.content)
+                return {key: content[key] for key in self._keys if key in content}
+            except CbKsPasswordError:
+                raise CbKsPasswordError(filename='{}:{}'.format(branch, self._store))
+            except yaml.YAMLError:
+                return None
+        if self._passphrase:
+            backend = CbKsCrypto(passphrase=self._passphrase)
+        else:
+            backend = CbKsPlain()
+        try:
+            content = safe_load(backend.decrypt(blob.content))
+        except CbKsPasswordError:
+            raise CbKsPasswordError(filename='{}:{}'.format(branch, self._store))
+        except yaml.YAMLError:
+            return None
+        if not isinstance(content, dict):
+            return None
+        return {key: content[key] for key in self._keys if key in content}
+
+    def refresh(self):
+        """
+        Bring the index up to date with the repository.
+
+        :return:    sorted list of the branches whose key stores have been read
+        :rtype:     list
+        """
+        tips = self._scm.get_branch_tips(path=self._root)
+        removed = set(self._tips) - set(tips)
+        for branch in removed:
+            del self._tips[branch]
+            self.data.pop(branch, None)
+
+        changed = sorted(branch for branch, sha in tips.items() if self._tips.get(branch) != sha)
+        if changed:
+            with GitCatFile(self._root) as reader:
+                blobs = reader.read('{}:{}'.format(tips[branch], self._store) for branch in changed)
+            with ThreadPoolExecutor(max_workers=get_conf('FLEET_INDEX_WORKERS')) as pool:
+                results = list(pool.map(self._decode, changed, blobs))
+            for branch, status in zip(changed, results):
+                self._tips[branch] = tips[branch]
+                if status is None:
+                    self.data.pop(branch, None)
+                else:
+                    self.data[branch] = status
+
+        if changed or removed:
+            self._save_cache()
+        return changed
+
+    @property
+    def tips(self):
+        """
+        Dictionary mapping each branch to the commit it pointed to when the index was refreshed
+        """
+        return dict(self._tips)
+
+
+def create_hosts(path=None, names=(), source=None, message=None):
+    """
+    Create several hosts within a ControlBeast repository at once.
+
+    Each host's branch is created from the ``source`` branch, and its initial key store is committed to it,
+    using :py:meth:`~controlbeast.scm.git.Git.commit_files`. No branch is checked out, and all branches are
+    created within one transaction, so either all or none of the hosts are created. As all hosts start with
+    the same key store content, the key store is serialised only once. Example::
+
+       create_hosts(path='/my/repository', names=['host{:03d}'.format(i) for i in range(500)])
+
+    :param str path:        Path on the file system where the repository resides. If not specified,
+                            it defaults to the current work directory.
+    :param list names:      identifiers of the hosts to be created
+    :param str source:      branch the hosts are created from. Defaults to ``SCM_BRANCH``.
+    :param str message:     Commit message to be attached to the commit records.
+    :return:                dictionary mapping each host identifier to the commit its branch points to
+    :rtype:                 dict
+    :raises CbSCMBranchError:   if a host identifier is already in use, or the source branch does not exist
+    """
+    scm = Git()
+    root = scm.get_root(path=path or os.path.abspath(os.getcwd()))
+    source = source or get_conf('SCM_BRANCH')
+    names = list(dict.fromkeys(names))
+    branches = scm.get_branches(path=root)
+    for name in names:
+        if name in branches:
+            raise CbSCMBranchError(
+                scm_name='git', path=root, branch=name, text='Host identifier is already in use.'
+            )
+    if source not in branches:
+        raise CbSCMBranchError(
+            scm_name='git', path=root, branch=source, text='Source branch does not exist.'
+        )
+    if not names:
+        return {}
+
+    # serialise through the plain text backend, as other layouts, e. g. SQLite, do not keep all data within one file
+    with tempfile.TemporaryDirectory() as td:
+        filename = os.path.join(td, os.path.basename(get_conf('HOST_KEY_STORE')))
+        CbKsPlain(file=filename).plaintext = safe_dump({'stage': get_conf('STAGE_UNDEFINED')})
+        with open(filename, 'rb') as fp:
+            content = fp.read()
+
+    store_file = get_conf('HOST_KEY_STORE').replace(os.sep, '/')
+    return scm.commit_files(
+        path=root,
+        message=message or 'Create hosts',
+        changes=dict((name, {store_file: content}) for name in names),
+        parents=dict.fromkeys(names, source),
+    )
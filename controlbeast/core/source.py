@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+    controlbeast.core.source
+    ~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+from collections import OrderedDict
+import copy
+import os
+import threading
+from controlbeast.conf import get_conf
+from controlbeast.scm.git import Git, GitCatFile
+from controlbeast.utils.yaml import CbYaml
+
+
+class CbYamlSource(object):
+    """
+    Source of YAML files as committed on any branch or commit of a ControlBeast repository.
+
+    Files are read straight from the git objects, so no branch needs to be checked out. Object names
+    are resolved through one ``git cat-file --batch-check`` process, and only blobs which have not been
+    parsed before are read through one ``git cat-file --batch`` process. Parsed results are cached by
+    blob SHA, so a file shared by many branches is parsed once. Example::
+
+       with CbYamlSource(path='/my/repository') as source:
+           network = source.get('host1', get_conf('HOST_NETWORK_FILE'))
+           files = source.get_many(['host1', 'host2'], [get_conf('HOST_NETWORK_FILE'), get_conf('HOST_OS_FILE')])
+           print(files['host2'][get_conf('HOST_OS_FILE')])
+
+    Each call returns new :py:class:`~controlbeast.utils.yaml.CbYaml` objects, so they may be modified
+    without affecting the cache. A source object may be shared between threads.
+
+    :param str path:        Path on the file system where the repository resides. If not specified,
+                            it defaults to the current work directory.
+    :param int cache_size:  Maximum number of parsed blobs to be cached. Defaults to ``FLEET_YAML_CACHE_SIZE``.
+    """
+
+    #: Root directory of the repository
+    _root = ''
+
+    #: Maximum number of parsed blobs to be cached
+    _cache_size = 0
+
+    def __init__(self, path=None, cache_size=None):
+        self._root = Git().get_root(path=path or os.path.abspath(os.getcwd()))
+        self._cache_size = get_conf('FLEET_YAML_CACHE_SIZE') if cache_size is None else cache_size
+        self._checker = GitCatFile(self._root, check=True)
+        self._reader = GitCatFile(self._root)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _lookup(self, sha):
+        """
+        Get a parsed blob from the cache, marking it as used most recently.
+
+        :param str sha: object name of the blob
+        :return:        parsed content, or ``None`` if the blob has not been cached
+        """
+        with self._lock:
+            if sha not in self._cache:
+                return None
+            self._cache.move_to_end(sha)
+            return self._cache[sha]
+
+    def _store(self, sha, data):
+        """
+        Put a parsed blob into the cache, evicting the blobs used least recently.
+
+        :param str sha:     object name of the blob
+        :param data:        parsed content
+        """
+        with self._lock:
+            self._cache[sha] = data
+            self._cache.move_to_end(sha)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def get_many(self, revisions, filenames):
+        """
+        Read several files from several branches or commits.
+
+        :param list revisions:  branch names, commit object names or any other revision git understands
+        :param list filenames:  file names relative to the repository's root
+        :return:                dictionary mapping each revision to a dictionary mapping each file name to
+                                a :py:class:`~controlbeast.utils.yaml.CbYaml` object, or ``None`` if the file
+                                does not exist within that revision
+        :rtype:                 dict
+        """
+        revisions = list(revisions)
+        filenames = list(filenames)
+        requests = [(revision, filename) for revision in revisions for filename in filenames]
+        names = ['{}:{}'.format(revision, filename.replace(os.sep, '/')) for revision, filename in requests]
+        objects = self._checker.read(names)
+
+        parsed = {}
+        missing = []
+        for obj in objects:
+            if obj is not None and obj.type == 'blob' and obj.sha not in parsed:
+                data = self._lookup(obj.sha)
+                if data is None:
+                    missing.append(obj.sha)
+                parsed[obj.sha] = data
+        for blob in self._reader.read(missing):
+            if blob is not None:
+                parsed[blob.sha] = CbYaml.parse(blob.content) or {}
+                self._store(blob.sha, parsed[blob.sha])
+
+        result = dict((revision, {}) for revision in revisions)
+        for (revision, filename), obj in zip(requests, objects):
+            if obj is None or parsed.get(obj.sha) is None:
+                result[revision][filename] = None
+            else:
+                result[revision][filename] = CbYaml()
+                result[revision][filename].update(copy.deepcopy(parsed[obj.sha]))
+        return result
+
+    def get(self, revision, filename):
+        """
+        Read a file from a branch or commit.
+
+        :param str revision:    branch name, commit object name or any other revision git understands
+        :param str filename:    file name relative to the repository's root
+        :return:                content of the file, or ``None`` if the file does not exist within the revision
+        :rtype:                 ~controlbeast.utils.yaml.CbYaml
+        """
+        return self.get_many([revision], [filename])[revision][filename]
+
+    def clear(self):
+        """
+        Drop all parsed blobs from the cache
+        """
+        with self._lock:
+            self._cache.clear()
+
+    def close(self):
+        """
+        Terminate the ``git cat-file`` processes
+        """
+        self._checker.close()
+        self._reader.close()
@@ -6,12 +6,52 @@
     :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
     :license: ISC, see LICENSE for details.
 """
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import os
-from controlbeast.conf import get_conf, CbConf
+import stat
+from controlbeast.conf import get_conf
+from controlbeast.utils.convert import to_bytes
 from controlbeast.utils.file import CbFile
+from controlbeast.utils.template import CbTemplateCache
 from controlbeast.utils.yaml import CbYaml
 
 
+#: Outcome of a template deployment: lists of the files created, changed and left unchanged, given by their
+#: names relative to the deployment path
+CbTemplateReport = namedtuple('CbTemplateReport', ['created', 'changed', 'unchanged'])
+
+#: Number of bytes read at once when hashing deployed files
+_HASH_CHUNK = 64 * 1024
+
+
+def _read_umask():
+    """
+    Determine the umask of the process.
+
+    The umask is read from ``/proc`` where available. Otherwise, it can only be read by setting it, so this
+    function is called once when this module is imported, never while other threads may be creating files.
+
+    :return:    umask of the process
+    :rtype:     int
+    """
+    try:
+        with open('/proc/self/status', 'r') as fp:
+            for line in fp:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError, IndexError):
+        pass
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+#: umask of the process, determining the permissions of deployed files which are created
+_UMASK = _read_umask()
+
+
 class CbTemplate(CbFile):
     """
     ControlBeast Template Manager Object.
@@ -45,6 +85,10 @@ class CbTemplate(CbFile):
     All template files, including ``__init__.yml`` may use Python format strings with designators
     defined in :py:mod:`controlbeast.conf.default`.
 
+    Deployment is incremental: a file is only written if its rendered content differs from the file
+    already present at the destination, so unchanged files keep their modification time. Template files
+    without format strings, e. g. binary assets, are deployed verbatim.
+
     :param str template:    name of the template to work with
     :param str path:        destination for the template deployment
     """
@@ -94,26 +138,89 @@ class CbTemplate(CbFile):
         if self._check_template_name(template):
             self._template = template
 
-    def deploy(self):
+    def deploy(self, workers=None):
         """
         Deploy the template onto the file system.
+
+        Each template file is rendered, and the hash of the rendered content is compared with the hash of the
+        file present at the destination. Only files which do not exist yet or whose content differs are
+        written. Files are deployed by a pool of threads.
+
+        Files whose content would not be changed by rendering (cf.
+        :py:meth:`~controlbeast.utils.template.CbTemplateCache.verbatim`), e. g. binary assets, are not read
+        into memory, but copied by the kernel, keeping their permissions.
+
+        :param int workers: maximum number of files deployed at once. Defaults to ``TEMPLATE_DEPLOY_WORKERS``.
+        :return:            names of the files created, changed and left unchanged
+        :rtype:             CbTemplateReport
         """
         if not self._ini:
             self._load_template()
         if not self._ini:
             raise RuntimeError('Could not load template. __init__.yml missing or damaged.')
+        report = CbTemplateReport(created=[], changed=[], unchanged=[])
         if 'dirs' in self._ini:
             for dirname in self._ini['dirs']:
                 # noinspection PyArgumentList
                 os.makedirs(os.path.join(self._path, dirname), exist_ok=True)
         if 'files' in self._ini:
-            conf = CbConf.get_instance()
-            for filename in self._ini['files']:
-                with open(os.path.join(get_conf('TEMPLATE_PATH'), self._template, filename), 'r') as fp:
-                    content = fp.read()
-                    content = content.format(**conf)
-                    with open(os.path.join(self._path, filename), 'w') as wp:
-                        wp.write(content)
+            with ThreadPoolExecutor(max_workers=workers or get_conf('TEMPLATE_DEPLOY_WORKERS')) as pool:
+                futures = [pool.submit(self._deploy_file, filename) for filename in self._ini['files']]
+                for filename, future in zip(self._ini['files'], futures):
+                    getattr(report, future.result()).append(filename)
+        return report
+
+    def _deploy_file(self, filename):
+        """
+        Deploy one template file, unless the file present at the destination has the same content.
+
+        :param str filename:    name of the file relative to the template's root directory
+        :return:                ``'created'``, ``'changed'`` or ``'unchanged'``
+        :rtype:                 str
+        """
+        cache = CbTemplateCache.get_instance()
+        source = os.path.join(get_conf('TEMPLATE_PATH'), self._template, filename)
+        target = os.path.join(self._path, filename)
+        digest = cache.verbatim(source)
+        if digest is None:
+            content = to_bytes(cache.render(source))
+            size, digest = len(content), hashlib.sha256(content).digest()
+        else:
+            content = None
+            size = os.path.getsize(source)
+        try:
+            existing = os.path.getsize(target)
+        except FileNotFoundError:
+            status = 'created'
+        else:
+            # files of different size cannot have the same content, so hashing them can be skipped
+            if existing == size and self._digest(target) == digest:
+                return 'unchanged'
+            status = 'changed'
+        if content is None:
+            self._copy_atomic(source, target)
+            os.chmod(target, stat.S_IMODE(os.stat(source).st_mode) & ~_UMASK)
+        else:
+            self._write_atomic(target, content)
+            if status == 'created':
+                # created like open() would create it, instead of being accessible by the owner only
+                os.chmod(target, 0o666 & ~_UMASK)
+        return status
+
+    @staticmethod
+    def _digest(filename):
+        """
+        Calculate the hash of a file's content.
+
+        :param str filename:    name of the file
+        :return:                SHA256 digest of the file's content
+        :rtype:                 bytes
+        """
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(_HASH_CHUNK), b''):
+                digest.update(chunk)
+        return digest.digest()
 
     def _check_path(self, path):
         """
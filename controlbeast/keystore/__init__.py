@@ -9,4 +9,4 @@
 
 # import for convenience
 from controlbeast.keystore.base import CbKeyStore
-from controlbeast.keystore.exception import CbKsError, CbKsPasswordError, CbKsIOError
\ No newline at end of file
+from controlbeast.keystore.exception import CbKsError, CbKsPasswordError, CbKsIOError, CbKsFormatError
\ No newline at end of file
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+    controlbeast.keystore.attachment
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import re
+import tempfile
+from controlbeast.conf import get_conf
+from controlbeast.keystore import cipher
+from controlbeast.keystore.exception import CbKsFormatError, CbKsIOError, CbKsPasswordError
+from controlbeast.utils.convert import to_bytes
+from controlbeast.utils.file import CbFile
+
+
+#: Magic prefix of encrypted attachment files
+ATTACHMENT_MAGIC = b'CbKsA\x02'
+
+#: Name of the file within the attachment directory holding the key derivation parameters
+ATTACHMENT_KEY_FILE = '.key'
+
+#: Pattern attachment names, i. e. hex encoded SHA-256 digests, have to match
+ATTACHMENT_NAME_PATTERN = re.compile(r'\A[0-9a-f]{64}\Z')
+
+
+class CbKsAttachments(CbFile):
+    """
+    Store for binary attachments of key stores.
+
+    Attachments are kept as separate files within a directory, one file per distinct content. Each
+    file is named after a hash of its content, so attaching the same content several times only
+    stores it once. Attachments are streamed in chunks of ``KEY_STORE_ATTACHMENT_CHUNK`` bytes both
+    when written and when read, so they are never loaded into memory as a whole. Example::
+
+       attachments = CbKsAttachments('/my/store/attachments', 'secret_password')
+       reference = attachments.put('/etc/ssh/ssh_host_ed25519_key')
+       for chunk in attachments.get(reference):
+           output.write(chunk)
+
+    If a passphrase is specified, each attachment is encrypted on its own using AES-256-CBC and
+    authenticated using HMAC-SHA256, which requires libcrypto to be available. File names are then
+    derived from a keyed hash, so they reveal nothing about the content. The key derivation parameters
+    are kept within the file ``.key`` in the attachment directory; all attachments within a directory
+    must use the same passphrase.
+
+    References returned by :py:meth:`put` are dictionaries, which can be stored within a key store.
+
+    :param str path:        directory holding the attachments
+    :param str passphrase:  Passphrase to derive the keys from, if attachments should be encrypted
+    """
+
+    #: Directory holding the attachments
+    _path = ''
+
+    #: Passphrase to derive the keys from
+    _passphrase = b''
+
+    #: Keys used for encrypting and authenticating the attachments
+    _keys = None
+
+    def __init__(self, path, passphrase=''):
+        self._path = os.path.abspath(path)
+        self._passphrase = to_bytes(passphrase)
+        if self._passphrase and not cipher.is_available():
+            raise CbKsFormatError(filename=self._path)
+        self._keys = None
+
+    def _derive(self, create=False):
+        """
+        Derive the keys for encrypting and authenticating the attachments, reading the key derivation
+        parameters from the attachment directory or, if ``create`` is set and none exist yet, writing them.
+
+        :param bool create: ``True`` if missing key derivation parameters are to be created
+        :return:            tuple of encryption key and authentication key
+        :rtype:             tuple
+        :raises CbKsPasswordError: if the passphrase does not match
+        """
+        if self._keys is not None:
+            return self._keys
+        filename = os.path.join(self._path, ATTACHMENT_KEY_FILE)
+        try:
+            with open(filename, 'rb') as fp:
+                fields = fp.read().split()
+        except FileNotFoundError:
+            if not create:
+                raise CbKsIOError(filename=filename)
+            kdf, params = cipher.default_kdf()
+            salt = os.urandom(cipher.CBKS_SALT_LENGTH)
+            self._keys = cipher.derive_key(self._passphrase, kdf, params, salt)
+            content = b' '.join([
+                cipher.CBKS_MAGIC, str(cipher.CBKS_VERSION).encode(), kdf.encode(), cipher.format_params(params),
+                base64.b64encode(salt), self._verifier()
+            ]) + b'\n'
+            self._write_atomic(filename, content)
+            return self._keys
+        try:
+            magic, version, kdf, params, salt, verifier = fields
+            if magic != cipher.CBKS_MAGIC or int(version) != cipher.CBKS_VERSION:
+                raise ValueError()
+            self._keys = cipher.derive_key(
+                self._passphrase, kdf.decode(), cipher.parse_params(params, kdf.decode()), base64.b64decode(salt, validate=True)
+            )
+        except ValueError:
+            raise CbKsFormatError(filename=filename)
+        if not hmac.compare_digest(self._verifier(), verifier):
+            self._keys = None
+            raise CbKsPasswordError(filename=filename)
+        return self._keys
+
+    def _verifier(self):
+        """
+        Get the value written into the key file for verifying the passphrase.
+
+        :return:    base64 encoded verifier
+        :rtype:     bytes
+        """
+        return base64.b64encode(hmac.new(self._keys[1], ATTACHMENT_MAGIC, hashlib.sha256).digest())
+
+    @staticmethod
+    def _chunks(fp, size=None):
+        """
+        Read a file object in chunks.
+
+        :param fp:          binary file object
+        :param int size:    number of bytes to read, or ``None`` to read until the end of the file
+        :return:            generator yielding chunks
+        """
+        chunk_size = get_conf('KEY_STORE_ATTACHMENT_CHUNK')
+        while size is None or size > 0:
+            chunk = fp.read(chunk_size if size is None else min(chunk_size, size))
+            if not chunk:
+                break
+            if size is not None:
+                size -= len(chunk)
+            yield chunk
+
+    @property
+    def path(self):
+        """
+        Directory holding the attachments
+        """
+        return self._path
+
+    def filename(self, reference):
+        """
+        Get the path of the file holding an attachment.
+
+        :param dict reference:  reference as returned by :py:meth:`put`
+        :return:                path of the attachment file
+        :rtype:                 str
+        :raises CbKsFormatError:    if the reference does not name an attachment by its hex encoded digest, e. g.
+                                    to point outside the attachment directory
+        """
+        name = reference['attachment']
+        if not isinstance(name, str) or not ATTACHMENT_NAME_PATTERN.match(name):
+            raise CbKsFormatError(filename=self._path)
+        return os.path.join(self._path, name)
+
+    def put(self, source):
+        """
+        Store an attachment.
+
+        :param source:  path of the file to be attached, or binary file object to read the attachment from
+        :return:        reference to the attachment, containing its name and size
+        :rtype:         dict
+        """
+        if isinstance(source, str):
+            with open(source, 'rb') as fp:
+                return self.put(fp)
+        os.makedirs(self._path, exist_ok=True)
+        if self._passphrase:
+            key, mac_key = self._derive(create=True)
+            digest = hmac.new(mac_key, b'', hashlib.sha256)
+        else:
+            digest = hashlib.sha256()
+        size = 0
+        fd, temporary = tempfile.mkstemp(prefix='.', dir=self._path)
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                if self._passphrase:
+                    iv = os.urandom(cipher.AES_BLOCK_SIZE)
+                    ctx = cipher.CbCipherContext(key, iv, encrypt=True)
+                    tag = hmac.new(mac_key, ATTACHMENT_MAGIC + iv, hashlib.sha256)
+                    fp.write(ATTACHMENT_MAGIC + iv)
+                for chunk in self._chunks(source):
+                    size += len(chunk)
+                    digest.update(chunk)
+                    if self._passphrase:
+                        chunk = ctx.update(chunk)
+                        tag.update(chunk)
+                    fp.write(chunk)
+                if self._passphrase:
+                    chunk = ctx.finalize()
+                    tag.update(chunk)
+                    fp.write(chunk + tag.digest())
+                fp.flush()
+                os.fsync(fp.fileno())
+            reference = {'attachment': digest.hexdigest(), 'size': size}
+            if os.path.exists(self.filename(reference)):
+                # identical content has already been attached
+                os.unlink(temporary)
+            else:
+                os.chmod(temporary, 0o644 if not self._passphrase else 0o600)
+                os.replace(temporary, self.filename(reference))
+        except BaseException:
+            if os.path.exists(temporary):
+                os.unlink(temporary)
+            raise
+        return reference
+
+    def get(self, reference):
+        """
+        Read an attachment.
+
+        Encrypted attachments are authenticated completely before the first chunk is decrypted,
+        so no tampered data are ever returned.
+
+        :param dict reference:  reference as returned by :py:meth:`put`
+        :return:                generator yielding the attachment's content in chunks
+        :raises CbKsPasswordError: if an encrypted attachment cannot be authenticated
+        :raises CbKsFormatError: if the reference does not name an attachment by its digest
+        """
+        filename = self.filename(reference)
+        if not self._passphrase:
+            with open(filename, 'rb') as fp:
+                for chunk in self._chunks(fp):
+                    yield chunk
+            return
+        key, mac_key = self._derive()
+        header_length = len(ATTACHMENT_MAGIC) + cipher.AES_BLOCK_SIZE
+        length = os.path.getsize(filename) - header_length - cipher.CBKS_TAG_LENGTH
+        with open(filename, 'rb') as fp:
+            header = fp.read(header_length)
+            if not header.startswith(ATTACHMENT_MAGIC) or length < 0 or length % cipher.AES_BLOCK_SIZE:
+                raise CbKsFormatError(filename=filename)
+            tag = hmac.new(mac_key, header, hashlib.sha256)
+            for chunk in self._chunks(fp, length):
+                tag.update(chunk)
+            if not hmac.compare_digest(tag.digest(), fp.read(cipher.CBKS_TAG_LENGTH)):
+                raise CbKsPasswordError(filename=filename)
+            fp.seek(header_length)
+            ctx = cipher.CbCipherContext(key, header[len(ATTACHMENT_MAGIC):], encrypt=False)
+            for chunk in self._chunks(fp, length):
+                chunk = ctx.update(chunk)
+                if chunk:
+                    yield chunk
+            chunk = ctx.finalize()
+            if chunk:
+                yield chunk
+
+    def extract(self, reference, destination):
+        """
+        Write an attachment into a file.
+
+        :param dict reference:  reference as returned by :py:meth:`put`
+        :param destination:     path of the file to be written, or binary file object to write the attachment to
+        """
+        if isinstance(destination, str):
+            with open(destination, 'wb') as fp:
+                return self.extract(reference, fp)
+        for chunk in self.get(reference):
+            destination.write(chunk)
+
+    def purge(self, references):
+        """
+        Delete all attachments except the referenced ones.
+
+        :param list references: references to the attachments to be kept
+        :return:                number of attachments deleted
+        :rtype:                 int
+        """
+        keep = set(reference['attachment'] for reference in references)
+        count = 0
+        if os.path.isdir(self._path):
+            for name in os.listdir(self._path):
+                if not name.startswith('.') and name not in keep:
+                    os.unlink(os.path.join(self._path, name))
+                    count += 1
+        return count
+
+
+def is_reference(value):
+    """
+    Check whether a key store value is a reference to an attachment.
+
+    :param value:   value read from a key store
+    :return:        ``True`` if the value is a reference as returned by :py:meth:`CbKsAttachments.put`
+    :rtype:         bool
+    """
+    return isinstance(value, dict) and set(value) == {'attachment', 'size'}
@@ -8,13 +8,58 @@
 """
 
 
+import atexit
 from collections import UserDict
+from contextlib import contextmanager
+import fcntl
 import os
+import shutil
+import sqlite3
 import tempfile
+import threading
+import weakref
 import yaml
+from controlbeast.conf import get_conf
+from controlbeast.keystore import cipher
+from controlbeast.keystore.attachment import CbKsAttachments, is_reference
 from controlbeast.keystore.plain import CbKsPlain
 from controlbeast.keystore.crypto import CbKsCrypto
+from controlbeast.keystore.entries import CbKsEntries
 from controlbeast.keystore.exception import CbKsPasswordError
+from controlbeast.keystore.sqlite import CbKsSQLite
+from controlbeast.utils.yaml import safe_dump, safe_load
+
+
+#: Marker for keys not present in a key store, used by the transaction undo log and the change log
+_MISSING = object()
+
+#: Marker for keys without pending change, used by the transaction undo log
+_UNCHANGED = object()
+
+#: Weak references to key stores with deferred updates, which are flushed when the interpreter exits
+_pending = {}
+
+
+def _flush_pending():
+    """
+    Flush all key stores with deferred updates
+    """
+    for reference in list(_pending.values()):
+        _flush_reference(reference)
+
+
+def _flush_reference(reference):
+    """
+    Flush a key store referenced weakly, unless it has already been destroyed.
+
+    :param reference: weak reference to a :py:class:`CbKeyStore` object
+    """
+    store = reference()
+    if store is not None:
+        store.flush()
+
+
+atexit.register(_flush_pending)
 
 
 class CbKeyStore(UserDict):
@@ -32,24 +77,64 @@ class CbKeyStore(UserDict):
     If no ``password`` argument is passed, the key store will not encrypt its serialized
     representation within the file.
 
-    .. warning::
+    Encrypted key stores use one of two layouts, selected by the ``layout`` argument or the
+    ``KEY_STORE_LAYOUT`` setting:
+
+    * ``file`` encrypts the serialized key store as a whole
+      (cf. :py:class:`~controlbeast.keystore.crypto.CbKsCrypto`).
+    * ``entries`` encrypts each entry on its own (cf. :py:class:`~controlbeast.keystore.entries.CbKsEntries`).
+      Opening the key store only reads the index of keys; values are decrypted on first access, and
+      writing only encrypts the entries which have been updated. This layout suits large key stores,
+      but requires libcrypto to be available.
 
-       The synchronisation behaviour of this key store class is mostly unidirectional, meaning
-       it will take into account the file backend's content only at the moment when the key store
-       object is created. If the backend file is changed by any other means (a second key store
-       object, an external text editor, ...), the key store will not take into account these
-       changes, but overwrite them with the next update on its own data.
+    Existing files written in the per-entry layout are always opened using it. Files written in the
+    ``file`` layout are converted when written, if the ``entries`` layout is selected.
 
-       Therefore, it is highly recommended to
+    Key stores with a file name extension listed in the ``KEY_STORE_SQLITE_EXTENSIONS`` setting, or
+    created using the ``sqlite`` layout, are kept within an SQLite database, encrypted or not
+    (cf. :py:class:`~controlbeast.keystore.sqlite.CbKsSQLite`). Opening such a key store only reads
+    its keys, and writing only updates the entries which have been updated or deleted. This suits
+    key stores with thousands of entries.
 
-       * never create two key store objects operating on the same file
-       * use key store objects in an environment preponderantly using read-only access
-       * when using key store objects in :py:mod:`multiprocessing` or :py:mod:`threading` environments,
-         implement appropriate synchronisation mechanisms (although this will not protect from completely
-         external changes to the backend file)
+    Every update is synchronised into the file immediately. To apply several updates at the cost
+    of one synchronisation, use :py:meth:`update` or group them within a :py:meth:`transaction`::
+
+       with keystore.transaction():
+           keystore['stage'] = STAGE_INSTALLED
+           keystore['installed'] = timestamp
+
+    If a ``write_behind`` window (in seconds) is set, updates are not written at once. Instead, the first
+    update starts the window, and all updates applied until it ends are written at once. Deferred updates
+    are also written by :py:meth:`flush`, when the key store object is destroyed and when the interpreter
+    exits. The default window is taken from the ``KEY_STORE_WRITE_BEHIND`` setting.
+
+    Several key store objects, also within different processes, may operate on the same file. Every write
+    is executed while holding an exclusive advisory lock (:py:func:`fcntl.flock`) on the directory containing
+    the file. Before writing, the key store checks whether the file has been changed since it has been read
+    or written by this object, comparing modification time, size and inode. If so, the file is read again
+    and the updates applied by this object are merged into its content, instead of overwriting it. Updates
+    of different keys therefore never get lost; for updates of the same key, the last write wins. Changes
+    can also be taken into account without writing by calling :py:meth:`reload`.
+
+    Binary data, such as host keys, certificates or disk images, are not kept within the key store itself,
+    but attached using :py:meth:`attach`. Each attachment is stored within a separate file in the directory
+    named by the ``KEY_STORE_ATTACHMENT_DIR`` setting next to the key store file, encrypted on its own if the
+    key store is encrypted (cf. :py:class:`~controlbeast.keystore.attachment.CbKsAttachments`). The key store
+    entry holds a reference to the attachment, whose content is read by :py:meth:`attachment`::
+
+       keystore.attach('ssh_host_key', '/etc/ssh/ssh_host_ed25519_key')
+       keystore.extract('ssh_host_key', '/tmp/ssh_host_ed25519_key')
+
+    .. warning::
+
+       Key store objects only take into account changes of the backend file when writing or when
+       :py:meth:`reload` is called. Between those, reading from a key store object may return data
+       which have been changed in the meantime by other key store objects or external means.
 
     :param str file:        path to file already containing or intended to contain the key store
     :param str passphrase:  Passphrase to derive the key from, if key store should be encrypted
+    :param float write_behind: time window in seconds within which updates are coalesced into one write
+    :param str layout:      layout of the key store, either ``file``, ``entries`` or ``sqlite``
     """
 
     #: flag signalizing whether this store is temporary or not
@@ -58,10 +143,34 @@ class CbKeyStore(UserDict):
     #: flag signalizing whether this store is read-only or not
     _read_only = False
 
-    def __init__(self, file='', passphrase='', dict=None, **kwargs):
+    #: store holding the attachments
+    _attachments = None
+
+    def __init__(self, file='', passphrase='', dict=None, write_behind=None, layout=None, **kwargs):
         """
         Key store constructor
         """
+        # stack of undo logs, one per open transaction
+        self._transactions = []
+
+        # flag signalizing whether updates have been deferred by an open transaction or the write-behind window
+        self._dirty = False
+
+        # updates not yet written into the backend, to be merged into changed backend content
+        self._changes = {}
+
+        # modification time, size and inode of the backend file when last read or written
+        self._signature = None
+
+        # write-behind window and the timer ending it
+        if write_behind is None:
+            write_behind = get_conf('KEY_STORE_WRITE_BEHIND')
+        self._write_behind = write_behind or 0
+        self._timer = None
+
+        # lock serialising updates with writes triggered by the write-behind timer
+        self._lock = threading.RLock()
+
         if file:
             self._file = file
             self._tmp = False
@@ -69,31 +178,31 @@ class CbKeyStore(UserDict):
             fp, self._file = tempfile.mkstemp()
             os.close(fp)
             self._tmp = True
-        if passphrase:
+        self._passphrase = passphrase
+        if layout is None:
+            layout = get_conf('KEY_STORE_LAYOUT')
+        if layout == 'sqlite' or CbKsSQLite.detect(self._file) or \
+                os.path.splitext(self._file)[1] in get_conf('KEY_STORE_SQLITE_EXTENSIONS'):
+            self._backend = CbKsSQLite(file=self._file, passphrase=passphrase)
+        elif passphrase and (CbKsEntries.detect(self._file) or (layout == 'entries' and cipher.is_available())):
+            self._backend = CbKsEntries(file=self._file, passphrase=passphrase)
+        elif passphrase:
             self._backend = CbKsCrypto(file=self._file, passphrase=passphrase)
         else:
             self._backend = CbKsPlain(file=self._file)
 
         self._read_only = self._backend.read_only
 
-        if self._backend.plaintext:
-            try:
-                data = yaml.safe_load(self._backend.plaintext)
-            except yaml.YAMLError:
-                self._read_only = True
-                data = {}
-        else:
-            data = {}
-
-        # Illegal read, e. g. due to a wrong / invalid password
-        if self._backend.return_code != os.EX_OK:
-            if 'bad decrypt' in self._backend.stderr:
-                raise CbKsPasswordError(filename=self._file)
+        super(CbKeyStore, self).__init__()
+        self._signature = self._stat()
+        self.data = self._read()
 
+        initial = {}
         if dict is not None and self._read_only is not True:
-            data.update(dict)
-
-        super(CbKeyStore, self).__init__(dict=data, **kwargs)
+            initial.update(dict)
+        initial.update(kwargs)
+        if initial:
+            self.update(initial)
 
     def __setitem__(self, key, item):
         """
@@ -101,8 +210,11 @@ class CbKeyStore(UserDict):
         backend after executing the data update.
         """
         if not self._read_only:
-            super(CbKeyStore, self).__setitem__(key, item)
-            self._sync()
+            with self._lock:
+                self._record(key)
+                super(CbKeyStore, self).__setitem__(key, item)
+                self._changes[key] = item
+                self._sync()
         else:
             raise TypeError("This key store is read-only.")
 
@@ -112,8 +224,12 @@ class CbKeyStore(UserDict):
         backend after executing the data update.
         """
         if not self._read_only:
-            super(CbKeyStore, self).__delitem__(key)
-            self._sync()
+            with self._lock:
+                if key in self.data:
+                    self._record(key)
+                super(CbKeyStore, self).__delitem__(key)
+                self._changes[key] = _MISSING
+                self._sync()
         else:
             raise TypeError("This key store is read-only.")
 
@@ -122,18 +238,248 @@ class CbKeyStore(UserDict):
         Clean up when object gets de-referenced
         """
         if self._tmp:
+            if self._timer is not None:
+                self._timer.cancel()
+            if isinstance(getattr(self, '_backend', None), CbKsSQLite):
+                self._backend.close()
             os.unlink(self._file)
+            if self._attachments is not None:
+                shutil.rmtree(self._attachments.path, ignore_errors=True)
+        else:
+            self.flush()
+
+    def _read(self, reload=False):
+        """
+        Read the key store content from the backend.
+
+        :param bool reload: ``True`` if the backend is to be read again, ``False`` if the backend's
+                            buffered plaintext may be used
+        :return:            dictionary holding the key store content
+        :rtype:             dict
+        """
+        if isinstance(self._backend, CbKsEntries):
+            try:
+                return self._backend.load()
+            except CbKsPasswordError:
+                raise CbKsPasswordError(filename=self._file)
+            except (yaml.YAMLError, sqlite3.DatabaseError):
+                self._read_only = True
+                return {}
+        if reload:
+            return self._load(self._backend.reload())
+        return self._load(self._backend.plaintext)
+
+    def _load(self, plaintext):
+        """
+        Parse the plaintext read from the backend.
+
+        If the plaintext cannot be parsed, the key store becomes read-only in order to preventing
+        the file content being destroyed by mistakenly using it as a key store backend file.
+
+        :param str plaintext:   plaintext as read from the backend
+        :return:                dictionary represented by the plaintext
+        :rtype:                 dict
+        """
+        # Illegal read, e. g. due to a wrong / invalid password
+        if self._backend.return_code != os.EX_OK:
+            if 'bad decrypt' in self._backend.stderr:
+                raise CbKsPasswordError(filename=self._file)
+        if not plaintext:
+            return {}
+        try:
+            return safe_load(plaintext)
+        except yaml.YAMLError:
+            self._read_only = True
+            return {}
+
+    def _stat(self):
+        """
+        Get the signature of the backend file, consisting of modification time, size and inode, or of the
+        SQLite database content version.
+
+        :return:    signature tuple, or ``None`` if the file does not exist
+        :rtype:     tuple
+        """
+        if isinstance(self._backend, CbKsSQLite):
+            # updates of an SQLite database are not reflected by the file's modification time
+            return self._backend.signature()
+        try:
+            status = os.stat(self._file)
+        except FileNotFoundError:
+            return None
+        return status.st_mtime_ns, status.st_size, status.st_ino
+
+    @contextmanager
+    def _locked(self):
+        """
+        Context manager holding an exclusive advisory lock on the directory containing the backend file.
+        The lock is shared by all key store objects, also in other processes, operating on that directory.
+        """
+        fd = os.open(os.path.dirname(os.path.abspath(self._file)), os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            # closing the file descriptor releases the lock
+            os.close(fd)
+
+    def _merge(self):
+        """
+        Read the backend file again and apply the updates not yet written on top of its content
+        """
+        read_only = self._read_only
+        data = self._read(reload=True)
+        if self._read_only and not read_only:
+            raise TypeError("This key store is read-only.")
+        for key, value in self._changes.items():
+            if value is _MISSING:
+                data.pop(key, None)
+            else:
+                data[key] = value
+        self.data = data
+
+    def _record(self, key):
+        """
+        Remember the current value and pending change of ``key`` in the undo log of the innermost
+        open transaction, unless they have already been recorded there.
+
+        :param key: key about to be modified
+        """
+        if self._transactions and key not in self._transactions[-1]:
+            self._transactions[-1][key] = (self.data.get(key, _MISSING), self._changes.get(key, _UNCHANGED))
+
+    def _rollback(self, undo):
+        """
+        Restore the values and pending changes recorded in an undo log.
+
+        :param dict undo: undo log of the transaction to be rolled back
+        """
+        for key, (value, change) in undo.items():
+            if value is _MISSING:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = value
+            if change is _UNCHANGED:
+                self._changes.pop(key, None)
+            else:
+                self._changes[key] = change
 
     def _sync(self):
         """
         Synchronize current data into the backend. This method is called every time the data stored in
-        this key store are modified.
+        this key store are modified. While a transaction is open, the synchronisation is deferred until
+        the outermost transaction is committed. If a write-behind window is set, the synchronisation is
+        deferred until the window ends.
         """
         if not self._read_only:
-            self._backend.plaintext = yaml.dump(self.data, default_flow_style=False)
+            if self._transactions:
+                self._dirty = True
+            elif self._write_behind > 0:
+                self._dirty = True
+                self._schedule()
+            else:
+                self._write()
         else:
             raise TypeError("This key store is read-only.")
 
+    def _schedule(self):
+        """
+        Start the write-behind window, unless it has already been started
+        """
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Timer(self._write_behind, _flush_reference, args=(weakref.ref(self),))
+                self._timer.daemon = True
+                self._timer.start()
+                _pending[id(self)] = weakref.ref(self)
+
+    def _write(self):
+        """
+        Serialise the current data and write them into the backend. If the backend file has been changed
+        since it has been read or written by this object, its content is merged before.
+        """
+        with self._lock, self._locked():
+            if self._stat() != self._signature:
+                self._merge()
+            if isinstance(self._backend, CbKsEntries):
+                self._backend.store(self.data)
+            else:
+                self._backend.plaintext = safe_dump(self.data)
+            self._signature = self._stat()
+            self._changes.clear()
+            self._dirty = False
+
+    def reload(self):
+        """
+        Take into account changes of the backend file.
+
+        If the backend file has been changed since it has been read or written by this object, it is
+        read again. Updates applied to this object but not written yet are merged into its content.
+
+        :return:    ``True`` if the backend file has been read again, ``False`` if not
+        :rtype:     bool
+        """
+        with self._lock, self._locked():
+            if self._stat() == self._signature:
+                return False
+            self._merge()
+            self._signature = self._stat()
+            return True
+
+    def flush(self):
+        """
+        Write deferred updates into the backend immediately.
+
+        Updates deferred by an open transaction are not written; they will be written
+        when the transaction is committed.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            _pending.pop(id(self), None)
+            if self._dirty and not self._transactions and not self._read_only:
+                self._write()
+
+    def update(self, *args, **kwargs):
+        """
+        Overrides default ``update`` method. Functionality is identical, except all data are synced to the
+        backend at once after executing the data update.
+        """
+        with self.transaction():
+            super(CbKeyStore, self).update(*args, **kwargs)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager grouping several updates into one synchronisation.
+
+        All updates applied within the ``with`` block are synced to the backend when the block is left.
+        If the block is left by an exception, all updates applied within the block are rolled back and
+        nothing is synced. Transactions can be nested; only the outermost transaction syncs the data.
+        """
+        if self._read_only:
+            raise TypeError("This key store is read-only.")
+        undo = {}
+        # updates deferred by a write-behind window before the transaction must still be written after a rollback
+        dirty = self._dirty
+        self._transactions.append(undo)
+        try:
+            yield self
+        except BaseException:
+            self._transactions.pop()
+            self._rollback(undo)
+            if not self._transactions:
+                self._dirty = dirty
+            raise
+        self._transactions.pop()
+        if self._transactions:
+            # hand over the undo log to the enclosing transaction, keeping its older values
+            for key, value in undo.items():
+                self._transactions[-1].setdefault(key, value)
+        elif self._dirty:
+            self._sync()
+
     @property
     def read_only(self):
         """
@@ -152,3 +498,79 @@ class CbKeyStore(UserDict):
         Path of the file used as backend
         """
         return self._file
+
+    @property
+    def attachments(self):
+        """
+        Store holding the attachments of this key store
+        """
+        if self._attachments is None:
+            if self._tmp:
+                path = self._file + '.' + get_conf('KEY_STORE_ATTACHMENT_DIR')
+            else:
+                path = os.path.join(os.path.dirname(os.path.abspath(self._file)), get_conf('KEY_STORE_ATTACHMENT_DIR'))
+            self._attachments = CbKsAttachments(path, self._passphrase)
+        return self._attachments
+
+    def _reference(self, key):
+        """
+        Get the reference to an attachment.
+
+        :param key: key of the entry referencing the attachment
+        :return:    reference to the attachment
+        :rtype:     dict
+        """
+        reference = self[key]
+        if not is_reference(reference):
+            raise TypeError("Entry {} does not reference an attachment.".format(key))
+        return reference
+
+    def attach(self, key, source):
+        """
+        Store an attachment, and reference it by an entry of this key store.
+
+        The attachment is read in chunks, so it is never loaded into memory as a whole. Attachments
+        with the same content are only stored once.
+
+        :param key:     key of the entry referencing the attachment
+        :param source:  path of the file to be attached, or binary file object to read the attachment from
+        :return:        reference to the attachment
+        :rtype:         dict
+        """
+        if self._read_only:
+            raise TypeError("This key store is read-only.")
+        reference = self.attachments.put(source)
+        self[key] = reference
+        return reference
+
+    def attachment(self, key):
+        """
+        Read an attachment referenced by an entry of this key store.
+
+        :param key: key of the entry referencing the attachment
+        :return:    generator yielding the attachment's content in chunks
+        """
+        return self.attachments.get(self._reference(key))
+
+    def extract(self, key, destination):
+        """
+        Write an attachment referenced by an entry of this key store into a file.
+
+        :param key:         key of the entry referencing the attachment
+        :param destination: path of the file to be written, or binary file object to write the attachment to
+        """
+        self.attachments.extract(self._reference(key), destination)
+
+    def purge_attachments(self):
+        """
+        Delete all attachments not referenced by any entry of this key store.
+
+        .. warning::
+
+           Attachments are shared by all key stores within the same directory. Do not purge attachments
+           if other key stores reside within the directory of this key store.
+
+        :return:    number of attachments deleted
+        :rtype:     int
+        """
+        return self.attachments.purge([value for value in self.data.values() if is_reference(value)])
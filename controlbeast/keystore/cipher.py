@@ -0,0 +1,517 @@
+# -*- coding: utf-8 -*-
+"""
+    controlbeast.keystore.cipher
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import base64
+import ctypes
+import ctypes.util
+import hashlib
+import hmac
+import os
+import threading
+from controlbeast.conf import get_conf
+from controlbeast.keystore.exception import CbKsPasswordError
+from controlbeast.utils.singleton import CbSingleton
+
+
+#: Magic prefix of the ciphertext produced by ``openssl enc -salt``
+OPENSSL_MAGIC = b'Salted__'
+
+#: Length of the salt used by ``openssl enc``
+OPENSSL_SALT_LENGTH = 8
+
+#: Message digests tried for key derivation, in order. OpenSSL >= 1.1.0 uses SHA-256, older releases MD5.
+OPENSSL_DIGESTS = ('sha256', 'md5')
+
+#: Line length of the base64 encoding produced by ``openssl enc -a``
+OPENSSL_BASE64_LINE = 64
+
+#: AES block size in bytes
+AES_BLOCK_SIZE = 16
+
+#: AES-256 key length in bytes
+AES_KEY_LENGTH = 32
+
+#: Magic prefix of the ControlBeast key store format
+CBKS_MAGIC = b'CbKs'
+
+#: Version of the ControlBeast key store format written
+CBKS_VERSION = 2
+
+#: Length of the salt used by the ControlBeast key store format
+CBKS_SALT_LENGTH = 16
+
+#: Length of the HMAC-SHA256 authentication tag used by the ControlBeast key store format
+CBKS_TAG_LENGTH = 32
+
+#: Key derivation functions supported by the ControlBeast key store format
+CBKS_KDFS = ('pbkdf2-sha256', 'scrypt')
+
+#: Parameters required by each key derivation function
+CBKS_KDF_PARAMS = {'pbkdf2-sha256': ('i', ), 'scrypt': ('n', 'p', 'r')}
+
+#: Maximum number of PBKDF2 iterations accepted
+CBKS_PBKDF2_MAX_ITERATIONS = 10 ** 7
+
+#: Maximum amount of memory in bytes scrypt may be told to use, also bounding its CPU cost
+CBKS_SCRYPT_MAX_MEMORY = 1 << 30
+
+#: Keys derived during this session, indexed by passphrase, key derivation function, parameters and salt
+_key_cache = {}
+
+#: Lock protecting the key cache
+_key_cache_lock = threading.Lock()
+
+
+@CbSingleton
+class CbLibCrypto():
+    """
+    Class acting as wrapper for the EVP cipher interface of OpenSSL's libcrypto library.
+
+    Unlike :py:class:`~controlbeast.ssh.api.CbSSHLib`, this wrapper does not raise an exception if the library
+    cannot be loaded, since callers are expected to fall back to the ``openssl`` command line utility. Use the
+    :py:attr:`available` property to find out whether in-process cryptography can be used.
+
+    This wrapper class is implemented following the singleton pattern. Therefore,
+    in order to getting a reference to the library, the
+    :py:meth:`~controlbeast.utils.singleton.CbSingleton.get_instance` method has to be used.
+
+    Example::
+
+       crypto_lib = CbLibCrypto.get_instance()
+    """
+
+    #: libcrypto library reference
+    _libcrypto = None
+
+    def __init__(self):
+        library_path = ctypes.util.find_library('crypto')
+        if not library_path:
+            return
+        try:
+            library = ctypes.CDLL(library_path)
+            library.EVP_CIPHER_CTX_new.argtypes = []
+            library.EVP_CIPHER_CTX_new.restype = ctypes.c_void_p
+            library.EVP_CIPHER_CTX_free.argtypes = [ctypes.c_void_p]
+            library.EVP_CIPHER_CTX_free.restype = None
+            library.EVP_aes_256_cbc.argtypes = []
+            library.EVP_aes_256_cbc.restype = ctypes.c_void_p
+            library.EVP_CipherInit_ex.argtypes = [
+                ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int
+            ]
+            library.EVP_CipherInit_ex.restype = ctypes.c_int
+            library.EVP_CipherUpdate.argtypes = [
+                ctypes.c_void_p, ctypes.c_char_p, ctypes.POINTER(ctypes.c_int), ctypes.c_char_p, ctypes.c_int
+            ]
+            library.EVP_CipherUpdate.restype = ctypes.c_int
+            library.EVP_CipherFinal_ex.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.POINTER(ctypes.c_int)]
+            library.EVP_CipherFinal_ex.restype = ctypes.c_int
+        except (AttributeError, OSError):
+            return
+        self._libcrypto = library
+
+    @property
+    def available(self):
+        """
+        Boolean indicating whether libcrypto could be loaded
+        """
+        return self._libcrypto is not None
+
+    def cipher_ctx_new(self):
+        return self._libcrypto.EVP_CIPHER_CTX_new()
+
+    def cipher_ctx_free(self, ctx):
+        self._libcrypto.EVP_CIPHER_CTX_free(ctx)
+
+    def cipher_init(self, ctx, key, iv, encrypt):
+        return self._libcrypto.EVP_CipherInit_ex(ctx, self._libcrypto.EVP_aes_256_cbc(), None, key, iv, int(encrypt))
+
+    def cipher_update(self, ctx, data):
+        buffer = ctypes.create_string_buffer(len(data) + AES_BLOCK_SIZE)
+        length = ctypes.c_int(0)
+        if not self._libcrypto.EVP_CipherUpdate(ctx, buffer, ctypes.byref(length), data, len(data)):
+            return None
+        return buffer.raw[:length.value]
+
+    def cipher_final(self, ctx):
+        buffer = ctypes.create_string_buffer(AES_BLOCK_SIZE)
+        length = ctypes.c_int(0)
+        if not self._libcrypto.EVP_CipherFinal_ex(ctx, buffer, ctypes.byref(length)):
+            return None
+        return buffer.raw[:length.value]
+
+
+class CbCipherContext(object):
+    """
+    AES-256-CBC cipher context operating in process via libcrypto.
+
+    A context can be fed incrementally with :py:meth:`update`, which allows de- or encrypting
+    data streams chunk by chunk. PKCS#7 padding is applied (encryption) or verified (decryption)
+    by :py:meth:`finalize`. Example::
+
+       ctx = CbCipherContext(key, iv, encrypt=True)
+       ciphertext = ctx.update(b'My very secret content') + ctx.finalize()
+
+    :param bytes key:      32 byte AES key
+    :param bytes iv:       16 byte initialisation vector
+    :param bool encrypt:   ``True`` for encryption, ``False`` for decryption
+    """
+
+    def __init__(self, key, iv, encrypt=True):
+        self._lib = CbLibCrypto.get_instance()
+        self._ctx = self._lib.cipher_ctx_new()
+        if not self._ctx:
+            raise MemoryError('Cannot allocate cipher context.')
+        if not self._lib.cipher_init(self._ctx, key, iv, encrypt):
+            self._free()
+            raise ValueError('Cannot initialise cipher context.')
+
+    def __del__(self):
+        self._free()
+
+    def _free(self):
+        """
+        Release the underlying libcrypto cipher context
+        """
+        if getattr(self, '_ctx', None):
+            self._lib.cipher_ctx_free(self._ctx)
+            self._ctx = None
+
+    def update(self, data):
+        """
+        Feed data into the cipher context.
+
+        :param bytes data:  chunk of plaintext (encryption) or ciphertext (decryption)
+        :return:            processed data available so far
+        :rtype:             bytes
+        """
+        result = self._lib.cipher_update(self._ctx, data)
+        if result is None:
+            raise ValueError('Cipher operation failed.')
+        return result
+
+    def finalize(self):
+        """
+        Finish the cipher operation and release the context.
+
+        :return:            remaining processed data
+        :rtype:             bytes
+        :raises CbKsPasswordError: if the padding of the decrypted data is invalid, which usually
+                                   means a wrong passphrase has been used
+        """
+        result = self._lib.cipher_final(self._ctx)
+        self._free()
+        if result is None:
+            raise CbKsPasswordError()
+        return result
+
+
+def is_available():
+    """
+    Check whether in-process cryptography is available.
+
+    :return:    ``True`` if libcrypto could be loaded, ``False`` if not
+    :rtype:     bool
+    """
+    return CbLibCrypto.get_instance().available
+
+
+def bytes_to_key(passphrase, salt, digest='sha256'):
+    """
+    Derive key and IV from a passphrase the way ``openssl enc`` does (``EVP_BytesToKey`` with one iteration).
+
+    :param bytes passphrase:    passphrase to derive the key from
+    :param bytes salt:          salt read from or to be written into the ciphertext header
+    :param str digest:          name of the message digest to be used
+    :return:                    tuple of key and initialisation vector
+    :rtype:                     tuple
+    """
+    result = b''
+    block = b''
+    while len(result) < AES_KEY_LENGTH + AES_BLOCK_SIZE:
+        block = hashlib.new(digest, block + passphrase + salt).digest()
+        result += block
+    return result[:AES_KEY_LENGTH], result[AES_KEY_LENGTH:AES_KEY_LENGTH + AES_BLOCK_SIZE]
+
+
+def openssl_encrypt(plaintext, passphrase, digest=OPENSSL_DIGESTS[0]):
+    """
+    Encrypt data into the format written by ``openssl enc -aes-256-cbc -a -salt``.
+
+    :param bytes plaintext:     data to be encrypted
+    :param bytes passphrase:    passphrase to derive the key from
+    :param str digest:          name of the message digest used for key derivation
+    :return:                    base64 encoded ciphertext, wrapped at 64 characters per line
+    :rtype:                     bytes
+    """
+    salt = os.urandom(OPENSSL_SALT_LENGTH)
+    key, iv = bytes_to_key(passphrase, salt, digest)
+    ctx = CbCipherContext(key, iv, encrypt=True)
+    encoded = base64.b64encode(OPENSSL_MAGIC + salt + ctx.update(plaintext) + ctx.finalize())
+    return b''.join(
+        encoded[i:i + OPENSSL_BASE64_LINE] + b'\n' for i in range(0, len(encoded), OPENSSL_BASE64_LINE)
+    )
+
+
+def openssl_decrypt(ciphertext, passphrase):
+    """
+    Decrypt data written by ``openssl enc -aes-256-cbc -a -salt``.
+
+    Since the message digest used for key derivation is not recorded in the ciphertext, all digests
+    listed in :py:data:`OPENSSL_DIGESTS` are tried in order.
+
+    :param bytes ciphertext:    base64 encoded ciphertext
+    :param bytes passphrase:    passphrase to derive the key from
+    :return:                    decrypted data
+    :rtype:                     bytes
+    :raises CbKsPasswordError:  if the data cannot be decrypted using the passphrase
+    """
+    try:
+        raw = base64.b64decode(b''.join(ciphertext.split()), validate=True)
+    except ValueError:
+        raise CbKsPasswordError()
+    header_length = len(OPENSSL_MAGIC) + OPENSSL_SALT_LENGTH
+    if raw[:len(OPENSSL_MAGIC)] != OPENSSL_MAGIC or (len(raw) - header_length) % AES_BLOCK_SIZE:
+        raise CbKsPasswordError()
+    salt = raw[len(OPENSSL_MAGIC):header_length]
+    for digest in OPENSSL_DIGESTS:
+        key, iv = bytes_to_key(passphrase, salt, digest)
+        ctx = CbCipherContext(key, iv, encrypt=False)
+        try:
+            return ctx.update(raw[header_length:]) + ctx.finalize()
+        except CbKsPasswordError:
+            continue
+    raise CbKsPasswordError()
+
+
+def default_kdf():
+    """
+    Get the key derivation function and its parameters as configured.
+
+    :return:    tuple of the key derivation function's name and a dictionary of its parameters
+    :rtype:     tuple
+    """
+    kdf = get_conf('KEY_STORE_KDF')
+    if kdf == 'scrypt':
+        return kdf, {
+            'n': get_conf('KEY_STORE_SCRYPT_N'),
+            'r': get_conf('KEY_STORE_SCRYPT_R'),
+            'p': get_conf('KEY_STORE_SCRYPT_P'),
+        }
+    return kdf, {'i': get_conf('KEY_STORE_PBKDF2_ITERATIONS')}
+
+
+def derive_key(passphrase, kdf, params, salt):
+    """
+    Derive the encryption and authentication keys from a passphrase.
+
+    Derived keys are cached for the lifetime of the process, so repeated crypto operations
+    on the same key store only pay for key derivation once.
+
+    :param bytes passphrase:    passphrase to derive the keys from
+    :param str kdf:             name of the key derivation function, one of :py:data:`CBKS_KDFS`
+    :param dict params:         parameters of the key derivation function
+    :param bytes salt:          salt read from or to be written into the ciphertext header
+    :return:                    tuple of encryption key and authentication key
+    :rtype:                     tuple
+    :raises ValueError:         if the key derivation function is not supported, or its parameters are invalid
+    """
+    check_params(kdf, params)
+    index = (passphrase, kdf, tuple(sorted(params.items())), salt)
+    with _key_cache_lock:
+        if index in _key_cache:
+            return _key_cache[index]
+    length = AES_KEY_LENGTH + CBKS_TAG_LENGTH
+    if kdf == 'pbkdf2-sha256':
+        key = hashlib.pbkdf2_hmac('sha256', passphrase, salt, params['i'], length)
+    elif kdf == 'scrypt' and hasattr(hashlib, 'scrypt'):
+        key = hashlib.scrypt(
+            passphrase, salt=salt, n=params['n'], r=params['r'], p=params['p'], dklen=length,
+            maxmem=256 * params['n'] * params['r'] * params['p']
+        )
+    else:
+        raise ValueError('Unsupported key derivation function {}.'.format(kdf))
+    result = key[:AES_KEY_LENGTH], key[AES_KEY_LENGTH:]
+    with _key_cache_lock:
+        _key_cache[index] = result
+    return result
+
+
+def clear_key_cache():
+    """
+    Forget all keys derived during this session
+    """
+    with _key_cache_lock:
+        _key_cache.clear()
+
+
+def format_params(params):
+    """
+    Format the parameters of a key derivation function the way they are written into a ciphertext header.
+
+    :param dict params: parameters of the key derivation function
+    :return:            formatted parameters, e. g. ``i=200000``
+    :rtype:             bytes
+    """
+    return ','.join('{}={}'.format(name, value) for name, value in sorted(params.items())).encode()
+
+
+def check_params(kdf, params):
+    """
+    Check the parameters of a key derivation function.
+
+    Exactly the parameters required by the key derivation function have to be given, and they must not
+    exceed the bounds defined by :py:data:`CBKS_PBKDF2_MAX_ITERATIONS` and :py:data:`CBKS_SCRYPT_MAX_MEMORY`,
+    so a forged ciphertext header cannot make key derivation fail or exhaust the system's resources.
+
+    :param str kdf:     name of the key derivation function, one of :py:data:`CBKS_KDFS`
+    :param dict params: parameters of the key derivation function
+    :raises ValueError: if the key derivation function is not supported, or its parameters are invalid
+    """
+    if kdf not in CBKS_KDF_PARAMS:
+        raise ValueError('Unsupported key derivation function {}.'.format(kdf))
+    if sorted(params) != list(CBKS_KDF_PARAMS[kdf]) or any(value < 1 for value in params.values()):
+        raise ValueError('Invalid parameters for key derivation function {}.'.format(kdf))
+    if kdf == 'pbkdf2-sha256' and params['i'] > CBKS_PBKDF2_MAX_ITERATIONS:
+        raise ValueError('Too many PBKDF2 iterations.')
+    if kdf == 'scrypt':
+        if params['n'] < 2 or params['n'] & (params['n'] - 1):
+            raise ValueError('scrypt cost parameter must be a power of 2.')
+        if 128 * params['n'] * params['r'] * params['p'] > CBKS_SCRYPT_MAX_MEMORY:
+            raise ValueError('scrypt parameters exceed the memory limit.')
+
+
+def parse_params(value, kdf):
+    """
+    Parse the parameters of a key derivation function read from a ciphertext header.
+
+    :param bytes value: formatted parameters as returned by :py:func:`format_params`
+    :param str kdf:     name of the key derivation function the parameters belong to
+    :return:            parameters of the key derivation function
+    :rtype:             dict
+    :raises ValueError: if the parameters cannot be parsed, or are invalid (cf. :py:func:`check_params`)
+    """
+    params = dict(
+        (name.decode(), int(number)) for name, number in (item.split(b'=') for item in value.split(b','))
+    )
+    check_params(kdf, params)
+    return params
+
+
+def seal(plaintext, key, mac_key, associated=b''):
+    """
+    Encrypt data using AES-256-CBC with a random initialisation vector, and authenticate it using HMAC-SHA256.
+
+    :param bytes plaintext:     data to be encrypted
+    :param bytes key:           encryption key
+    :param bytes mac_key:       authentication key
+    :param bytes associated:    additional data covered by the authentication tag, but not encrypted
+    :return:                    initialisation vector, ciphertext and authentication tag
+    :rtype:                     bytes
+    """
+    iv = os.urandom(AES_BLOCK_SIZE)
+    ctx = CbCipherContext(key, iv, encrypt=True)
+    body = iv + ctx.update(plaintext) + ctx.finalize()
+    return body + hmac.new(mac_key, associated + body, hashlib.sha256).digest()
+
+
+def unseal(sealed, key, mac_key, associated=b''):
+    """
+    Verify and decrypt data encrypted by :py:func:`seal`.
+
+    :param bytes sealed:        initialisation vector, ciphertext and authentication tag
+    :param bytes key:           encryption key
+    :param bytes mac_key:       authentication key
+    :param bytes associated:    additional data covered by the authentication tag
+    :return:                    decrypted data
+    :rtype:                     bytes
+    :raises CbKsPasswordError:  if the authentication tag does not match, i. e. a wrong key has been used,
+                                or the data have been tampered with
+    """
+    body, tag = sealed[:-CBKS_TAG_LENGTH], sealed[-CBKS_TAG_LENGTH:]
+    if len(body) < 2 * AES_BLOCK_SIZE or len(body) % AES_BLOCK_SIZE:
+        raise CbKsPasswordError()
+    if not hmac.compare_digest(hmac.new(mac_key, associated + body, hashlib.sha256).digest(), tag):
+        raise CbKsPasswordError()
+    ctx = CbCipherContext(key, body[:AES_BLOCK_SIZE], encrypt=False)
+    return ctx.update(body[AES_BLOCK_SIZE:]) + ctx.finalize()
+
+
+def parse_header(ciphertext):
+    """
+    Parse the header of a ciphertext in the ControlBeast key store format.
+
+    :param bytes ciphertext:    ciphertext as written by :py:func:`encrypt`
+    :return:                    tuple of key derivation function, its parameters and the salt, or ``None``
+                                if the ciphertext is not in the ControlBeast key store format
+    :rtype:                     tuple
+    """
+    if not ciphertext.startswith(CBKS_MAGIC + b' '):
+        return None
+    try:
+        magic, version, kdf, params, salt = ciphertext.split(b'\n', 1)[0].split(b' ')
+        if int(version) != CBKS_VERSION or kdf.decode() not in CBKS_KDFS:
+            return None
+        return kdf.decode(), parse_params(params, kdf.decode()), base64.b64decode(salt, validate=True)
+    except ValueError:
+        return None
+
+
+def encrypt(plaintext, passphrase, kdf=None, params=None, salt=None):
+    """
+    Encrypt data into the ControlBeast key store format.
+
+    The format consists of one header line naming the format version, the key derivation function,
+    its parameters and the salt, followed by the base64 encoded initialisation vector, the AES-256-CBC
+    ciphertext and an HMAC-SHA256 tag authenticating header and ciphertext, wrapped at 64 characters per line.
+
+    :param bytes plaintext:     data to be encrypted
+    :param bytes passphrase:    passphrase to derive the keys from
+    :param str kdf:             name of the key derivation function. Defaults to ``KEY_STORE_KDF``.
+    :param dict params:         parameters of the key derivation function. Default to the configured ones.
+    :param bytes salt:          salt for key derivation. Reusing the salt of a key store's previous ciphertext
+                                allows the derived keys to be taken from the cache; a new salt is generated
+                                if not specified.
+    :return:                    ciphertext
+    :rtype:                     bytes
+    """
+    if kdf is None or params is None:
+        kdf, params = default_kdf()
+    if salt is None:
+        salt = os.urandom(CBKS_SALT_LENGTH)
+    key, mac_key = derive_key(passphrase, kdf, params, salt)
+    header = b' '.join([
+        CBKS_MAGIC, str(CBKS_VERSION).encode(), kdf.encode(), format_params(params), base64.b64encode(salt)
+    ]) + b'\n'
+    encoded = base64.b64encode(seal(plaintext, key, mac_key, associated=header))
+    return header + b''.join(
+        encoded[i:i + OPENSSL_BASE64_LINE] + b'\n' for i in range(0, len(encoded), OPENSSL_BASE64_LINE)
+    )
+
+
+def decrypt(ciphertext, passphrase):
+    """
+    Decrypt data written either in the ControlBeast key store format by :py:func:`encrypt`, or
+    by ``openssl enc -aes-256-cbc -a -salt``.
+
+    :param bytes ciphertext:    ciphertext
+    :param bytes passphrase:    passphrase to derive the keys from
+    :return:                    decrypted data
+    :rtype:                     bytes
+    :raises CbKsPasswordError:  if the data cannot be decrypted using the passphrase, or has been tampered with
+    """
+    header = parse_header(ciphertext)
+    if header is None:
+        return openssl_decrypt(ciphertext, passphrase)
+    kdf, params, salt = header
+    header_line, encoded = ciphertext.split(b'\n', 1)
+    try:
+        raw = base64.b64decode(b''.join(encoded.split()), validate=True)
+    except ValueError:
+        raise CbKsPasswordError()
+    key, mac_key = derive_key(passphrase, kdf, params, salt)
+    return unseal(raw, key, mac_key, associated=header_line + b'\n')
@@ -6,9 +6,11 @@
     :copyright: Copyright 2013 by the ControlBeast team, see AUTHORS.
     :license: ISC, see LICENSE for details.
 """
+import asyncio
 import os
 import shlex
-from controlbeast.keystore.exception import CbKsIOError
+from controlbeast.keystore import cipher
+from controlbeast.keystore.exception import CbKsIOError, CbKsPasswordError, CbKsFormatError
 from controlbeast.utils.binary import CbBinary
 from controlbeast.utils.convert import to_bytes, to_str
 from controlbeast.utils.compat import set_inheritable
@@ -18,8 +20,19 @@ class CbKsCrypto(CbBinary):
     """
     Symmetric de- and encryption backend.
 
+    Whenever OpenSSL's libcrypto can be loaded, the crypto operations are executed in process
+    (cf. :py:mod:`~controlbeast.keystore.cipher`), writing the ControlBeast key store format. It derives
+    the key using the configured key derivation function (``KEY_STORE_KDF``), and authenticates the
+    ciphertext. Derived keys are cached for the session, and the salt of a file is kept when the file is
+    updated, so only the first crypto operation on a file pays for key derivation.
+
+    Files in the legacy ``openssl enc -aes-256-cbc -a -salt`` format can still be read, and are converted
+    into the ControlBeast key store format when updated. If libcrypto cannot be loaded, the ``openssl enc``
+    command line utility is used, which only reads and writes the legacy format.
+
     This crypto handler keeps the ciphertext in a file, while offering to access the plaintext as a property.
-    Updating the plaintext automatically entails updating of the ciphertext in the backend file. Example::
+    Updating the plaintext automatically entails updating of the ciphertext in the backend file. The file is
+    replaced atomically, so a crash while writing never leaves a truncated ciphertext behind. Example::
 
        # set up an encrypted file store
        crypto = CbKsCrypto('/my/file', 'secret_password')
@@ -53,6 +66,15 @@ class CbKsCrypto(CbBinary):
     #: Flag signalising whether this backend is read-only or not
     _read_only = True
 
+    #: Flag signalising whether crypto operations are executed in process instead of calling openssl
+    _in_process = False
+
+    #: Key derivation function, parameters and salt of the ciphertext last read or written
+    _header = None
+
+    #: Options whose values are not recorded, since they may contain the passphrase
+    _secret_options = ('-pass', '-k')
+
     def __init__(self, file='', passphrase=''):
         if file:
             self._file = os.path.abspath(file)
@@ -61,17 +83,26 @@ class CbKsCrypto(CbBinary):
             self._passphrase = to_bytes(passphrase)
         self._arguments = []
         self._stdin = None
+        self._in_process = self._ciphersuite == 'none' or cipher.is_available()
         super(CbKsCrypto, self).__init__(binary_name='openssl')
 
     def _decrypt(self):
         """
         Execute decryption from source file
         """
-        # Make sure no stdin data is sent when decrypting from a file
         if self._check_access(self._file, os.R_OK):
-            self.stdin = None
-            self._operate(action='d')
-            self._plaintext = self._stdout
+            if self._in_process:
+                self._decrypt_in_process()
+            elif self._ciphersuite != 'none' and self._is_cbks():
+                raise CbKsFormatError(filename=self._file)
+            else:
+                # Make sure no stdin data is sent when decrypting from a file
+                self.stdin = None
+                for digest in cipher.OPENSSL_DIGESTS:
+                    self._operate(action='d', digest=digest)
+                    if self._return_code == os.EX_OK or 'bad decrypt' not in self.stderr:
+                        break
+                self._plaintext = self._stdout
         else:
             self._plaintext = b''
 
@@ -80,13 +111,59 @@ class CbKsCrypto(CbBinary):
         Execute encryption into file
         """
         if not self._read_only:
-            # Make sure stdin data contains plaintext to be encrypted
-            self._stdin = self._plaintext
-            self._operate(action='e')
+            if self._in_process:
+                self._encrypt_in_process()
+            else:
+                # Make sure stdin data contains plaintext to be encrypted
+                self._stdin = self._plaintext
+                self._operate(action='e')
+                if self._return_code == os.EX_OK:
+                    self._write_atomic(self._file, self._stdout)
         else:
             self._decrypt()
 
-    def _operate(self, action):
+    def _decrypt_in_process(self):
+        """
+        Execute decryption from source file without calling openssl.
+
+        The outcome is reported via ``return_code`` and ``stderr`` the same way
+        the openssl command line utility would report it.
+        """
+        with open(self._file, 'rb') as fp:
+            content = fp.read()
+        self._stdout = b''
+        self._stderr = b''
+        self._return_code = os.EX_OK
+        if self._ciphersuite == 'none' or not content:
+            self._plaintext = content
+            return
+        self._header = cipher.parse_header(content)
+        try:
+            self._plaintext = cipher.decrypt(content, self._passphrase)
+        except CbKsPasswordError:
+            self._plaintext = b''
+            self._stderr = b'bad decrypt'
+            self._return_code = 1
+
+    def _encrypt_in_process(self):
+        """
+        Execute encryption into file without calling openssl
+        """
+        if self._ciphersuite == 'none':
+            content = self._plaintext
+        else:
+            kdf, params = cipher.default_kdf()
+            salt = None
+            if self._header is not None and self._header[:2] == (kdf, params):
+                salt = self._header[2]
+            content = cipher.encrypt(self._plaintext, self._passphrase, kdf, params, salt)
+            self._header = cipher.parse_header(content)
+        self._write_atomic(self._file, content)
+        self._stdout = b''
+        self._stderr = b''
+        self._return_code = os.EX_OK
+
+    def _operate(self, action, digest=cipher.OPENSSL_DIGESTS[0]):
         """
         Execute the actual crypto operation.
 
@@ -95,16 +172,40 @@ class CbKsCrypto(CbBinary):
 
         Before calling this method, the environment has to be properly set up:
 
-        * for **decryption**, ``self.stdin`` must be set to ``None``
+        * for **decryption**, ``self.stdin`` must be set to ``None`` to decrypt the file, or contain the
+          ciphertext to be decrypted
         * for **encryption**, ``self.stdin`` must be set to contain the plaintext to be encrypted
 
-        When run in decryption mode, the generated plaintext resides in ``self.stdout``.
+        When run in decryption mode, the generated plaintext resides in ``self.stdout``. When run in encryption mode,
+        the generated ciphertext resides in ``self.stdout`` and still has to be written into the file.
 
         :param str action: ``d`` means decrypt, ``e`` means encrypt
+        :param str digest: message digest used for key derivation. It is always passed explicitly, since
+                           the default differs between OpenSSL releases.
+        """
+        self._arguments, fd_pass_r = self._prepare(action, digest, from_file=self._stdin is None)
+        # when executing openssl, close_fds must be False; otherwise pipe communication will not work
+        self._execute(close_fds=False)
+        # close the pipe's remote end file descriptor if it exists
+        if fd_pass_r is not None:
+            os.close(fd_pass_r)
+
+    def _prepare(self, action, digest, from_file=False):
+        """
+        Build the argument list for a crypto operation executed by the OpenSSL binary.
+
+        If the cipher suite requires a passphrase, it is written into a pipe, whose read end is passed to
+        OpenSSL. That file descriptor must be closed by the caller once OpenSSL has terminated.
+
+        :param str action:      ``d`` means decrypt, ``e`` means encrypt
+        :param str digest:      message digest used for key derivation
+        :param bool from_file:  ``True`` if the ciphertext is to be read from the file when decrypting
+        :return:                tuple of argument list and the pipe's read end file descriptor, or ``None``
+        :rtype:                 tuple
         """
         fd_pass_r = None
         # build argument list for de- or encryption
-        self._arguments = ['enc', '-{}'.format(self._ciphersuite), '-{}'.format(action)]
+        arguments = ['enc', '-{}'.format(self._ciphersuite), '-{}'.format(action)]
         if self._ciphersuite != "none":
             # generate file descriptors for pipe needed for transporting the password to the openssl subprocess
             # write the password into our end end close our pipe's end file descriptor
@@ -112,16 +213,40 @@ class CbKsCrypto(CbBinary):
             set_inheritable(fd_pass_r, True)
             os.write(fd_pass_w, self._passphrase)
             os.close(fd_pass_w)
-            self._arguments.extend(['-a', '-pass', 'fd:{}'.format(fd_pass_r)])
+            arguments.extend(['-a', '-md', digest, '-pass', 'fd:{}'.format(fd_pass_r)])
         if action == 'e':
-            self._arguments.extend(['-salt', '-out', shlex.quote(self._file)])
-        elif action == 'd':
-            self._arguments.extend(['-in', shlex.quote(self._file)])
-        # when executing openssl, close_fds must be False; otherwise pipe communication will not work
-        self._execute(close_fds=False)
-        # close the pipe's remote end file descriptor if it exists
-        if self._ciphersuite != "none":
-            os.close(fd_pass_r)
+            arguments.append('-salt')
+        elif action == 'd' and from_file:
+            arguments.extend(['-in', shlex.quote(self._file)])
+        return arguments, fd_pass_r
+
+    async def _operate_async(self, action, data, digest=cipher.OPENSSL_DIGESTS[0]):
+        """
+        Coroutine executing a crypto operation on data by calling the OpenSSL binary, without modifying
+        the object's state.
+
+        :param str action:  ``d`` means decrypt, ``e`` means encrypt
+        :param bytes data:  ciphertext to be decrypted or plaintext to be encrypted
+        :param str digest:  message digest used for key derivation
+        :return:            return code and output of OpenSSL
+        :rtype:             ~controlbeast.utils.binary.CbBinaryResult
+        """
+        arguments, fd_pass_r = self._prepare(action, digest)
+        try:
+            return await self._invoke_async(arguments, stdin=data, close_fds=False)
+        finally:
+            if fd_pass_r is not None:
+                os.close(fd_pass_r)
+
+    def _is_cbks(self):
+        """
+        Check whether the file is written in the ControlBeast key store format.
+
+        :return:    ``True`` if the file starts with the ControlBeast key store format's magic prefix
+        :rtype:     bool
+        """
+        with open(self._file, 'rb') as fp:
+            return fp.read(len(cipher.CBKS_MAGIC)) == cipher.CBKS_MAGIC
 
     def _test_file(self):
         """
@@ -137,6 +262,95 @@ class CbKsCrypto(CbBinary):
                 raise CbKsIOError(filename=self._file)
             self._read_only = False
 
+    def decrypt(self, ciphertext):
+        """
+        Decrypt a ciphertext which has not been read from the file, e. g. a key store read from a git object.
+
+        :param bytes ciphertext:    ciphertext as it would be kept in the file
+        :return:                    the plaintext resulting from ciphertext decryption
+        :rtype:                     str
+        :raises CbKsPasswordError:  if the ciphertext cannot be decrypted using the passphrase
+        """
+        ciphertext = to_bytes(ciphertext)
+        if self._ciphersuite == 'none' or not ciphertext:
+            return to_str(ciphertext)
+        if self._in_process:
+            return to_str(cipher.decrypt(ciphertext, self._passphrase))
+        if ciphertext.startswith(cipher.CBKS_MAGIC):
+            raise CbKsFormatError(filename=self._file)
+        self._stdin = ciphertext
+        for digest in cipher.OPENSSL_DIGESTS:
+            self._operate(action='d', digest=digest)
+            if self._return_code == os.EX_OK or 'bad decrypt' not in self.stderr:
+                break
+        self._stdin = None
+        if self._return_code != os.EX_OK:
+            raise CbKsPasswordError(filename=self._file)
+        return to_str(self._stdout)
+
+    async def decrypt_async(self, ciphertext):
+        """
+        Coroutine decrypting a ciphertext which has not been read from the file, like :py:meth:`decrypt`.
+
+        In-process decryption is executed within the event loop's default executor, so neither OpenSSL
+        nor key derivation block the event loop, and several ciphertexts may be decrypted at once.
+
+        :param bytes ciphertext:    ciphertext as it would be kept in the file
+        :return:                    the plaintext resulting from ciphertext decryption
+        :rtype:                     str
+        :raises CbKsPasswordError:  if the ciphertext cannot be decrypted using the passphrase
+        """
+        ciphertext = to_bytes(ciphertext)
+        if self._ciphersuite == 'none' or not ciphertext:
+            return to_str(ciphertext)
+        if self._in_process:
+            loop = asyncio.get_running_loop()
+            return to_str(await loop.run_in_executor(None, cipher.decrypt, ciphertext, self._passphrase))
+        if ciphertext.startswith(cipher.CBKS_MAGIC):
+            raise CbKsFormatError(filename=self._file)
+        for digest in cipher.OPENSSL_DIGESTS:
+            result = await self._operate_async('d', ciphertext, digest)
+            if result.return_code == os.EX_OK or b'bad decrypt' not in result.stderr:
+                break
+        if result.return_code != os.EX_OK:
+            raise CbKsPasswordError(filename=self._file)
+        return to_str(result.stdout)
+
+    async def encrypt_async(self, plaintext):
+        """
+        Coroutine encrypting a plaintext without writing it into the file, e. g. for committing a key store
+        as git object. Like :py:meth:`decrypt_async`, it does not block the event loop.
+
+        :param plaintext:   plaintext to be encrypted, as string or byte sequence
+        :return:            ciphertext as it would be kept in the file
+        :rtype:             bytes
+        """
+        plaintext = to_bytes(plaintext)
+        if self._ciphersuite == 'none':
+            return plaintext
+        if self._in_process:
+            kdf, params = cipher.default_kdf()
+            salt = None
+            if self._header is not None and self._header[:2] == (kdf, params):
+                # reuse the file's salt, so the cached key need not be derived again
+                salt = self._header[2]
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, cipher.encrypt, plaintext, self._passphrase, kdf, params, salt)
+        result = await self._operate_async('e', plaintext)
+        if result.return_code != os.EX_OK:
+            raise CbKsIOError(filename=self._file)
+        return result.stdout
+
+    def reload(self):
+        """
+        Discard the buffered plaintext and decrypt the ciphertext from the file again.
+
+        :return:    the plaintext resulting from ciphertext decryption
+        :rtype:     str
+        """
+        self._decrypt()
+        return to_str(self._plaintext)
+
     @property
     def plaintext(self):
         """
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+    controlbeast.keystore.entries
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import base64
+from collections.abc import MutableMapping
+import hashlib
+import hmac
+import os
+import yaml
+from controlbeast.keystore import cipher
+from controlbeast.keystore.crypto import CbKsCrypto
+from controlbeast.keystore.exception import CbKsFormatError, CbKsPasswordError
+from controlbeast.utils.convert import to_bytes, to_str
+from controlbeast.utils.yaml import safe_dump, safe_load
+
+
+#: Magic prefix of the per-entry key store layout
+ENTRIES_MAGIC = b'# CbKs-entries '
+
+
+class CbKsEntryDict(MutableMapping):
+    """
+    Dictionary holding the entries of a per-entry encrypted key store.
+
+    Entries are kept encrypted until they are accessed for the first time. Decrypted values are
+    cached. Entries which have been updated are marked for encryption, while all other entries keep
+    their ciphertext, so writing the key store only encrypts the updated entries. Deleted entries
+    are remembered until the key store is written.
+
+    :param dict tokens:     ciphertexts of the entries, or references to the stored values, indexed by key
+    :param unseal:          callable decrypting an entry, called with key and token
+    :param dict lines:      serialised index lines of the entries, indexed by key
+    """
+
+    def __init__(self, tokens=None, unseal=None, lines=None):
+        self._tokens = dict(tokens or {})
+        self._values = {}
+        self._unseal = unseal
+        self._lines = dict(lines or {})
+        self._deleted = set()
+
+    def __getitem__(self, key):
+        if key in self._values:
+            return self._values[key]
+        value = self._unseal(key, self._tokens[key])
+        self._values[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._tokens[key] = None
+        self._values[key] = value
+        self._lines.pop(key, None)
+        self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        del self._tokens[key]
+        self._values.pop(key, None)
+        self._lines.pop(key, None)
+        self._deleted.add(key)
+
+    def __contains__(self, key):
+        return key in self._tokens
+
+    def __iter__(self):
+        return iter(self._tokens)
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def token(self, key):
+        """
+        Get the ciphertext of an entry.
+
+        :param key: key of the entry
+        :return:    ciphertext, or ``None`` if the entry has been updated since it has been read or written
+        :rtype:     str
+        """
+        return self._tokens.get(key)
+
+    def line(self, key):
+        """
+        Get the serialised index line of an entry.
+
+        :param key: key of the entry
+        :return:    index line, or ``None`` if it is not known
+        :rtype:     str
+        """
+        return self._lines.get(key)
+
+    def deleted(self):
+        """
+        Get the keys of the entries deleted since the key store has been read or written.
+
+        :return:    keys of deleted entries
+        :rtype:     set
+        """
+        return set(self._deleted)
+
+    def stored(self, tokens, unseal, lines=None):
+        """
+        Mark all entries as written.
+
+        :param dict tokens: ciphertexts of the entries, or references to the stored values, indexed by key
+        :param unseal:      callable decrypting an entry, called with key and token
+        :param dict lines:  serialised index lines of the entries, indexed by key
+        """
+        self._tokens = tokens
+        self._unseal = unseal
+        self._lines = lines or {}
+        self._deleted.clear()
+
+
+class CbKsEntries(CbKsCrypto):
+    """
+    Backend for the key store handler, encrypting each entry on its own.
+
+    The backend file starts with a header line, which is a YAML comment naming the key derivation
+    function, its parameters, the salt and a verifier for the passphrase. It is followed by a YAML
+    dictionary mapping each key to the encrypted value. Values are encrypted using the ControlBeast
+    key store format's algorithms (cf. :py:func:`~controlbeast.keystore.cipher.seal`), with the key
+    being authenticated along with the value.
+
+    Unlike the other backends, this backend is not accessed via its plaintext, but via :py:meth:`load`
+    and :py:meth:`store`, which deal with :py:class:`CbKsEntryDict` objects. Opening a key store
+    thus only parses the index of keys, and values are decrypted on first access. Writing only encrypts
+    the entries which have been updated.
+
+    Files written by :py:class:`~controlbeast.keystore.crypto.CbKsCrypto` can be read, and are converted
+    into the per-entry layout when written.
+
+    .. note::
+
+       The keys of a per-entry encrypted key store are stored in plain text.
+
+    This backend requires libcrypto to be available.
+
+    :param str file:        path to file already containing or intended to contain the key store
+    :param str passphrase:  Passphrase to derive the keys from
+    """
+
+    #: Key derivation function, parameters and salt of the file
+    _header = None
+
+    #: Key used for encrypting the entries
+    _key = b''
+
+    #: Key used for authenticating the entries
+    _mac_key = b''
+
+    def __init__(self, file='', passphrase=''):
+        super(CbKsEntries, self).__init__(file=file, passphrase=passphrase)
+        if not cipher.is_available():
+            raise CbKsFormatError(filename=self._file)
+
+    @staticmethod
+    def detect(file):
+        """
+        Check whether a file contains a key store using the per-entry layout.
+
+        :param str file:    path to the file
+        :return:            ``True`` if the file starts with the per-entry layout's magic prefix
+        :rtype:             bool
+        """
+        try:
+            with open(file, 'rb') as fp:
+                return fp.read(len(ENTRIES_MAGIC)) == ENTRIES_MAGIC
+        except OSError:
+            return False
+
+    def _derive(self, kdf, params, salt):
+        """
+        Derive the keys for encrypting and authenticating the entries.
+
+        :param str kdf:         name of the key derivation function
+        :param dict params:     parameters of the key derivation function
+        :param bytes salt:      salt for key derivation
+        """
+        self._key, self._mac_key = cipher.derive_key(self._passphrase, kdf, params, salt)
+        self._header = (kdf, params, salt)
+
+    def _verifier(self):
+        """
+        Get the value written into the header for verifying the passphrase.
+
+        :return:    base64 encoded verifier
+        :rtype:     bytes
+        """
+        return base64.b64encode(hmac.new(self._mac_key, ENTRIES_MAGIC, hashlib.sha256).digest())
+
+    def _seal(self, key, value):
+        """
+        Encrypt an entry.
+
+        :param key:     key of the entry
+        :param value:   value of the entry
+        :return:        base64 encoded ciphertext
+        :rtype:         str
+        """
+        sealed = cipher.seal(to_bytes(safe_dump(value)), self._key, self._mac_key, to_bytes(safe_dump(key)))
+        return to_str(base64.b64encode(sealed))
+
+    def _unseal(self, key, token):
+        """
+        Decrypt an entry.
+
+        :param key:         key of the entry
+        :param str token:   base64 encoded ciphertext
+        :return:            value of the entry
+        """
+        try:
+            sealed = base64.b64decode(token, validate=True)
+        except (TypeError, ValueError):
+            raise CbKsPasswordError(filename=self._file)
+        return safe_load(to_str(cipher.unseal(sealed, self._key, self._mac_key, to_bytes(safe_dump(key)))))
+
+    def parse(self, content):
+        """
+        Parse the content of a key store file.
+
+        :param bytes content:   content of a key store file
+        :return:                entries of the key store
+        :rtype:                 CbKsEntryDict
+        :raises CbKsPasswordError:  if the passphrase does not match
+        :raises yaml.YAMLError:     if the content does not represent a key store
+        """
+        if not content.startswith(ENTRIES_MAGIC):
+            # key store written by CbKsCrypto, to be converted when written
+            result = CbKsEntryDict(unseal=self._unseal)
+            if content:
+                data = safe_load(to_str(cipher.decrypt(content, self._passphrase)))
+                if data is not None and not isinstance(data, dict):
+                    raise yaml.YAMLError('Key store does not contain a dictionary.')
+                result.update(data or {})
+            return result
+        header, index = content.split(b'\n', 1)
+        try:
+            version, kdf, params, salt, verifier = header[len(ENTRIES_MAGIC):].split(b' ')
+            if int(version) != cipher.CBKS_VERSION or kdf.decode() not in cipher.CBKS_KDFS:
+                raise CbKsFormatError(filename=self._file)
+            self._derive(kdf.decode(), cipher.parse_params(params, kdf.decode()), base64.b64decode(salt, validate=True))
+        except ValueError:
+            raise CbKsFormatError(filename=self._file)
+        if not hmac.compare_digest(self._verifier(), verifier):
+            raise CbKsPasswordError(filename=self._file)
+        index = to_str(index)
+        tokens = safe_load(index) or {}
+        if not isinstance(tokens, dict):
+            raise yaml.YAMLError('Key store does not contain a dictionary.')
+        # remember the index lines, so they need not be serialised again when writing,
+        # unless any entry spans several lines
+        keys = dict((token, key) for key, token in tokens.items())
+        lines = {}
+        if len(index.splitlines()) == len(tokens):
+            for line in index.splitlines(keepends=True):
+                token = line.rsplit(' ', 1)[-1].strip()
+                if token in keys:
+                    lines[keys[token]] = line
+        return CbKsEntryDict(tokens, self._unseal, lines)
+
+    def load(self):
+        """
+        Read the key store file.
+
+        :return:    entries of the key store
+        :rtype:     CbKsEntryDict
+        """
+        try:
+            with open(self._file, 'rb') as fp:
+                content = fp.read()
+        except FileNotFoundError:
+            content = b''
+        return self.parse(content)
+
+    def store(self, data):
+        """
+        Write entries into the key store file.
+
+        Entries of a :py:class:`CbKsEntryDict` read from this backend keep their ciphertext unless they have
+        been updated. All entries are encrypted again if the configured key derivation function has changed.
+
+        :param data:    entries of the key store
+        :type data:     CbKsEntryDict or dict
+        """
+        kdf, params = cipher.default_kdf()
+        rekey = self._header is None or self._header[:2] != (kdf, params)
+        if rekey:
+            # decrypt all entries using the old keys before deriving the new ones
+            values = dict(data.items())
+            self._derive(kdf, params, os.urandom(cipher.CBKS_SALT_LENGTH))
+        entries = isinstance(data, CbKsEntryDict) and not rekey
+        tokens = {}
+        lines = {}
+        for key in sorted(data):
+            token = data.token(key) if entries else None
+            line = data.line(key) if entries and token else None
+            if token is None:
+                token = self._seal(key, values[key] if rekey else data[key])
+            if line is None:
+                line = safe_dump({key: token})
+            tokens[key] = token
+            lines[key] = line
+        header = b' '.join([
+            ENTRIES_MAGIC.rstrip(), str(cipher.CBKS_VERSION).encode(), kdf.encode(), cipher.format_params(params),
+            base64.b64encode(self._header[2]), self._verifier()
+        ])
+        self._write_atomic(self._file, header + b'\n' + to_bytes(''.join(lines.values()) or safe_dump({})))
+        if isinstance(data, CbKsEntryDict):
+            data.stored(tokens, self._unseal, lines)
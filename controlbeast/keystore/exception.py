@@ -47,4 +47,18 @@ class CbKsIOError(CbKsError):
         if self._filename:
             return "Insufficient privileges for accessing key store at {file}.".format(file=self._filename)
         else:
-            return "Insufficient privileges for accessing key store."
\ No newline at end of file
+            return "Insufficient privileges for accessing key store."
+
+
+class CbKsFormatError(CbKsError):
+    """
+    Key Store format error.
+
+    This exception is raised when a key store file is written in a format which cannot be processed,
+    e. g. the ControlBeast key store format while libcrypto is not available.
+    """
+    def __str__(self):
+        if self._filename:
+            return "Key store at {file} is written in an unsupported format.".format(file=self._filename)
+        else:
+            return "Key store is written in an unsupported format."
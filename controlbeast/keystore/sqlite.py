@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+    controlbeast.keystore.sqlite
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import os
+import sqlite3
+import threading
+import urllib.request
+from controlbeast.keystore import cipher
+from controlbeast.keystore.crypto import CbKsCrypto
+from controlbeast.keystore.entries import CbKsEntries, CbKsEntryDict
+from controlbeast.keystore.exception import CbKsFormatError, CbKsPasswordError
+from controlbeast.utils.yaml import safe_dump, safe_load
+
+
+#: Magic prefix of SQLite database files
+SQLITE_MAGIC = b'SQLite format 3\x00'
+
+#: Token marking entries whose values are stored within the database and have not been updated
+_STORED = True
+
+
+class CbKsSQLite(CbKsEntries):
+    """
+    Backend for the key store handler, keeping the entries within an SQLite database.
+
+    Each entry is stored within its own table row, indexed by key. Opening a key store only
+    reads the keys; values are read by indexed lookups on first access. Writing only updates the
+    rows of entries which have been updated or deleted, within one database transaction. The
+    database operates in WAL mode, so readers are not blocked by writers, also within other processes.
+
+    If a passphrase is specified, the values are encrypted the same way as by
+    :py:class:`~controlbeast.keystore.entries.CbKsEntries`, which requires libcrypto to be available.
+    Otherwise, they are stored as YAML. Keys are always stored in plain text, and must be strings
+    or numbers.
+
+    Like :py:class:`~controlbeast.keystore.entries.CbKsEntries`, this backend is accessed via
+    :py:meth:`load` and :py:meth:`store`.
+
+    :param str file:        path to file already containing or intended to contain the key store
+    :param str passphrase:  Passphrase to derive the keys from, if values should be encrypted
+    """
+
+    #: Database connection
+    _connection = None
+
+    def __init__(self, file='', passphrase=''):
+        CbKsCrypto.__init__(self, file=file, passphrase=passphrase)
+        if self._passphrase and not cipher.is_available():
+            raise CbKsFormatError(filename=self._file)
+        self._lock = threading.RLock()
+
+    def __del__(self):
+        self.close()
+
+    @staticmethod
+    def detect(file):
+        """
+        Check whether a file contains an SQLite database.
+
+        :param str file:    path to the file
+        :return:            ``True`` if the file starts with the SQLite database magic prefix
+        :rtype:             bool
+        """
+        try:
+            with open(file, 'rb') as fp:
+                return fp.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+        except OSError:
+            return False
+
+    def _connect(self):
+        """
+        Open the database, unless it is already open, and create the tables if necessary.
+
+        :return:    database connection
+        :rtype:     sqlite3.Connection
+        """
+        if self._connection is None:
+            if self._read_only:
+                uri = 'file:{}?mode=ro'.format(urllib.request.pathname2url(self._file))
+                connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            else:
+                connection = sqlite3.connect(self._file, check_same_thread=False)
+                connection.execute('PRAGMA journal_mode=WAL')
+                with connection:
+                    connection.execute('CREATE TABLE IF NOT EXISTS entries (key PRIMARY KEY, value) WITHOUT ROWID')
+                    connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value)')
+            self._connection = connection
+        return self._connection
+
+    def _meta(self):
+        """
+        Read the metadata describing the key derivation.
+
+        :return:    dictionary of metadata
+        :rtype:     dict
+        """
+        try:
+            return dict(self._connect().execute('SELECT name, value FROM meta'))
+        except sqlite3.OperationalError:
+            # read-only database without tables
+            return {}
+
+    def _fetch(self, key, token):
+        """
+        Read the value of an entry from the database.
+
+        :param key:     key of the entry
+        :param token:   reference to the stored value
+        :return:        value of the entry
+        """
+        with self._lock:
+            row = self._connect().execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self._decode(key, row[0])
+
+    def _decode(self, key, value):
+        """
+        Convert a value read from the database.
+
+        :param key:         key of the entry
+        :param str value:   value as stored within the database
+        :return:            value of the entry
+        """
+        if self._passphrase:
+            return self._unseal(key, value)
+        return safe_load(value)
+
+    def _encode(self, key, value):
+        """
+        Convert a value to be stored within the database.
+
+        :param key:     key of the entry
+        :param value:   value of the entry
+        :return:        value to be stored within the database
+        :rtype:         str
+        """
+        if self._passphrase:
+            return self._seal(key, value)
+        return safe_dump(value)
+
+    def close(self):
+        """
+        Close the database connection
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def signature(self):
+        """
+        Get a value changing whenever the database has been changed by other connections.
+
+        :return:    signature of the database content
+        :rtype:     int
+        """
+        with self._lock:
+            try:
+                return self._connect().execute('PRAGMA data_version').fetchone()[0]
+            except sqlite3.DatabaseError:
+                return None
+
+    def _has_entries(self):
+        """
+        Check whether the database contains any entries.
+
+        :rtype: bool
+        """
+        try:
+            return self._connect().execute('SELECT 1 FROM entries LIMIT 1').fetchone() is not None
+        except sqlite3.OperationalError:
+            return False
+
+    def load(self):
+        """
+        Read the keys of all entries from the database.
+
+        :return:    entries of the key store
+        :rtype:     CbKsEntryDict
+        :raises CbKsPasswordError:      if the passphrase does not match
+        :raises sqlite3.DatabaseError:  if the file is not an SQLite database
+        """
+        with self._lock:
+            meta = self._meta()
+            if self._passphrase and meta:
+                try:
+                    self._derive(meta['kdf'], cipher.parse_params(meta['params'].encode(), meta['kdf']), meta['salt'])
+                except (KeyError, ValueError):
+                    raise CbKsFormatError(filename=self._file)
+                if self._verifier() != meta['verifier']:
+                    raise CbKsPasswordError(filename=self._file)
+            elif bool(self._passphrase) != bool(meta) and self._has_entries():
+                # values encrypted, but no passphrase given, or vice versa
+                raise CbKsPasswordError(filename=self._file)
+            try:
+                keys = [row[0] for row in self._connect().execute('SELECT key FROM entries')]
+            except sqlite3.OperationalError:
+                keys = []
+        return CbKsEntryDict(dict.fromkeys(keys, _STORED), self._fetch)
+
+    def store(self, data):
+        """
+        Write the entries which have been updated or deleted into the database.
+
+        All entries are written if ``data`` is not a :py:class:`~controlbeast.keystore.entries.CbKsEntryDict`,
+        or if the configured key derivation function has changed.
+
+        :param data:    entries of the key store
+        :type data:     CbKsEntryDict or dict
+        """
+        with self._lock:
+            connection = self._connect()
+            complete = not isinstance(data, CbKsEntryDict)
+            values = {}
+            if self._passphrase:
+                kdf, params = cipher.default_kdf()
+                if self._header is None or self._header[:2] != (kdf, params):
+                    # decrypt all entries using the old keys before deriving the new ones
+                    values = dict(data.items())
+                    complete = True
+                    self._derive(kdf, params, os.urandom(cipher.CBKS_SALT_LENGTH))
+            with connection:
+                if self._passphrase and complete:
+                    connection.executemany('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', [
+                        ('kdf', self._header[0]),
+                        ('params', cipher.format_params(self._header[1]).decode()),
+                        ('salt', self._header[2]),
+                        ('verifier', self._verifier()),
+                    ])
+                if complete:
+                    connection.execute('DELETE FROM entries')
+                    updated = list(data)
+                else:
+                    connection.executemany('DELETE FROM entries WHERE key = ?', [(key, ) for key in data.deleted()])
+                    updated = [key for key in data if data.token(key) is None]
+                connection.executemany('INSERT OR REPLACE INTO entries (key, value) VALUES (?, ?)', [
+                    (key, self._encode(key, values[key] if key in values else data[key])) for key in updated
+                ])
+            if isinstance(data, CbKsEntryDict):
+                data.stored(dict.fromkeys(data, _STORED), self._fetch)
@@ -162,3 +162,35 @@ def scm_get_root(*args, **kwargs):
         _load_scm_handler()
 
     return _scm_handler.get_root(*args, **kwargs)
+
+
+def scm_get_workspace(*args, **kwargs):
+    """
+    Get a working directory with a branch checked out, without switching the repository's working tree.
+
+    :param str path:    Path on the file system where the repository resides. If not specified, it defaults to the
+                        current work directory.
+    :param str name:    Name of the branch to be checked out.
+    :return:            Path of the working directory
+    :rtype:             str
+    """
+    if not _scm_handler:
+        _load_scm_handler()
+
+    return _scm_handler.get_workspace(*args, **kwargs)
+
+
+def scm_prune_workspaces(*args, **kwargs):
+    """
+    Remove working directories provided by :py:func:`scm_get_workspace` which have not been used for a while.
+
+    :param str path:    Path on the file system where the repository resides. If not specified, it defaults to the
+                        current work directory.
+    :param float idle:  Time in seconds after which unused working directories are removed.
+    :return:            Names of the branches whose working directories have been removed
+    :rtype:             list
+    """
+    if not _scm_handler:
+        _load_scm_handler()
+
+    return _scm_handler.prune_workspaces(*args, **kwargs)
@@ -7,7 +7,9 @@
     :license: ISC, see LICENSE for details.
 """
 import subprocess
-from controlbeast.utils.binary import CbBinary
+import threading
+from controlbeast.utils.binary import CbBinary, CbBinaryResult
+from controlbeast.utils.convert import to_str
 from controlbeast.utils.dynamic import CbDynamic
 
 
@@ -120,6 +122,10 @@ class CbSCMRepoError(CbSCMError):
 class CbSCMWrapper(CbBinary):
     """
     The class from which all SCM interface wrappers derive
+
+    SCM commands are executed without modifying the wrapper object or the process-wide working directory,
+    so a wrapper object may be used by several threads at once. The output of the last command executed
+    (cf. :py:attr:`stdout`, :py:attr:`stderr` and :py:attr:`return_code`) is kept per thread.
     """
 
     def __init__(self, binary_name=''):
@@ -127,8 +133,9 @@ class CbSCMWrapper(CbBinary):
         if not self._binary_path:
             raise CbSCMBinaryError(self._binary_name)
         self._arguments = []
+        self._local = threading.local()
 
-    def _run(self, arguments, path, exception):
+    def _run(self, arguments, path, exception, stdin=None):
         """
         Run the command described by arguments and catch eventual exceptions.
 
@@ -136,14 +143,68 @@ class CbSCMWrapper(CbBinary):
                                the path to the binary (cf. :py:class:`~controlbeast.utils.binary.CbBinary`)
         :param str path:       file system path representing the location of the SCM repository
         :param exception:      reference to the exception class to be raised if anything goes wrong
+        :param bytes stdin:    input to be sent to the command via stdin
+        :return:               return code and output of the command
+        :rtype:                ~controlbeast.utils.binary.CbBinaryResult
         """
-        self._arguments = arguments
         try:
-            self._execute()
-        except subprocess.CalledProcessError:
-            raise exception(scm_name=self._binary_name, path=path, text=self.stderr)
+            result = self._invoke(arguments, stdin=stdin)
+        except subprocess.CalledProcessError as e:
+            raise exception(scm_name=self._binary_name, path=path, text=to_str(e.stderr or b''))
         except (OSError, FileNotFoundError):
             raise CbSCMBinaryError(scm_name=self._binary_name)
+        self._local.result = result
+        return result
+
+    async def _run_async(self, arguments, path, exception, stdin=None):
+        """
+        Coroutine running the command described by arguments and catching eventual exceptions.
+
+        Unlike :py:meth:`_run`, the outcome is not kept as output of the last command executed, since several
+        commands may be awaited at once.
+
+        :param list arguments: list of arguments as expected by the various :py:mod:`subprocess` functions, excluding
+                               the path to the binary (cf. :py:class:`~controlbeast.utils.binary.CbBinary`)
+        :param str path:       file system path representing the location of the SCM repository
+        :param exception:      reference to the exception class to be raised if anything goes wrong
+        :param bytes stdin:    input to be sent to the command via stdin
+        :return:               return code and output of the command
+        :rtype:                ~controlbeast.utils.binary.CbBinaryResult
+        """
+        try:
+            return await self._invoke_async(arguments, stdin=stdin)
+        except subprocess.CalledProcessError as e:
+            raise exception(scm_name=self._binary_name, path=path, text=to_str(e.stderr or b''))
+        except (OSError, FileNotFoundError):
+            raise CbSCMBinaryError(scm_name=self._binary_name)
+
+    @property
+    def _result(self):
+        """
+        Return code and output of the last command executed by the current thread
+        """
+        return getattr(self._local, 'result', CbBinaryResult(return_code=0, stdout=b'', stderr=b''))
+
+    @property
+    def stdout(self):
+        """
+        Data returned via stdout by the last command executed by the current thread.
+        """
+        return to_str(self._result.stdout)
+
+    @property
+    def stderr(self):
+        """
+        Data returned via stderr by the last command executed by the current thread.
+        """
+        return to_str(self._result.stderr)
+
+    @property
+    def return_code(self):
+        """
+        Return code of the last command executed by the current thread
+        """
+        return self._result.return_code
 
     def init(self, *args, **kwargs):
         """
@@ -196,3 +257,19 @@ class CbSCMWrapper(CbBinary):
         Get the path to the root of the SCM repository
         """
         raise NotImplementedError
+
+    def get_workspace(self, *args, **kwargs):
+        """
+        The get_workspace method contains the actual code for providing a working directory with
+        a named branch checked out, without switching the repository's working tree. This method
+        needs to be implemented for each SCM wrapper class.
+        """
+        raise NotImplementedError
+
+    def prune_workspaces(self, *args, **kwargs):
+        """
+        The prune_workspaces method contains the actual code for removing working directories
+        provided by get_workspace which have not been used for a while. This method needs to be
+        implemented for each SCM wrapper class.
+        """
+        raise NotImplementedError
@@ -6,20 +6,98 @@
     :copyright: Copyright 2013 by the ControlBeast team, see AUTHORS.
     :license: ISC, see LICENSE for details.
 """
+from collections import namedtuple
+import hashlib
 import os
 import re
+import subprocess
+import tempfile
+import threading
+import time
+from controlbeast.conf import get_conf
 from controlbeast.scm.base import CbSCMWrapper, CbSCMInitError, CbSCMCommitError, CbSCMRepoError, CbSCMBranchError, \
-    CbSCMCheckoutError
+    CbSCMCheckoutError, CbSCMBinaryError
+from controlbeast.utils.binary import CbBinary
+from controlbeast.utils.convert import to_bytes, to_str
+
+
+#: Object read from a git repository: object name (SHA-1), type and content
+GitObject = namedtuple('GitObject', ['sha', 'type', 'content'])
+
+#: Mode of tree entries referring to trees
+_TREE_MODE = b'40000'
+
+#: Mode of tree entries referring to regular files
+_FILE_MODES = (b'100644', b'100755')
+
+
+def _parse_tree(content, length):
+    """
+    Parse the content of a git tree object.
+
+    :param bytes content:   content of the tree object
+    :param int length:      length of object names in bytes
+    :return:                dictionary mapping entry names to tuples of mode and object name, both as byte sequences
+    :rtype:                 dict
+    """
+    entries = {}
+    position = 0
+    while position < len(content):
+        end = content.index(b'\0', position)
+        mode, name = content[position:end].split(b' ', 1)
+        entries[name] = (mode, content[end + 1:end + 1 + length])
+        position = end + 1 + length
+    return entries
+
+
+def _format_tree(entries):
+    """
+    Serialise entries into the content of a git tree object.
+
+    :param dict entries:    dictionary mapping entry names to tuples of mode and binary object name
+    :return:                content of the tree object
+    :rtype:                 bytes
+    """
+    # git sorts trees as if their names ended with a slash
+    names = sorted(entries, key=lambda name: name + b'/' if entries[name][0] == _TREE_MODE else name)
+    return b''.join(entries[name][0] + b' ' + name + b'\0' + entries[name][1] for name in names)
 
 
 class Git(CbSCMWrapper):
     """
     Class acting as wrapper for the git command line interface
+
+    Each command is passed the repository's path using git's ``-C`` option, so the process-wide working
+    directory is never changed, and a Git object may be shared by the threads of a thread pool operating
+    on several repositories or worktrees at once.
+
+    Branches, the active branch and the repository's root are looked up by reading the repository's files
+    (cf. :py:class:`GitRefCache`), falling back to running git for repositories which cannot be read directly.
+
+    Coroutine variants of the commands changing a repository (e. g. :py:meth:`commit_async`) allow running git
+    on several worktrees at once from an :py:mod:`asyncio` event loop.
     """
 
     def __init__(self):
         super(Git, self).__init__(binary_name='git')
         self._arguments = []
+        self._refs = GitRefCache()
+        self._workspace_lock = threading.Lock()
+        self._workspace_locks = {}
+        self._workspace_pruned = {}
+
+    def _classify(self, arguments):
+        """
+        Determine the command class of an execution, which is the git command, skipping the ``-C`` option.
+
+        :param list arguments:  redacted arguments passed to git
+        :return:                git command
+        :rtype:                 str
+        """
+        arguments = list(arguments)
+        while len(arguments) > 1 and arguments[0] == '-C':
+            arguments = arguments[2:]
+        return super(Git, self)._classify(arguments)
 
     def init(self, *args, **kwargs):
         """
@@ -39,9 +117,9 @@ class Git(CbSCMWrapper):
         if not path:
             path = os.path.abspath(os.getcwd())
 
-        self._run(['init', path], path, CbSCMInitError)
-        if self.return_code != os.EX_OK:
-            raise CbSCMInitError(scm_name=self._binary_name, path=path, text=self.stderr)
+        result = self._run(['init', path], path, CbSCMInitError)
+        if result.return_code != os.EX_OK:
+            raise CbSCMInitError(scm_name=self._binary_name, path=path, text=to_str(result.stderr))
 
     def commit(self, *args, **kwargs):
         """
@@ -69,21 +147,13 @@ class Git(CbSCMWrapper):
         if not path:
             path = os.path.abspath(os.getcwd())
 
-        # Git can only commit in the current work directory, so we have to change the current working
-        # directory to the path of the repository we are expected to execute the commit on.
-        current_dir = os.path.abspath(os.getcwd())
-        os.chdir(path)
-
         # Before committing to git, changes have to be staged for the commit process
-        self._run(['add', '.'], path, CbSCMCommitError)
-        if self.return_code != os.EX_OK:
-            raise CbSCMCommitError(scm_name=self._binary_name, path=path, text=self.stderr)
-        self._run(['commit', '-a', '-m', message], path, CbSCMCommitError)
-        if self.return_code != os.EX_OK:
-            raise CbSCMCommitError(scm_name=self._binary_name, path=path, text=self.stderr)
-
-        # Switch back to the previous working directory
-        os.chdir(current_dir)
+        result = self._run(['-C', path, 'add', '.'], path, CbSCMCommitError)
+        if result.return_code != os.EX_OK:
+            raise CbSCMCommitError(scm_name=self._binary_name, path=path, text=to_str(result.stderr))
+        result = self._run(['-C', path, 'commit', '-a', '-m', message], path, CbSCMCommitError)
+        if result.return_code != os.EX_OK:
+            raise CbSCMCommitError(scm_name=self._binary_name, path=path, text=to_str(result.stderr))
 
     def create_branch(self, *args, **kwargs):
         """
@@ -117,17 +187,10 @@ class Git(CbSCMWrapper):
         if name in self.get_branches(path=path):
             raise CbSCMBranchError(path=path, branch=name, text='Branch name specified already exists')
 
-        # Git can only operate in the current work directory, so we have to change the current working
-        # directory to the path of the repository we are expected to create the branch on.
-        current_dir = os.path.abspath(os.getcwd())
-        os.chdir(path)
-
-        self._run(['branch', '--quiet', name], path, CbSCMBranchError)
-        if self._return_code != os.EX_OK:
-            raise CbSCMBranchError(path=path, branch=name, text=self.stderr)
-
-        # Switch back to the previous working directory
-        os.chdir(current_dir)
+        self._refs.invalidate(path)
+        result = self._run(['-C', path, 'branch', '--quiet', name], path, CbSCMBranchError)
+        if result.return_code != os.EX_OK:
+            raise CbSCMBranchError(path=path, branch=name, text=to_str(result.stderr))
 
     def get_branches(self, *args, **kwargs):
         """
@@ -149,20 +212,16 @@ class Git(CbSCMWrapper):
         if not path:
             path = os.path.abspath(os.getcwd())
 
-        # Git can only operate in the current work directory, so we have to change the current working
-        # directory to the path of the repository we are expected to get the list of branches from.
-        current_dir = os.path.abspath(os.getcwd())
-        os.chdir(path)
+        refs = self._refs.get(path)
+        if refs is not None:
+            return refs[2]
 
-        self._run(['branch', '--list', '--no-color', '--no-column'], path, CbSCMRepoError)
-        if self._return_code != os.EX_OK:
-            raise CbSCMRepoError(scm_name=self._binary_name, path=path, text=self.stderr)
-
-        # Switch back to the previous working directory
-        os.chdir(current_dir)
+        result = self._run(['-C', path, 'branch', '--list', '--no-color', '--no-column'], path, CbSCMRepoError)
+        if result.return_code != os.EX_OK:
+            raise CbSCMRepoError(scm_name=self._binary_name, path=path, text=to_str(result.stderr))
 
         pattern = re.compile(r'^\s*\**\s+')
-        return [pattern.sub('', candidate) for candidate in self.stdout.splitlines(keepends=False)]
+        return [pattern.sub('', candidate) for candidate in to_str(result.stdout).splitlines(keepends=False)]
 
     def checkout(self, *args, **kwargs):
         """
@@ -196,17 +255,10 @@ class Git(CbSCMWrapper):
         if name not in self.get_branches(path=path):
             raise CbSCMCheckoutError(path=path, branch=name, text='Branch name specified does not exist.')
 
-        # Git can only operate in the current work directory, so we have to change the current working
-        # directory to the path of the repository we are expected to execute the checkout on.
-        current_dir = os.path.abspath(os.getcwd())
-        os.chdir(path)
-
-        self._run(['checkout', '-q', name], path, CbSCMCheckoutError)
-        if self._return_code != os.EX_OK:
-            raise CbSCMCheckoutError(path=path, branch=name, text=self.stderr)
-
-        # Switch back to the previous working directory
-        os.chdir(current_dir)
+        self._refs.invalidate(path)
+        result = self._run(['-C', path, 'checkout', '-q', name], path, CbSCMCheckoutError)
+        if result.return_code != os.EX_OK:
+            raise CbSCMCheckoutError(path=path, branch=name, text=to_str(result.stderr))
 
     def get_active_branch(self, *args, **kwargs):
         """
@@ -228,20 +280,16 @@ class Git(CbSCMWrapper):
         if not path:
             path = os.path.abspath(os.getcwd())
 
-        # Git can only operate in the current work directory, so we have to change the current working
-        # directory to the path of the repository we are expected to detect the active branch on.
-        current_dir = os.path.abspath(os.getcwd())
-        os.chdir(path)
-
-        self._run(['branch', '--list', '--no-color', '--no-column'], path, CbSCMRepoError)
-        if self._return_code != os.EX_OK:
-            raise CbSCMRepoError(scm_name=self._binary_name, path=path, text=self.stderr)
+        refs = self._refs.get(path)
+        if refs is not None:
+            return refs[1]
 
-        # Switch back to the previous working directory
-        os.chdir(current_dir)
+        result = self._run(['-C', path, 'branch', '--list', '--no-color', '--no-column'], path, CbSCMRepoError)
+        if result.return_code != os.EX_OK:
+            raise CbSCMRepoError(scm_name=self._binary_name, path=path, text=to_str(result.stderr))
 
         pattern = re.compile(r'\s*\*+\s+(\S+)')
-        return pattern.search(self.stdout).groups()[0]
+        return pattern.search(to_str(result.stdout)).groups()[0]
 
     def get_root(self, *args, **kwargs):
         """
@@ -260,15 +308,819 @@ class Git(CbSCMWrapper):
         if not path:
             path = os.path.abspath(os.getcwd())
 
-        # Git can only commit in the current work directory, so we have to change the current working
-        # directory to the path of the repository we are expected to execute the commit on.
-        current_dir = os.path.abspath(os.getcwd())
-        os.chdir(path)
+        location = self._refs.find(path)
+        if location is not None:
+            return location[0]
+
+        result = self._run(['-C', path, 'rev-parse', '--show-toplevel'], path, CbSCMRepoError)
+        if result.return_code != os.EX_OK:
+            raise CbSCMRepoError(scm_name=self._binary_name, path=path, text=to_str(result.stderr))
+        return to_str(result.stdout).strip()
+
+    def get_branch_tips(self, *args, **kwargs):
+        """
+        Get the commits the branches existing within a git repository point to.
+
+        :param str path:    Path on the file system where the repository resides. If not specified, it defaults to the
+                            current work directory.
+        :return:            dictionary mapping branch names to commit object names
+        :rtype:             dict
+        """
+        path = None
+
+        if len(args) > 0:
+            path = args[0]
+
+        if 'path' in kwargs:
+            path = kwargs['path']
+
+        if not path:
+            path = os.path.abspath(os.getcwd())
+
+        result = self._run(
+            ['-C', path, 'for-each-ref', '--format=%(objectname) %(refname)', 'refs/heads'], path, CbSCMRepoError
+        )
+        if result.return_code != os.EX_OK:
+            raise CbSCMRepoError(scm_name=self._binary_name, path=path, text=to_str(result.stderr))
+
+        tips = {}
+        for line in to_str(result.stdout).splitlines():
+            sha, ref = line.split(' ', 1)
+            tips[ref[len('refs/heads/'):]] = sha
+        return tips
+
+    def _get_common_dir(self, path):
+        """
+        Get the git directory shared by the main working tree and all worktrees of a repository.
+
+        :param str path:    Path on the file system within the repository
+        :return:            absolute path of the common git directory
+        :rtype:             str
+        """
+        location = self._refs.find(path)
+        if location is not None:
+            return location[2]
+        result = self._run(['-C', path, 'rev-parse', '--git-common-dir'], path, CbSCMRepoError)
+        if result.return_code != os.EX_OK:
+            raise CbSCMRepoError(scm_name=self._binary_name, path=path, text=to_str(result.stderr))
+        return os.path.normpath(os.path.join(path, to_str(result.stdout).strip()))
+
+    def _get_worktrees(self, path):
+        """
+        Get the working trees of a repository and the branches checked out within them.
+
+        :param str path:    Path on the file system within the repository
+        :return:            dictionary mapping working tree paths to branch names, ``None`` for detached working trees
+        :rtype:             dict
+        """
+        result = self._run(['-C', path, 'worktree', 'list', '--porcelain'], path, CbSCMRepoError)
+        if result.return_code != os.EX_OK:
+            raise CbSCMRepoError(scm_name=self._binary_name, path=path, text=to_str(result.stderr))
+        worktrees = {}
+        worktree = None
+        for line in to_str(result.stdout).splitlines():
+            if line.startswith('worktree '):
+                worktree = line[len('worktree '):]
+                worktrees[worktree] = None
+            elif line.startswith('branch refs/heads/') and worktree is not None:
+                worktrees[worktree] = line[len('branch refs/heads/'):]
+        return worktrees
+
+    def get_workspace(self, *args, **kwargs):
+        """
+        Get a working directory with a branch checked out, without switching the repository's working tree.
+
+        Each branch is checked out into a git worktree of its own within the ``SCM_WORKSPACE_PATH`` directory.
+        The worktree is created on first use and reused afterwards, so operations on different branches can run
+        concurrently in separate directories. If the branch is already checked out within another working tree,
+        e. g. the repository's main working tree, that working tree is returned instead.
+
+        Whenever a work space is created, idle work spaces of the same repository are removed using
+        :py:meth:`prune_workspaces`, at most once per ``SCM_WORKSPACE_IDLE`` seconds.
+
+        :param str path:    Path on the file system where the repository resides. If not specified, it defaults to the
+                            current work directory.
+        :param str name:    Name of the branch to be checked out.
+        :return:            path of the working directory
+        :rtype:             str
+        """
+        path = None
+        name = ""
+
+        if len(args) > 0:
+            path = args[0]
+
+        if len(args) > 1:
+            name = args[1]
+
+        if 'path' in kwargs:
+            path = kwargs['path']
+
+        if 'name' in kwargs:
+            name = kwargs['name']
+
+        if not path:
+            path = os.path.abspath(os.getcwd())
+
+        if not name:
+            raise CbSCMCheckoutError(path=path, branch=name, text='No branch name specified.')
+
+        common_dir = self._get_common_dir(path)
+        root = os.path.dirname(common_dir)
+        directory = os.path.join(root, get_conf('SCM_WORKSPACE_PATH'), *name.split('/'))
+
+        # git does not support administering the worktrees of one repository concurrently
+        with self._workspace_lock:
+            lock = self._workspace_locks.setdefault(common_dir, threading.Lock())
+        created = False
+        with lock:
+            if not os.path.isfile(os.path.join(directory, '.git')):
+                if name not in self.get_branches(path=root):
+                    raise CbSCMCheckoutError(path=path, branch=name, text='Branch name specified does not exist.')
+                for worktree, branch in self._get_worktrees(root).items():
+                    if branch == name:
+                        return worktree
+                # forget worktrees whose directories have been removed
+                self._run(['-C', root, 'worktree', 'prune'], path, CbSCMCheckoutError)
+                result = self._run(
+                    ['-C', root, 'worktree', 'add', '--quiet', directory, name], path, CbSCMCheckoutError
+                )
+                if result.return_code != os.EX_OK and not os.path.isfile(os.path.join(directory, '.git')):
+                    raise CbSCMCheckoutError(path=path, branch=name, text=to_str(result.stderr))
+                created = True
+            # the modification time tells when a work space has been used last
+            os.utime(directory)
+        if created:
+            self._prune_idle_workspaces(root, common_dir)
+        return directory
+
+    def _prune_idle_workspaces(self, root, common_dir):
+        """
+        Remove idle work spaces of a repository, unless this has been done within the last
+        ``SCM_WORKSPACE_IDLE`` seconds.
+
+        :param str root:        root of the repository's main working tree
+        :param str common_dir:  repository's common git directory
+        """
+        now = time.monotonic()
+        with self._workspace_lock:
+            last = self._workspace_pruned.get(common_dir)
+            if last is not None and now - last < get_conf('SCM_WORKSPACE_IDLE'):
+                return
+            self._workspace_pruned[common_dir] = now
+        self.prune_workspaces(path=root)
+
+    def prune_workspaces(self, *args, **kwargs):
+        """
+        Remove work spaces which have not been used for a while.
 
-        self._run(['rev-parse', '--show-toplevel'], path, CbSCMRepoError)
-        if self.return_code != os.EX_OK:
-            raise CbSCMRepoError(scm_name=self._binary_name, path=path, text=self.stderr)
+        Work spaces containing changes which have not been committed are kept.
 
-        # Switch back to the previous working directory
-        os.chdir(current_dir)
-        return self.stdout.strip()
+        :param str path:    Path on the file system where the repository resides. If not specified, it defaults to the
+                            current work directory.
+        :param float idle:  Time in seconds after which unused work spaces are removed. If not specified, it defaults
+                            to the ``SCM_WORKSPACE_IDLE`` setting.
+        :return:            names of the branches whose work spaces have been removed
+        :rtype:             list
+        """
+        path = None
+        idle = None
+
+        if len(args) > 0:
+            path = args[0]
+
+        if len(args) > 1:
+            idle = args[1]
+
+        if 'path' in kwargs:
+            path = kwargs['path']
+
+        if 'idle' in kwargs:
+            idle = kwargs['idle']
+
+        if not path:
+            path = os.path.abspath(os.getcwd())
+
+        if idle is None:
+            idle = get_conf('SCM_WORKSPACE_IDLE')
+
+        common_dir = self._get_common_dir(path)
+        root = os.path.dirname(common_dir)
+        base = os.path.realpath(os.path.join(root, get_conf('SCM_WORKSPACE_PATH')))
+        removed = []
+        with self._workspace_lock:
+            lock = self._workspace_locks.setdefault(common_dir, threading.Lock())
+        with lock:
+            for worktree, branch in sorted(self._get_worktrees(root).items()):
+                if not os.path.realpath(worktree).startswith(base + os.sep):
+                    continue
+                try:
+                    if os.stat(worktree).st_mtime > time.time() - idle:
+                        continue
+                except FileNotFoundError:
+                    pass
+                # git refuses to remove worktrees containing changes
+                result = self._run(['-C', root, 'worktree', 'remove', worktree], path, CbSCMRepoError)
+                if result.return_code == os.EX_OK:
+                    removed.append(branch)
+            self._run(['-C', root, 'worktree', 'prune'], path, CbSCMRepoError)
+        return removed
+
+    def _hash_objects(self, path, objects, object_type):
+        """
+        Write objects into a repository's object database using one ``git hash-object`` process.
+
+        :param str path:        Path on the file system where the repository resides
+        :param list objects:    contents of the objects to be written
+        :param str object_type: type of the objects, e. g. ``blob`` or ``tree``
+        :return:                object names of the objects written
+        :rtype:                 list
+        """
+        if not objects:
+            return []
+        with tempfile.TemporaryDirectory() as td:
+            filenames = []
+            for i, content in enumerate(objects):
+                filenames.append(os.path.join(td, str(i)))
+                with open(filenames[-1], 'wb') as fp:
+                    fp.write(content)
+            result = self._run(
+                ['-C', path, 'hash-object', '-w', '-t', object_type, '--no-filters', '--stdin-paths'], path,
+                CbSCMCommitError, stdin='\n'.join(filenames).encode() + b'\n'
+            )
+        if result.return_code != os.EX_OK:
+            raise CbSCMCommitError(scm_name=self._binary_name, path=path, text=to_str(result.stderr))
+        return to_str(result.stdout).split()
+
+    def _build_tree(self, reader, base, files, digest):
+        """
+        Build the trees of a commit by applying changed files to the trees of a base commit.
+
+        Only the trees containing changed files are read and rebuilt, so the effort is proportional to
+        the number of changed files and the size of the directories containing them.
+
+        :param reader:          :py:class:`GitCatFile` object reading from the repository
+        :param str base:        object name of the base commit, or ``None`` to start from an empty tree
+        :param dict files:      dictionary mapping file names to contents, or ``None`` for files to be deleted
+        :param digest:          constructor of the hash function used by the repository
+        :return:                tuple of the root tree's object name and a dictionary mapping the object names of
+                                all new trees and blobs to their type and content
+        :rtype:                 tuple
+        """
+        length = digest().digest_size
+        objects = {}
+
+        def hash_object(object_type, content):
+            sha = digest(object_type.encode() + ' {}\0'.format(len(content)).encode() + content).digest()
+            objects[sha] = (object_type, content)
+            return sha
+
+        # group changes by directory, and make sure all parent directories are rebuilt
+        changes = {(): {}}
+        for filename, content in files.items():
+            parts = tuple(filename.replace(os.sep, '/').strip('/').split('/'))
+            changes.setdefault(parts[:-1], {})[parts[-1].encode()] = content
+            for i in range(len(parts) - 1):
+                changes.setdefault(parts[:i], {})
+
+        directories = sorted(changes, key=len)
+        if base is not None:
+            names = ['{}:{}'.format(base, '/'.join(directory)) for directory in directories]
+            names[0] = '{}^{{tree}}'.format(base)
+            trees = dict(zip(directories, reader.read(names)))
+        else:
+            trees = {}
+
+        root = None
+        for directory in reversed(directories):
+            tree = trees.get(directory)
+            entries = _parse_tree(tree.content, length) if tree is not None and tree.type == 'tree' else {}
+            for name, content in changes[directory].items():
+                if isinstance(content, tuple):
+                    # rebuilt subdirectory
+                    if content[1] is None:
+                        entries.pop(name, None)
+                    else:
+                        entries[name] = content
+                elif content is None:
+                    entries.pop(name, None)
+                else:
+                    mode = entries[name][0] if name in entries and entries[name][0] in _FILE_MODES else _FILE_MODES[0]
+                    entries[name] = (mode, hash_object('blob', to_bytes(content)))
+            sha = hash_object('tree', _format_tree(entries)) if entries or not directory else None
+            if directory:
+                changes[directory[:-1]][directory[-1].encode()] = (_TREE_MODE, sha)
+            else:
+                root = sha
+        return root, objects
+
+    def commit_files(self, *args, **kwargs):
+        """
+        Commit changed files to several branches, without checking out any branch or touching any working tree.
+
+        The commits are built from git objects directly: blobs and only the trees containing changed files are
+        written using ``git hash-object``, and all branches are updated within one ``git update-ref --stdin``
+        transaction, so either all or none of them are updated. A branch which does not exist yet is created,
+        starting from the revision specified within ``parents``, or, if not specified, the ``SCM_BRANCH`` branch.
+        Branches whose files do not change are left as they are. Example::
+
+           git.commit_files(path='/my/repository', message='Update stage', changes={
+               'host1': {'store/status.db': content1},
+               'host2': {'store/status.db': content2, 'base/obsolete.yml': None},
+           })
+
+        .. note::
+
+           If a branch is checked out within a working tree, its working tree and index are not updated,
+           so they show the reverse of the committed changes as uncommitted changes.
+
+        :param str path:        Path on the file system where the repository resides. If not specified, it defaults to
+                                the current work directory.
+        :param dict changes:    dictionary mapping branch names to dictionaries, which map file names relative to the
+                                repository's root to new contents, as string or byte sequence, or ``None`` for files
+                                to be deleted
+        :param str message:     Commit message to be attached to the commit records.
+        :param dict parents:    dictionary mapping names of branches to be created to the revisions they start from
+        :return:                dictionary mapping branch names to the object names of the commits they point to
+        :rtype:                 dict
+        """
+        path = None
+        changes = {}
+        message = ""
+        parents = {}
+
+        if len(args) > 0:
+            path = args[0]
+
+        if len(args) > 1:
+            changes = args[1]
+
+        if len(args) > 2:
+            message = args[2]
+
+        if len(args) > 3:
+            parents = args[3]
+
+        if 'path' in kwargs:
+            path = kwargs['path']
+
+        if 'changes' in kwargs:
+            changes = kwargs['changes']
+
+        if 'message' in kwargs:
+            message = kwargs['message']
+
+        if 'parents' in kwargs:
+            parents = kwargs['parents'] or {}
+
+        if not path:
+            path = os.path.abspath(os.getcwd())
+
+        result = self._run(['-C', path, 'rev-parse', '--show-object-format'], path, CbSCMCommitError)
+        if result.return_code != os.EX_OK:
+            raise CbSCMCommitError(scm_name=self._binary_name, path=path, text=to_str(result.stderr))
+        digest = getattr(hashlib, to_str(result.stdout).strip())
+
+        identities = []
+        for variable in ('GIT_AUTHOR_IDENT', 'GIT_COMMITTER_IDENT'):
+            result = self._run(['-C', path, 'var', variable], path, CbSCMCommitError)
+            if result.return_code != os.EX_OK:
+                raise CbSCMCommitError(scm_name=self._binary_name, path=path, text=to_str(result.stderr))
+            identities.append(result.stdout.strip())
+
+        tips = self.get_branch_tips(path=path)
+        bases = {}
+        with GitCatFile(path, check=True) as checker:
+            for branch in changes:
+                if branch not in tips:
+                    revision = (parents or {}).get(branch, get_conf('SCM_BRANCH'))
+                    commit = checker.read(['{}^{{commit}}'.format(revision)])[0]
+                    if commit is None:
+                        raise CbSCMCommitError(
+                            scm_name=self._binary_name, path=path, text='Revision {} does not exist.'.format(revision)
+                        )
+                    bases[branch] = commit.sha
+                else:
+                    bases[branch] = tips[branch]
+
+        objects = {}
+        commits = {}
+        with GitCatFile(path) as reader:
+            base_trees = dict(zip(changes, reader.read(['{}^{{tree}}'.format(bases[branch]) for branch in changes])))
+            for branch, files in changes.items():
+                root, new_objects = self._build_tree(reader, bases[branch], files, digest)
+                objects.update(new_objects)
+                if root.hex() == base_trees[branch].sha:
+                    # nothing changed, new branches point to the revision they start from
+                    continue
+                content = b'tree ' + root.hex().encode() + b'\n'
+                content += b'parent ' + bases[branch].encode() + b'\n'
+                content += b'author ' + identities[0] + b'\n'
+                content += b'committer ' + identities[1] + b'\n'
+                content += b'\n' + to_bytes(message).rstrip(b'\n') + b'\n'
+                commits[branch] = content
+
+        for object_type in ('blob', 'tree'):
+            shas = [sha for sha in objects if objects[sha][0] == object_type]
+            written = self._hash_objects(path, [objects[sha][1] for sha in shas], object_type)
+            if written != [sha.hex() for sha in shas]:
+                raise CbSCMCommitError(scm_name=self._binary_name, path=path, text='Object names do not match.')
+        branches = sorted(commits)
+        shas = self._hash_objects(path, [commits[branch] for branch in branches], 'commit')
+
+        updated = dict((branch, bases[branch]) for branch in changes)
+        updated.update(zip(branches, shas))
+        transaction = []
+        for branch in sorted(updated):
+            if branch in tips:
+                if updated[branch] != tips[branch]:
+                    transaction.append('update refs/heads/{} {} {}\n'.format(branch, updated[branch], tips[branch]))
+            else:
+                transaction.append('create refs/heads/{} {}\n'.format(branch, updated[branch]))
+        if transaction:
+            self._refs.invalidate(path)
+            result = self._run(
+                ['-C', path, 'update-ref', '-m', message, '--stdin'], path, CbSCMCommitError,
+                stdin=''.join(transaction).encode()
+            )
+            if result.return_code != os.EX_OK:
+                raise CbSCMCommitError(scm_name=self._binary_name, path=path, text=to_str(result.stderr))
+
+        return updated
+
+    async def commit_async(self, path=None, message=''):
+        """
+        Coroutine committing to a git repository, like :py:meth:`commit`.
+
+        Several coroutines may be awaited at once, as long as each of them operates on a different repository
+        or worktree (cf. :py:meth:`get_workspace`).
+
+        :param str path:    Path on the file system where the repository resides. If not specified, it defaults to the
+                            current work directory.
+        :param str message: Commit message to be attached to the commit record.
+        """
+        if not path:
+            path = os.path.abspath(os.getcwd())
+
+        for arguments in (['-C', path, 'add', '.'], ['-C', path, 'commit', '-a', '-m', message]):
+            result = await self._run_async(arguments, path, CbSCMCommitError)
+            if result.return_code != os.EX_OK:
+                raise CbSCMCommitError(scm_name=self._binary_name, path=path, text=to_str(result.stderr))
+
+    async def create_branch_async(self, path=None, name=''):
+        """
+        Coroutine creating a branch within a git repository, like :py:meth:`create_branch`.
+
+        :param str path:    Path on the file system where the repository resides. If not specified, it defaults to the
+                            current work directory.
+        :param str name:    Name of the branch to be created.
+        """
+        if not path:
+            path = os.path.abspath(os.getcwd())
+
+        if not name:
+            raise CbSCMBranchError(path=path, branch=name, text='No branch name specified')
+
+        self._refs.invalidate(path)
+        result = await self._run_async(['-C', path, 'branch', '--quiet', name], path, CbSCMBranchError)
+        self._refs.invalidate(path)
+        if result.return_code != os.EX_OK:
+            raise CbSCMBranchError(path=path, branch=name, text=to_str(result.stderr))
+
+    async def checkout_async(self, path=None, name=''):
+        """
+        Coroutine checking out a branch within a git repository, like :py:meth:`checkout`.
+
+        :param str path:    Path on the file system where the repository resides. If not specified, it defaults to the
+                            current work directory.
+        :param str name:    Name of the branch to be checked out.
+        """
+        if not path:
+            path = os.path.abspath(os.getcwd())
+
+        if not name:
+            raise CbSCMCheckoutError(path=path, branch=name, text='No branch name specified.')
+
+        self._refs.invalidate(path)
+        result = await self._run_async(['-C', path, 'checkout', '-q', name], path, CbSCMCheckoutError)
+        self._refs.invalidate(path)
+        if result.return_code != os.EX_OK:
+            raise CbSCMCheckoutError(path=path, branch=name, text=to_str(result.stderr))
+
+    async def get_branch_tips_async(self, path=None):
+        """
+        Coroutine getting the commits the branches existing within a git repository point to,
+        like :py:meth:`get_branch_tips`.
+
+        :param str path:    Path on the file system where the repository resides. If not specified, it defaults to the
+                            current work directory.
+        :return:            dictionary mapping branch names to commit object names
+        :rtype:             dict
+        """
+        if not path:
+            path = os.path.abspath(os.getcwd())
+
+        result = await self._run_async(
+            ['-C', path, 'for-each-ref', '--format=%(objectname) %(refname)', 'refs/heads'], path, CbSCMRepoError
+        )
+        if result.return_code != os.EX_OK:
+            raise CbSCMRepoError(scm_name=self._binary_name, path=path, text=to_str(result.stderr))
+
+        tips = {}
+        for line in to_str(result.stdout).splitlines():
+            sha, ref = line.split(' ', 1)
+            tips[ref[len('refs/heads/'):]] = sha
+        return tips
+
+
+class GitRefCache(object):
+    """
+    Cache of the branches and the active branch of git repositories, read directly from the repository's files.
+
+    Branches are read from the loose refs below ``refs/heads`` and from ``packed-refs``, the active branch from
+    ``HEAD``. Cache entries are invalidated when the modification time of any of these files or directories
+    changes. Entries read less than :py:attr:`_racy` seconds after the last modification are not reused, so
+    modifications within the file system's time stamp granularity do not go unnoticed.
+
+    Repositories whose files cannot be interpreted, e. g. using the reftable format, a detached ``HEAD`` or
+    ``GIT_DIR`` set within the environment, are reported as unsupported, so callers can fall back to running git.
+    The cache is guarded by a lock, so it may be shared by several threads.
+    """
+
+    #: Time in seconds after the last modification within which cache entries are not trusted
+    _racy = 1.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    @staticmethod
+    def find(path):
+        """
+        Find the working tree root and the git directories of the repository containing a path.
+
+        :param str path:    Path on the file system within the repository
+        :return:            tuple of the working tree root, the git directory holding ``HEAD`` and the common git
+                            directory holding the refs, or ``None`` if the repository cannot be read directly
+        :rtype:             tuple
+        """
+        if 'GIT_DIR' in os.environ or 'GIT_WORK_TREE' in os.environ:
+            return None
+        current = os.path.realpath(path)
+        while True:
+            candidate = os.path.join(current, '.git')
+            if os.path.isdir(candidate):
+                git_dir = candidate
+                break
+            if os.path.isfile(candidate):
+                # linked worktree or submodule, pointing to its git directory
+                try:
+                    with open(candidate, 'r') as fp:
+                        content = fp.read().strip()
+                except OSError:
+                    return None
+                if not content.startswith('gitdir: '):
+                    return None
+                git_dir = os.path.join(current, content[len('gitdir: '):])
+                break
+            parent = os.path.dirname(current)
+            if parent == current:
+                return None
+            current = parent
+        common_dir = git_dir
+        try:
+            with open(os.path.join(git_dir, 'commondir'), 'r') as fp:
+                common_dir = os.path.normpath(os.path.join(git_dir, fp.read().strip()))
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return None
+        if os.path.exists(os.path.join(common_dir, 'reftable')) or not os.path.isdir(os.path.join(common_dir, 'refs')):
+            return None
+        return current, git_dir, common_dir
+
+    @staticmethod
+    def _signature(git_dir, common_dir, directories):
+        """
+        Get the modification times of the files and directories holding the refs.
+
+        :param str git_dir:         git directory holding ``HEAD``
+        :param str common_dir:      common git directory holding the refs
+        :param list directories:    directories below ``refs/heads``
+        :return:                    tuple of modification times in nanoseconds, ``None`` for missing files
+        :rtype:                     tuple
+        """
+        signature = []
+        for filename in [os.path.join(git_dir, 'HEAD'), os.path.join(common_dir, 'packed-refs')] + directories:
+            try:
+                signature.append(os.stat(filename).st_mtime_ns)
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    @staticmethod
+    def _read(git_dir, common_dir):
+        """
+        Read the branches and the active branch from a repository's files.
+
+        :param str git_dir:     git directory holding ``HEAD``
+        :param str common_dir:  common git directory holding the refs
+        :return:                tuple of active branch name, sorted list of branch names and the directories
+                                below ``refs/heads``, or ``None`` if the files cannot be interpreted
+        :rtype:                 tuple
+        """
+        try:
+            with open(os.path.join(git_dir, 'HEAD'), 'r') as fp:
+                head = fp.read().strip()
+        except OSError:
+            return None
+        if not head.startswith('ref: refs/heads/'):
+            # detached HEAD
+            return None
+        active = head[len('ref: refs/heads/'):]
+        branches = set()
+        heads = os.path.join(common_dir, 'refs', 'heads')
+        directories = []
+        for directory, __, files in os.walk(heads):
+            directories.append(directory)
+            prefix = os.path.relpath(directory, heads)
+            for filename in files:
+                if not filename.endswith('.lock'):
+                    branches.add(filename if prefix == os.curdir else '/'.join([prefix.replace(os.sep, '/'), filename]))
+        try:
+            with open(os.path.join(common_dir, 'packed-refs'), 'r') as fp:
+                for line in fp:
+                    if line.startswith(('#', '^')):
+                        continue
+                    fields = line.split()
+                    if len(fields) == 2 and fields[1].startswith('refs/heads/'):
+                        branches.add(fields[1][len('refs/heads/'):])
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return None
+        return active, sorted(branches), directories
+
+    def get(self, path):
+        """
+        Get the working tree root, the active branch and the branches of the repository containing a path.
+
+        :param str path:    Path on the file system within the repository
+        :return:            tuple of working tree root, active branch name and sorted list of branch names, or
+                            ``None`` if the repository cannot be read directly
+        :rtype:             tuple
+        """
+        location = self.find(path)
+        if location is None:
+            return None
+        root, git_dir, common_dir = location
+        with self._lock:
+            entry = self._entries.get(git_dir)
+        if entry is not None:
+            signature, active, branches, directories = entry
+            if signature == self._signature(git_dir, common_dir, directories):
+                return root, active, list(branches)
+        read_at = time.time()
+        content = self._read(git_dir, common_dir)
+        if content is None:
+            self.invalidate(path)
+            return None
+        active, branches, directories = content
+        signature = self._signature(git_dir, common_dir, directories)
+        modified = max([mtime for mtime in signature if mtime is not None] or [0]) / 1e9
+        if modified < read_at - self._racy:
+            with self._lock:
+                self._entries[git_dir] = (signature, active, branches, directories)
+        return root, active, list(branches)
+
+    def invalidate(self, path):
+        """
+        Drop the cache entry of the repository containing a path.
+
+        :param str path:    Path on the file system within the repository
+        """
+        location = self.find(path)
+        if location is not None:
+            with self._lock:
+                self._entries.pop(location[1], None)
+
+
+class GitCatFile(CbBinary):
+    """
+    Reader for objects stored within a git repository.
+
+    All objects are read through one long-lived ``git cat-file --batch`` process, which is started
+    on first use. Objects are addressed by any name git understands, e. g. ``<branch>:<path>`` for the
+    file ``path`` as committed on ``branch``. Example::
+
+       with GitCatFile('/my/repository') as reader:
+           network, status = reader.read(['host1:base/network.yml', 'host1:store/status.db'])
+
+    Reading is serialised by a lock, so a reader object may be shared between threads.
+
+    If ``check`` is set, a ``git cat-file --batch-check`` process is used instead, which only reads the
+    objects' names, types and sizes. The objects returned then contain no content.
+
+    :param str path:    Path on the file system where the repository resides. If not specified, it defaults to the
+                        current work directory.
+    :param bool check:  ``True`` if only object names and types are to be read, but no content
+    """
+
+    def __init__(self, path=None, check=False):
+        super(GitCatFile, self).__init__(binary_name='git')
+        if not self._binary_path:
+            raise CbSCMBinaryError(scm_name=self._binary_name)
+        self._path = path or os.path.abspath(os.getcwd())
+        self._check = check
+        self._process = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def _start(self):
+        """
+        Start the ``git cat-file --batch`` process, unless it is already running
+        """
+        if self._process is None or self._process.poll() is not None:
+            self._process = subprocess.Popen(
+                [self._binary_path, 'cat-file', '--batch-check' if self._check else '--batch'],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, cwd=self._path
+            )
+
+    def _request(self, names):
+        """
+        Send object names to the ``git cat-file --batch`` process.
+
+        :param list names:  object names to be sent
+        """
+        try:
+            for name in names:
+                self._process.stdin.write('{}\n'.format(name).encode())
+            self._process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            pass
+
+    def _response(self):
+        """
+        Read one response from the ``git cat-file --batch`` process.
+
+        :return:    the object read, or ``None`` if the object does not exist
+        :rtype:     :py:class:`GitObject`
+        """
+        header = self._process.stdout.readline()
+        if not header:
+            raise CbSCMRepoError(scm_name=self._binary_name, path=self._path, text='git cat-file terminated')
+        fields = header.split()
+        if fields[-1] in (b'missing', b'ambiguous'):
+            # the object name echoed before may contain spaces, so only the last field is reliable
+            return None
+        fields = [field.decode() for field in fields]
+        if self._check:
+            return GitObject(sha=fields[0], type=fields[1], content=None)
+        content = self._process.stdout.read(int(fields[2]))
+        # each object's content is followed by a newline
+        self._process.stdout.read(1)
+        return GitObject(sha=fields[0], type=fields[1], content=content)
+
+    def read(self, names):
+        """
+        Read several objects from the repository.
+
+        The object names are sent by a separate thread while the responses are read, so
+        arbitrarily many objects can be requested without the pipes blocking each other.
+
+        :param list names:  object names, e. g. ``<branch>:<path>``
+        :return:            list of :py:class:`GitObject` tuples in the order of ``names``, containing ``None``
+                            for objects which do not exist
+        :rtype:             list
+        """
+        names = list(names)
+        with self._lock:
+            self._start()
+            writer = threading.Thread(target=self._request, args=(names,))
+            writer.start()
+            try:
+                return [self._response() for __ in names]
+            finally:
+                writer.join()
+
+    def close(self):
+        """
+        Terminate the ``git cat-file --batch`` process
+        """
+        process = getattr(self, '_process', None)
+        if process is not None:
+            self._process = None
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            process.wait()
+            process.stdout.close()
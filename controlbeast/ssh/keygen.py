@@ -8,10 +8,22 @@
 """
 
 
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import getpass
 import os
-import shlex
 import re
-from controlbeast.utils.binary import CbBinary
+import tempfile
+import time
+from controlbeast.conf import get_conf
+from controlbeast.utils.binary import CbBinary, CbBinaryCache
+from controlbeast.utils.convert import to_str
+
+
+#: Outcome of generating one key pair within a batch: name of the key pair, return code of ssh-keygen,
+#: wall time in seconds, path of the private key file (``None`` if attached to a key store), public key,
+#: and error output of ssh-keygen
+CbSSHKeyPair = namedtuple('CbSSHKeyPair', ['name', 'return_code', 'wall_time', 'private_key', 'public_key', 'error'])
 
 
 class CbSSHKeygen(CbBinary):
@@ -70,6 +82,9 @@ class CbSSHKeygen(CbBinary):
     #: version of OpenSSH
     _ssh_version = (0, 0)
 
+    #: options whose values are not recorded, since they contain passphrases
+    _secret_options = ('-N', '-P')
+
     def __init__(self):
         self._arguments = []
         super(CbSSHKeygen, self).__init__(binary_name='ssh-keygen')
@@ -141,29 +156,156 @@ class CbSSHKeygen(CbBinary):
                                 being empty or too short, ssh-keygen will ask for a passphrase using the system's
                                 ssh-askpass mechanism.
         """
-        self._arguments.extend([
+        self._arguments = self._keygen_arguments(filename, passphrase)
+        self._execute()
+
+    async def keygen_async(self, filename='', passphrase=''):
+        """
+        Coroutine generating a public/private key pair, like :py:meth:`keygen`.
+
+        The object's state is not modified, so several key pairs may be generated at once, e. g. using
+        :py:func:`asyncio.gather`.
+
+        :param str filename:    File name to store the private key in.
+        :param str passphrase:  The passphrase used for encrypting the private key.
+        :return:                return code and output of ssh-keygen
+        :rtype:                 ~controlbeast.utils.binary.CbBinaryResult
+        """
+        return await self._invoke_async(self._keygen_arguments(filename, passphrase))
+
+    def keygen_batch(self, names, directory=None, keystore=None, algorithm=None, workers=None, progress=None):
+        """
+        Generate one key pair per name, executing several instances of ssh-keygen at once.
+
+        The key pairs are generated without passphrase, as needed for host keys. Unless a ``keystore`` is
+        specified, each private key is stored within ``directory`` in a file named like the key pair, and the
+        public key next to it (suffixed by ``.pub``). Otherwise, each private key is attached to the key store
+        using the name as key (cf. :py:meth:`~controlbeast.keystore.base.CbKeyStore.attach`), and the public
+        key stored as entry suffixed by ``.pub``. All key store entries are written at once. Example::
+
+           keygen = CbSSHKeygen()
+           keygen.keygen_batch(['host{}'.format(i) for i in range(50)], keystore=store,
+                               progress=lambda done, total, pair: print(done, total, pair.wall_time))
+
+        :param list names:          names of the key pairs to be generated
+        :param str directory:       directory to store the key pairs in, unless stored within a key store
+        :param keystore:            key store to store the key pairs in
+        :type keystore:             ~controlbeast.keystore.base.CbKeyStore
+        :param str algorithm:       algorithm to be used. Defaults to Ed25519 if available, otherwise to the
+                                    algorithm selected for this object.
+        :param int workers:         maximum number of ssh-keygen instances executed at once. Defaults to
+                                    ``SSH_KEYGEN_WORKERS``.
+        :param progress:            callable called with the number of key pairs generated, the total number of
+                                    key pairs and the :py:data:`CbSSHKeyPair` just generated
+        :return:                    key pairs, in the order of ``names``
+        :rtype:                     list
+        """
+        if algorithm is None:
+            algorithm = 'ed25519' if 'ed25519' in self._algorithms else self._algorithm
+        keylength = self._keylength
+        if keylength not in self._key_map[algorithm]['range']:
+            keylength = self._key_map[algorithm]['default']
+        names = list(names)
+        results = {}
+        with tempfile.TemporaryDirectory() as td:
+            target = td if keystore is not None else directory or os.path.abspath(os.getcwd())
+
+            def generate(name):
+                filename = os.path.join(target, name)
+                start = time.perf_counter()
+                result = self._invoke(self._keygen_arguments(filename, '', algorithm, keylength, comment=name))
+                public_key = None
+                if result.return_code == os.EX_OK:
+                    with open(filename + '.pub', 'r') as fp:
+                        public_key = fp.read().strip()
+                return CbSSHKeyPair(
+                    name=name, return_code=result.return_code, wall_time=time.perf_counter() - start,
+                    private_key=filename, public_key=public_key, error=to_str(result.stderr)
+                )
+
+            with ThreadPoolExecutor(max_workers=workers or get_conf('SSH_KEYGEN_WORKERS')) as pool:
+                futures = [pool.submit(generate, name) for name in names]
+                for future in as_completed(futures):
+                    pair = future.result()
+                    results[pair.name] = pair
+                    if progress is not None:
+                        progress(len(results), len(names), pair)
+
+            if keystore is not None:
+                with keystore.transaction():
+                    for name, pair in results.items():
+                        if pair.return_code == os.EX_OK:
+                            keystore.attach(name, pair.private_key)
+                            keystore['{}.pub'.format(name)] = pair.public_key
+                        results[name] = pair._replace(private_key=None)
+        return [results[name] for name in names]
+
+    def _keygen_arguments(self, filename, passphrase, algorithm=None, keylength=None, comment=None):
+        """
+        Build the argument list for generating a key pair.
+
+        :param str filename:    File name to store the private key in.
+        :param str passphrase:  The passphrase used for encrypting the private key, or ``''`` for an unencrypted
+                                key if ``comment`` is specified
+        :param str algorithm:   algorithm to be used, if not the one selected for this object
+        :param int keylength:   key length to be used, if not the one selected for this object
+        :param str comment:     comment of the key pair. Defaults to the user and host name. If specified, the key
+                                pair is generated non-interactively.
+        :return:                list of arguments to be passed to ssh-keygen
+        :rtype:                 list
+        """
+        interactive = comment is None
+        if interactive:
+            try:
+                user = os.getlogin()
+            except OSError:
+                # no controlling terminal
+                user = getpass.getuser()
+            comment = '{user}@{host}'.format(user=user, host=os.uname().nodename)
+        arguments = [
             '-q',
-            '-t', self._algorithm,
-            '-b', str(self._keylength),
+            '-t', algorithm or self._algorithm,
+            '-b', str(keylength or self._keylength),
             '-O', 'clear',
             '-O', 'permit-pty',
-            '-C', shlex.quote('{user}@{host}'.format(user=os.getlogin(), host=os.uname().nodename)),
-            '-f', shlex.quote(filename)
-        ])
+            '-C', comment,
+            '-f', filename
+        ]
         if passphrase and len(passphrase) > 4:
-            self._arguments.extend([
-                '-N', shlex.quote(passphrase)
+            arguments.extend([
+                '-N', passphrase
             ])
-        self._execute()
+        elif not interactive and not passphrase:
+            arguments.extend(['-N', ''])
+        return arguments
 
     def _get_ssh_version(self):
         """
-        Detects the version of the installed OpenSSH client
+        Detects the version of the installed OpenSSH client. The version is probed once per
+        OpenSSH installation (cf. :py:class:`~controlbeast.utils.binary.CbBinaryCache`).
+        """
+        cache = CbBinaryCache.get_instance()
+        path = cache.find('ssh')
+        if path:
+            version = cache.version(path, self._probe_ssh_version)
+            if version:
+                self._ssh_version = tuple(version)
+
+    @staticmethod
+    def _probe_ssh_version(path):
+        """
+        Run the OpenSSH client for detecting its version.
+
+        :param str path:    path of the OpenSSH client
+        :return:            list of major and minor version, or ``None`` if the version cannot be detected
+        :rtype:             list
         """
         ssh_bin = CbBinary(binary_name='ssh')
+        ssh_bin._binary_path = path
         ssh_bin._arguments = ['-V']
         ssh_bin._execute()
         pattern = re.compile(r'^.*_(\d+).(\d+)\D+.*$')
         result = pattern.search(ssh_bin.stderr)
         if result:
-            self._ssh_version = (int(result.groups()[0]), int(result.groups()[1]))
+            return [int(result.groups()[0]), int(result.groups()[1])]
+        return None
@@ -6,15 +6,528 @@
     :copyright: Copyright 2013 by the ControlBeast team, see AUTHORS.
     :license: ISC, see LICENSE for details.
 """
+import asyncio
+from collections import namedtuple
 import os
 import subprocess
+import sys
+import threading
+import time
+import yaml
+from controlbeast.conf import get_conf
 from controlbeast.utils.convert import to_bytes, to_str
 from controlbeast.utils.file import CbFile
+from controlbeast.utils.singleton import CbSingleton
+from controlbeast.utils.yaml import safe_dump, safe_load
+
+
+#: Outcome of executing a binary: return code, and output received via stdout and stderr as byte sequences
+CbBinaryResult = namedtuple('CbBinaryResult', ['return_code', 'stdout', 'stderr'])
+
+#: Record describing one execution of a binary: name of the binary, command class, redacted arguments, wall time
+#: and CPU time (user and system) in seconds, number of bytes sent via stdin, number of bytes received via stdout
+#: and stderr, and return code
+CbBinaryRecord = namedtuple('CbBinaryRecord', [
+    'binary', 'command', 'arguments', 'wall_time', 'cpu_time', 'bytes_in', 'bytes_out', 'return_code'
+])
+
+#: Replacement for arguments which must not be recorded
+REDACTED = '<redacted>'
+
+#: Callables receiving a :py:data:`CbBinaryRecord` for each execution of a binary
+_sinks = []
+
+#: Lock serialising updates of the sink list
+_sinks_lock = threading.Lock()
+
+
+def add_sink(sink):
+    """
+    Register a callable to be called with a :py:data:`CbBinaryRecord` for each execution of a binary.
+
+    Sinks are called within the thread executing the binary, so they must be thread safe. As long as no
+    sink is registered, no records are created.
+
+    :param sink: callable accepting one argument
+    """
+    global _sinks
+    with _sinks_lock:
+        _sinks = _sinks + [sink]
+
+
+def remove_sink(sink):
+    """
+    Unregister a callable registered by :py:func:`add_sink`.
+
+    :param sink: callable to be unregistered
+    """
+    global _sinks
+    with _sinks_lock:
+        _sinks = [item for item in _sinks if item != sink]
+
+
+class CbBinaryStatistics(object):
+    """
+    Sink aggregating the records of binary executions by binary and command class. Example::
+
+       statistics = CbBinaryStatistics()
+       add_sink(statistics)
+       ...
+       print(statistics.summary())
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def __call__(self, record):
+        """
+        Add a record to the statistics.
+
+        :param CbBinaryRecord record: record of one execution
+        """
+        key = (record.binary, record.command)
+        with self._lock:
+            totals = self._totals.setdefault(key, [0, 0, 0.0, 0.0, 0, 0])
+            totals[0] += 1
+            totals[1] += record.return_code != os.EX_OK
+            totals[2] += record.wall_time
+            totals[3] += record.cpu_time or 0.0
+            totals[4] += record.bytes_in
+            totals[5] += record.bytes_out
+
+    @property
+    def totals(self):
+        """
+        Dictionary mapping (binary, command class) tuples to tuples of number of executions, number of
+        failed executions, wall time, CPU time, bytes sent and bytes received
+        """
+        with self._lock:
+            return dict((key, tuple(value)) for key, value in self._totals.items())
+
+    def clear(self):
+        """
+        Discard all records
+        """
+        with self._lock:
+            self._totals.clear()
+
+    def summary(self):
+        """
+        Format the statistics as table, sorted by descending wall time.
+
+        :return:    table of executions per binary and command class
+        :rtype:     str
+        """
+        totals = sorted(self.totals.items(), key=lambda item: (-item[1][2], item[0]))
+        lines = [
+            "Binary        Command           Calls  Failed    Wall [ms]     CPU [ms]       In [B]      Out [B]",
+            "=================================================================================================",
+        ]
+        overall = [0, 0, 0.0, 0.0, 0, 0]
+        for (binary, command), values in totals:
+            lines.append(self._format_line(binary, command, values))
+            overall = [a + b for a, b in zip(overall, values)]
+        lines.append(
+            "================================================================================================="
+        )
+        lines.append(self._format_line('total', '', overall))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _format_line(binary, command, values):
+        """
+        Format one line of the summary table.
+        """
+        calls, failed, wall_time, cpu_time, bytes_in, bytes_out = values
+        return "{binary: <12.12}  {command: <16.16}  {calls: >5}  {failed: >6}  {wall: >11.1f}  {cpu: >11.1f}  " \
+               "{bytes_in: >11}  {bytes_out: >11}".format(
+                   binary=binary, command=command, calls=calls, failed=failed, wall=wall_time * 1000,
+                   cpu=cpu_time * 1000, bytes_in=bytes_in, bytes_out=bytes_out
+               )
+
+    def report(self, file=None):
+        """
+        Print the summary table.
+
+        :param file:    file object to print to; defaults to stderr
+        """
+        print("\nExternal commands\n\n" + self.summary(), file=file or sys.stderr, end='')
+
+
+@CbSingleton
+class CbBinaryCache(CbFile):
+    """
+    Process-wide cache of the paths and versions of external binaries.
+
+    Binaries are looked up within the directories of the executable search path (cf. :py:func:`os.get_exec_path`),
+    and cached per search path. Versions are probed by a callable, e. g. running the binary with a version
+    option, and cached per binary path. The cache is persisted within the file named by the ``BINARY_CACHE_FILE``
+    setting, so it is shared by subsequent invocations of ControlBeast. Each cache entry is validated against
+    the modification time and inode of the binary, so replacing or updating a binary invalidates its entries.
+    Example::
+
+       cache = CbBinaryCache.get_instance()
+       path = cache.find('ssh')
+       version = cache.version(path, probe_ssh_version)
+
+    .. note::
+
+       A binary installed into a directory preceding the cached binary's directory within the search
+       path is not detected until the cached binary changes or the cache is cleared.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._paths = None
+        self._binaries = None
+
+    def _load(self):
+        """
+        Read the cache file, unless it has already been read.
+        """
+        if self._paths is not None:
+            return
+        self._paths, self._binaries = {}, {}
+        filename = get_conf('BINARY_CACHE_FILE')
+        if not filename:
+            return
+        try:
+            with open(filename, 'r') as fp:
+                content = safe_load(fp)
+        except (OSError, yaml.YAMLError):
+            return
+        if isinstance(content, dict):
+            self._paths = content.get('paths') or {}
+            self._binaries = content.get('binaries') or {}
+
+    def _save(self):
+        """
+        Write the cache file
+        """
+        filename = get_conf('BINARY_CACHE_FILE')
+        if not filename:
+            return
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            self._write_atomic(filename, safe_dump({'paths': self._paths, 'binaries': self._binaries}).encode())
+        except OSError:
+            pass
+
+    @staticmethod
+    def _signature(path):
+        """
+        Get the signature a binary's cache entries are validated against.
+
+        :param str path:    path of the binary
+        :return:            list of modification time in nanoseconds and inode, or ``None`` if it does not exist
+        :rtype:             list
+        """
+        try:
+            status = os.stat(path)
+        except OSError:
+            return None
+        return [status.st_mtime_ns, status.st_ino]
+
+    def _entry(self, path):
+        """
+        Get the valid cache entry of a binary, creating a new one if the binary has changed.
+
+        :param str path:    path of the binary
+        :return:            cache entry, or ``None`` if the binary does not exist
+        :rtype:             dict
+        """
+        signature = self._signature(path)
+        if signature is None:
+            self._binaries.pop(path, None)
+            return None
+        entry = self._binaries.get(path)
+        if not isinstance(entry, dict) or entry.get('signature') != signature:
+            entry = {'signature': signature}
+            self._binaries[path] = entry
+        return entry
+
+    def find(self, name):
+        """
+        Look up a binary within the executable search path.
+
+        :param str name:    name of the binary
+        :return:            absolute path of the binary, or ``None`` if it cannot be found
+        :rtype:             str
+        """
+        search_path = os.pathsep.join(os.get_exec_path())
+        with self._lock:
+            self._load()
+            path = self._paths.get(search_path, {}).get(name)
+            if path and path in self._binaries and self._binaries[path].get('signature') == self._signature(path):
+                return path
+            path = None
+            for directory in os.get_exec_path():
+                binary = os.path.join(directory, name)
+                if os.path.isfile(binary) and self._check_access(binary, os.X_OK):
+                    path = binary
+                    break
+            if path is None:
+                return None
+            self._paths.setdefault(search_path, {})[name] = path
+            self._entry(path)
+            self._save()
+            return path
+
+    def version(self, path, probe):
+        """
+        Get the version of a binary, probing it unless it has been cached.
+
+        :param str path:    path of the binary
+        :param probe:       callable returning the version of the binary, called with its path. The version
+                            must be representable in YAML. ``None`` is returned if the version could not be
+                            determined; it is not cached, so the binary is probed again next time.
+        :return:            version as returned by ``probe``
+        """
+        with self._lock:
+            self._load()
+            entry = self._entry(path)
+            if entry is None:
+                return probe(path)
+            if entry.get('version') is None:
+                version = probe(path)
+                if version is None:
+                    return None
+                entry['version'] = version
+                self._save()
+            return entry['version']
+
+    def clear(self):
+        """
+        Discard all cache entries, also within the cache file.
+        """
+        with self._lock:
+            self._paths, self._binaries = {}, {}
+            filename = get_conf('BINARY_CACHE_FILE')
+            if filename and os.path.exists(filename):
+                os.unlink(filename)
+
+
+class _CbPopen(subprocess.Popen):
+    """
+    Child process recording its resource usage when it is reaped.
+
+    :py:meth:`wait`, which is also used by :py:meth:`~subprocess.Popen.communicate`, reaps the child process
+    using :py:func:`os.wait4` and stores its exit status in the public ``returncode`` attribute, so subsequent
+    calls of :py:meth:`~subprocess.Popen.wait` or :py:meth:`~subprocess.Popen.poll` return it without reaping
+    it again. Where :py:func:`os.wait4` is not available, or the child process has already been reaped, e. g.
+    by :py:meth:`~subprocess.Popen.poll` within another thread, no resource usage is recorded.
+    """
+
+    #: Resource usage of the terminated child process, as returned by :py:func:`os.wait4`
+    rusage = None
+
+    #: Maximum time in seconds between two checks whether the child process has terminated, if a timeout is set
+    _poll_interval = 0.05
+
+    def wait(self, timeout=None):
+        if self.returncode is not None or not hasattr(os, 'wait4'):
+            return super(_CbPopen, self).wait(timeout=timeout)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.0005
+        while True:
+            try:
+                pid, status, rusage = os.wait4(self.pid, 0 if deadline is None else os.WNOHANG)
+            except ChildProcessError:
+                # child process has been reaped elsewhere
+                return super(_CbPopen, self).wait(timeout=timeout)
+            if pid == self.pid:
+                self.rusage = rusage
+                self.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+                return self.returncode
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, self._poll_interval)
+
+
+class CbBinaryStream(object):
+    """
+    Child process executing a binary, whose output is streamed instead of being buffered in memory.
+
+    Iterating over a stream yields the chunks received via stdout as byte sequences, while the child process
+    is running. Input is sent via stdin from a byte sequence or an iterable yielding byte sequences, e. g. the
+    chunks of another stream, within a separate thread. Output received via stderr is collected within a
+    separate thread, keeping at most ``stderr_limit`` bytes. Memory consumption is thus bounded, whatever
+    amount of data passes through the child process. Example::
+
+       with git._stream(['-C', path, 'log', '-p']) as stream:
+           for chunk in stream:
+               output.write(chunk)
+       if stream.return_code != os.EX_OK:
+           print(stream.stderr)
+
+    Streams are created by :py:meth:`CbBinary._stream`. Leaving the ``with`` block, or calling :py:meth:`close`,
+    before stdout has been consumed completely kills the child process. Once all input has been sent, or the
+    child process stopped reading it, an input iterable providing a ``close`` method is closed, so a stream
+    piped into another one is terminated together with the receiving child process.
+
+    :param CbBinary binary:     object representing the binary to be executed
+    :param list arguments:      arguments to be passed to the binary
+    :param stdin:               input to be sent via stdin, as byte sequence or iterable yielding byte sequences
+    :param str cwd:             working directory of the child process
+    :param dict env:            environment of the child process; if not specified, it is inherited
+    :param bool close_fds:      ``True`` if file descriptors are to be closed within the child process
+    :param int chunk_size:      maximum size of the chunks yielded. Defaults to ``BINARY_STREAM_CHUNK``.
+    :param int stderr_limit:    maximum number of bytes kept from stderr. Defaults to ``BINARY_STDERR_LIMIT``.
+    """
+
+    def __init__(self, binary, arguments, stdin=None, cwd=None, env=None, close_fds=True, chunk_size=None,
+                 stderr_limit=None):
+        self._binary = binary
+        self._arguments = list(arguments)
+        self._chunk_size = chunk_size or get_conf('BINARY_STREAM_CHUNK')
+        self._stderr_limit = get_conf('BINARY_STDERR_LIMIT') if stderr_limit is None else stderr_limit
+        self._stderr = bytearray()
+        self._stderr_size = 0
+        self._bytes_in = 0
+        self._bytes_out = 0
+        self._error = None
+        self._return_code = None
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._process = _CbPopen(
+            [binary._binary_path] + self._arguments, stdin=subprocess.DEVNULL if stdin is None else subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=close_fds, cwd=cwd, env=env
+        )
+        self._threads = [threading.Thread(target=self._read_stderr, daemon=True)]
+        if stdin is not None:
+            if isinstance(stdin, (bytes, bytearray, str)):
+                stdin = [to_bytes(stdin)]
+            self._threads.append(threading.Thread(target=self._write_stdin, args=(stdin, ), daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        read = self._process.stdout.read1
+        while True:
+            chunk = read(self._chunk_size)
+            if not chunk:
+                break
+            self._bytes_out += len(chunk)
+            yield chunk
+        self._finish()
+
+    def _write_stdin(self, chunks):
+        """
+        Send input to the child process; executed within a separate thread.
+        """
+        try:
+            for chunk in chunks:
+                self._process.stdin.write(chunk)
+                self._bytes_in += len(chunk)
+        except (BrokenPipeError, ValueError):
+            # child process terminated without reading all of its input, or stream closed
+            pass
+        except BaseException as e:
+            self._error = e
+        finally:
+            try:
+                self._process.stdin.close()
+            except OSError:
+                pass
+            if hasattr(chunks, 'close'):
+                # e. g. an upstream stream, which is killed unless it has terminated already
+                try:
+                    chunks.close()
+                except BaseException as e:
+                    self._error = self._error or e
+
+    def _read_stderr(self):
+        """
+        Collect the output received via stderr, up to the limit; executed within a separate thread.
+        """
+        for chunk in iter(lambda: self._process.stderr.read1(self._chunk_size), b''):
+            self._stderr_size += len(chunk)
+            if len(self._stderr) < self._stderr_limit:
+                self._stderr += chunk[:self._stderr_limit - len(self._stderr)]
+
+    def _finish(self):
+        """
+        Wait for the child process and the threads, and record the execution.
+
+        As a stream may also be closed by the thread sending its output into another stream, this method
+        is serialised by a lock.
+        """
+        with self._lock:
+            if self._return_code is not None:
+                return
+            self._return_code = self._process.wait()
+            for thread in self._threads:
+                thread.join()
+            self._process.stdout.close()
+            self._process.stderr.close()
+            if _sinks:
+                self._binary._emit(
+                    self._arguments, self._bytes_in, self._bytes_out + self._stderr_size, self._return_code,
+                    time.perf_counter() - self._start, self._process.rusage
+                )
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        """
+        Terminate the child process, unless it has terminated already, and wait for it.
+        """
+        if self._return_code is None and self._process.poll() is None:
+            self._process.kill()
+        self._finish()
+
+    def feed(self, sink):
+        """
+        Pass all chunks received via stdout to a callable.
+
+        :param sink:    callable accepting a byte sequence, e. g. the ``write`` method of a file object
+        :return:        return code of the child process
+        :rtype:         int
+        """
+        for chunk in self:
+            sink(chunk)
+        return self._return_code
+
+    @property
+    def return_code(self):
+        """
+        Return code of the child process, or ``None`` while it is running
+        """
+        return self._return_code
+
+    @property
+    def stderr(self):
+        """
+        Output received via stderr, truncated to the limit
+        """
+        return bytes(self._stderr)
+
+    @property
+    def stderr_truncated(self):
+        """
+        ``True`` if output received via stderr exceeded the limit
+        """
+        return self._stderr_size > len(self._stderr)
 
 
 class CbBinary(CbFile):
     """
     Auxiliary class to ease implementing classes dealing with execution of external binaries.
+
+    Each execution is described by a :py:data:`CbBinaryRecord`, which is passed to the sinks registered
+    using :py:func:`add_sink`, e. g. a :py:class:`CbBinaryStatistics` object. Values of options listed in
+    :py:attr:`_secret_options` are redacted within records.
+
+    Output too large for being buffered in memory can be streamed using :py:meth:`_stream`.
     """
 
     #: Name of the binary to be executed. Needs to be overridden by child class.
@@ -50,6 +563,9 @@ class CbBinary(CbFile):
     #: Device or socket to be used as stderr
     _stderr_dev = subprocess.PIPE
 
+    #: Options whose values are replaced by :py:data:`REDACTED` within records, since they may contain secrets
+    _secret_options = ()
+
     def __init__(self, binary_name=''):
         if binary_name:
             self._binary_name = binary_name
@@ -57,36 +573,165 @@ class CbBinary(CbFile):
 
     def _detect_binary(self):
         """
-        Look for the binary and store its path in _binary_path
+        Look for the binary and store its path in _binary_path (cf. :py:class:`CbBinaryCache`)
         """
         # only act if _scm_binary_name has been defined
         if self._binary_name:
-            for path in os.get_exec_path():
-                binary = os.path.join(path, self._binary_name)
-                if self._check_access(binary, os.X_OK):
-                    self._binary_path = binary
-                    break
+            self._binary_path = CbBinaryCache.get_instance().find(self._binary_name)
 
-    def _execute(self, close_fds=True):
+    def _invoke(self, arguments, stdin=None, cwd=None, env=None, timeout=None, close_fds=True):
         """
-        Create a child process executing the external command.
+        Create a child process executing the external command, without modifying the object's state.
+
+        Since neither the object nor the process-wide working directory are modified, this method may be
+        called from several threads at once.
+
+        :param list arguments:  arguments to be passed to the binary
+        :param bytes stdin:     input to be sent via stdin
+        :param str cwd:         working directory of the child process
+        :param dict env:        environment of the child process; if not specified, it is inherited
+        :param float timeout:   timeout in seconds, after which the child process is killed
+        :param bool close_fds:  ``True`` if file descriptors are to be closed within the child process
+        :return:                return code and output of the child process
+        :rtype:                 CbBinaryResult
         """
-        arguments = [self._binary_path]
-        arguments.extend(self._arguments)
-        process = subprocess.Popen(
-            arguments, stdin=self._stdin_dev, stdout=self._stdout_dev, stderr=self._stderr_dev, close_fds=close_fds
+        stdout, stderr = b'', b''
+        start = time.perf_counter()
+        process = _CbPopen(
+            [self._binary_path] + list(arguments), stdin=self._stdin_dev, stdout=self._stdout_dev,
+            stderr=self._stderr_dev, close_fds=close_fds, cwd=cwd, env=env
         )
         try:
-            self._stdout, self._stderr = process.communicate(input=self._stdin, timeout=self._timeout)
+            stdout, stderr = process.communicate(input=stdin, timeout=timeout)
         except subprocess.TimeoutExpired:
             process.kill()
-            self._stdout, self._stderr = process.communicate()
+            stdout, stderr = process.communicate()
         except subprocess.CalledProcessError:
             pass
         except (OSError, FileNotFoundError):
             pass
-        finally:
-            self._return_code = process.returncode
+        result = CbBinaryResult(return_code=process.returncode, stdout=stdout or b'', stderr=stderr or b'')
+        if _sinks:
+            self._emit(
+                arguments, len(stdin or b''), len(result.stdout) + len(result.stderr), result.return_code,
+                time.perf_counter() - start, process.rusage
+            )
+        return result
+
+    async def _invoke_async(self, arguments, stdin=None, cwd=None, env=None, timeout=None, close_fds=True):
+        """
+        Coroutine creating a child process executing the external command, without modifying the object's state.
+
+        Unlike :py:meth:`_invoke`, the event loop is not blocked while the child process runs, so several
+        child processes may be awaited at once, e. g. using :py:func:`asyncio.gather`. The CPU time of child
+        processes executed this way is not recorded.
+
+        :param list arguments:  arguments to be passed to the binary
+        :param bytes stdin:     input to be sent via stdin
+        :param str cwd:         working directory of the child process
+        :param dict env:        environment of the child process; if not specified, it is inherited
+        :param float timeout:   timeout in seconds, after which the child process is killed
+        :param bool close_fds:  ``True`` if file descriptors are to be closed within the child process
+        :return:                return code and output of the child process
+        :rtype:                 CbBinaryResult
+        """
+        start = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            self._binary_path, *arguments, stdin=self._stdin_dev, stdout=self._stdout_dev,
+            stderr=self._stderr_dev, close_fds=close_fds, cwd=cwd, env=env
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(input=stdin), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            stdout, stderr = await process.communicate()
+        result = CbBinaryResult(return_code=process.returncode, stdout=stdout or b'', stderr=stderr or b'')
+        if _sinks:
+            self._emit(
+                arguments, len(stdin or b''), len(result.stdout) + len(result.stderr), result.return_code,
+                time.perf_counter() - start, None
+            )
+        return result
+
+    def _emit(self, arguments, bytes_in, bytes_out, return_code, wall_time, rusage):
+        """
+        Pass a record describing an execution of the binary to all registered sinks.
+
+        :param list arguments:      arguments passed to the binary
+        :param int bytes_in:        number of bytes sent via stdin
+        :param int bytes_out:       number of bytes received via stdout and stderr
+        :param int return_code:     return code of the binary
+        :param float wall_time:     wall time in seconds
+        :param rusage:              resource usage of the child process, or ``None`` if not available
+        """
+        arguments = self._redact(arguments)
+        record = CbBinaryRecord(
+            binary=self._binary_name,
+            command=self._classify(arguments),
+            arguments=tuple(arguments),
+            wall_time=wall_time,
+            cpu_time=rusage.ru_utime + rusage.ru_stime if rusage is not None else None,
+            bytes_in=bytes_in,
+            bytes_out=bytes_out,
+            return_code=return_code
+        )
+        for sink in _sinks:
+            sink(record)
+
+    def _redact(self, arguments):
+        """
+        Replace the values of the options listed in :py:attr:`_secret_options` by :py:data:`REDACTED`.
+
+        :param list arguments:  arguments passed to the binary
+        :return:                arguments safe for being recorded
+        :rtype:                 list
+        """
+        redacted = list(arguments)
+        for i in range(1, len(redacted)):
+            if redacted[i - 1] in self._secret_options:
+                redacted[i] = REDACTED
+        return redacted
+
+    def _classify(self, arguments):
+        """
+        Determine the command class of an execution, grouping executions within records. By default, this
+        is the first argument, unless it is a path. Child classes may override this method.
+
+        :param list arguments:  redacted arguments passed to the binary
+        :return:                command class
+        :rtype:                 str
+        """
+        if arguments and os.sep not in arguments[0] and arguments[0] != REDACTED:
+            return arguments[0]
+        return ''
+
+    def _stream(self, arguments, stdin=None, cwd=None, env=None, close_fds=True, chunk_size=None,
+                stderr_limit=None):
+        """
+        Create a child process executing the external command, streaming its output instead of buffering it,
+        without modifying the object's state.
+
+        :param list arguments:      arguments to be passed to the binary
+        :param stdin:               input to be sent via stdin, as byte sequence or iterable yielding byte sequences
+        :param str cwd:             working directory of the child process
+        :param dict env:            environment of the child process; if not specified, it is inherited
+        :param bool close_fds:      ``True`` if file descriptors are to be closed within the child process
+        :param int chunk_size:      maximum size of the chunks yielded. Defaults to ``BINARY_STREAM_CHUNK``.
+        :param int stderr_limit:    maximum number of bytes kept from stderr. Defaults to ``BINARY_STDERR_LIMIT``.
+        :return:                    stream yielding the output received via stdout
+        :rtype:                     CbBinaryStream
+        """
+        return CbBinaryStream(
+            self, arguments, stdin=stdin, cwd=cwd, env=env, close_fds=close_fds, chunk_size=chunk_size,
+            stderr_limit=stderr_limit
+        )
+
+    def _execute(self, close_fds=True):
+        """
+        Create a child process executing the external command.
+        """
+        result = self._invoke(self._arguments, stdin=self._stdin, timeout=self._timeout, close_fds=close_fds)
+        self._return_code, self._stdout, self._stderr = result
 
     @property
     def stdin(self):
@@ -46,7 +46,7 @@ class CbDynamicIterable(UserDict):
     """
 
     def __init__(self, dict=None, **kwargs):
-        super(CbDynamicIterable, self).__init__(dict=dict, **kwargs)
+        super(CbDynamicIterable, self).__init__(dict, **kwargs)
 
     def __add_property(self, name, value, doc=None):
         """
@@ -6,7 +6,24 @@
     :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
     :license: ISC, see LICENSE for details.
 """
+import errno
 import os
+import shutil
+import stat
+import sys
+import tempfile
+
+
+#: Maximum number of bytes copied by one system call
+_COPY_CHUNK = 1 << 30
+
+#: Kernel-level copy methods, in order of preference; only Linux supports sendfile between regular files
+_COPY_METHODS = ('copy_file_range', 'sendfile') if sys.platform.startswith('linux') else ('copy_file_range', )
+
+#: Errors indicating that a kernel-level copy method is not available for the files involved
+_COPY_FALLBACK_ERRORS = (
+    errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF, errno.ENOTSOCK
+)
 
 
 class CbFile(object):
@@ -51,3 +68,109 @@ class CbFile(object):
         :rtype:             bool
         """
         return os.path.exists(os.path.abspath(path)) and os.path.isdir(os.path.abspath(path))
+
+    @staticmethod
+    def _write_atomic(filename, content):
+        """
+        Write content into a file in a crash-safe way.
+
+        The content is written into a temporary file within the same directory, flushed to disk and then
+        renamed over the target file. This way, the target file either keeps its previous content or contains
+        the complete new content, even if the process or system crashes while writing. If the directory is
+        not writeable, the target file is overwritten in place instead.
+
+        :param str filename:    name of the file to be written
+        :param bytes content:   content to be written into the file
+        """
+        CbFile._replace_atomic(filename, lambda fp: fp.write(content))
+
+    @staticmethod
+    def _copy_atomic(source, filename):
+        """
+        Copy a file in the same crash-safe way as :py:meth:`_write_atomic` writes one.
+
+        The content is copied by the kernel using :py:func:`os.copy_file_range`, which lets file systems
+        supporting it share the data blocks of both files (reflink), or using :py:func:`os.sendfile` on Linux.
+        If neither is available for the files involved, the content is copied in user space.
+
+        :param str source:      name of the file to be copied
+        :param str filename:    name of the file to be written
+        """
+        def copy(fp):
+            with open(source, 'rb') as sp:
+                CbFile._copy_content(sp, fp)
+
+        CbFile._replace_atomic(filename, copy)
+
+    @staticmethod
+    def _copy_content(source, target):
+        """
+        Copy the remaining content of a file object into another file object, within the kernel if possible.
+
+        :param source:  binary file object to read from, positioned where copying is to start
+        :param target:  binary file object to write to
+        """
+        target.flush()
+        copied = 0
+        for method in _COPY_METHODS:
+            if not hasattr(os, method):
+                continue
+            try:
+                while True:
+                    if method == 'sendfile':
+                        count = os.sendfile(target.fileno(), source.fileno(), None, _COPY_CHUNK)
+                    else:
+                        count = os.copy_file_range(source.fileno(), target.fileno(), _COPY_CHUNK)
+                    if not count:
+                        return
+                    copied += count
+            except OSError as e:
+                # fall back to the next method unless the copy has already started
+                if copied or e.errno not in _COPY_FALLBACK_ERRORS:
+                    raise
+            except TypeError:
+                # platforms whose sendfile does not accept an offset of None
+                if copied:
+                    raise
+        shutil.copyfileobj(source, target)
+
+    @staticmethod
+    def _replace_atomic(filename, write):
+        """
+        Replace a file in a crash-safe way (cf. :py:meth:`_write_atomic`).
+
+        :param str filename:    name of the file to be written
+        :param write:           callable writing the content, called with a binary file object
+        """
+        directory = os.path.dirname(os.path.abspath(filename))
+        if not CbFile._check_access(directory, os.W_OK):
+            with open(filename, 'wb') as fp:
+                write(fp)
+                fp.flush()
+                os.fsync(fp.fileno())
+            return
+        fd, tmp_name = tempfile.mkstemp(dir=directory, prefix='.{}.'.format(os.path.basename(filename)))
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                write(fp)
+                fp.flush()
+                os.fsync(fp.fileno())
+            # preserve permissions of an already existing target file
+            if os.path.exists(filename):
+                os.chmod(tmp_name, stat.S_IMODE(os.stat(filename).st_mode))
+            os.replace(tmp_name, filename)
+        except BaseException:
+            if os.path.exists(tmp_name):
+                os.unlink(tmp_name)
+            raise
+        # make the rename itself durable
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+    controlbeast.utils.template
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import atexit
+import codecs
+from collections import OrderedDict
+import copy
+import hashlib
+import os
+import pickle
+import stat
+import string
+import threading
+from controlbeast.conf import get_conf, CbConf
+from controlbeast.utils.file import CbFile
+from controlbeast.utils.singleton import CbSingleton
+
+
+#: Formatter resolving and converting the replacement fields of compiled templates
+_formatter = string.Formatter()
+
+#: Version of the on-disk cache layout; cache files of other versions are ignored
+_CACHE_VERSION = 1
+
+#: Number of bytes read at once when inspecting template files
+_READ_CHUNK = 64 * 1024
+
+
+def compile_template(content):
+    """
+    Split a template into its format segments.
+
+    :param str content: template using Python format strings
+    :return:            list of tuples, each consisting of literal text, field name, format specification
+                        and conversion, as returned by :py:meth:`string.Formatter.parse`
+    :rtype:             list
+    """
+    return list(_formatter.parse(content))
+
+
+def render_fields(segments, conf):
+    """
+    Render the replacement fields of a compiled template.
+
+    :param list segments:   format segments as returned by :py:func:`compile_template`
+    :param conf:            mapping the fields are resolved against
+    :return:                rendered fields, in the order of the segments
+    :rtype:                 list
+    """
+    values = []
+    for literal, field_name, format_spec, conversion in segments:
+        if field_name is None:
+            continue
+        value = _formatter.convert_field(_formatter.get_field(field_name, (), conf)[0], conversion)
+        if format_spec and '{' in format_spec:
+            # nested replacement fields within the format specification
+            format_spec = _formatter.vformat(format_spec, (), conf)
+        values.append(format(value, format_spec or ''))
+    return values
+
+
+def join_fields(segments, values):
+    """
+    Assemble a compiled template from its literal text and its rendered fields.
+
+    :param list segments:   format segments as returned by :py:func:`compile_template`
+    :param list values:     rendered fields as returned by :py:func:`render_fields`
+    :return:                rendered template
+    :rtype:                 str
+    """
+    values = iter(values)
+    parts = []
+    for literal, field_name, format_spec, conversion in segments:
+        parts.append(literal)
+        if field_name is not None:
+            parts.append(next(values))
+    return ''.join(parts)
+
+
+@CbSingleton
+class CbTemplateCache(CbFile):
+    """
+    Process-wide cache of compiled and parsed templates.
+
+    Template files are compiled into their format segments once (cf. :py:func:`compile_template`), so
+    rendering them only resolves the replacement fields against the configuration. Parsed templates, e. g.
+    YAML files, are cached per configuration fingerprint, which is derived from the rendered values of the
+    fields they actually use. Entries are keyed by file name, modification time and size, so changing a file
+    invalidates its entries. At most ``TEMPLATE_CACHE_SIZE`` entries are kept, evicting the entries used least
+    recently.
+    Example::
+
+       cache = CbTemplateCache.get_instance()
+       content = cache.render('/my/template/file.txt')
+       data = cache.parse('/my/template/__init__.yml', safe_load)
+       digest = cache.verbatim('/my/template/firmware.bin')
+
+    If the ``TEMPLATE_CACHE_FILE`` setting names a file, the cache is written into that file when the
+    process exits, and read from it on first use, so it is shared by subsequent invocations of ControlBeast.
+
+    .. note::
+
+       The on-disk cache is serialised using :py:mod:`pickle`. It is only read if it is owned by the current
+       user and cannot be written by anybody else.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = None
+        self._dirty = False
+        self._registered = False
+
+    def _load(self):
+        """
+        Read the cache file, unless it has already been read.
+        """
+        if self._entries is not None:
+            return
+        self._entries = OrderedDict()
+        filename = get_conf('TEMPLATE_CACHE_FILE')
+        if not filename:
+            return
+        try:
+            with open(filename, 'rb') as fp:
+                status = os.fstat(fp.fileno())
+                if status.st_uid != os.getuid() or stat.S_IMODE(status.st_mode) & 0o022:
+                    return
+                version, entries = pickle.load(fp)
+        except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+            return
+        if version == _CACHE_VERSION and isinstance(entries, OrderedDict):
+            self._entries = entries
+            self._evict()
+
+    def save(self):
+        """
+        Write the cache file, if the cache has been changed since it has been read.
+        """
+        filename = get_conf('TEMPLATE_CACHE_FILE')
+        with self._lock:
+            if not filename or not self._dirty:
+                return
+            try:
+                os.makedirs(os.path.dirname(filename), mode=0o700, exist_ok=True)
+                self._write_atomic(filename, pickle.dumps((_CACHE_VERSION, self._entries)))
+                os.chmod(filename, 0o600)
+            except OSError:
+                return
+            self._dirty = False
+
+    def _evict(self):
+        """
+        Evict the entries used least recently, until the cache size is not exceeded.
+        """
+        while len(self._entries) > get_conf('TEMPLATE_CACHE_SIZE'):
+            self._entries.popitem(last=False)
+
+    def _lookup(self, key):
+        """
+        Get an entry from the cache, marking it as used most recently.
+
+        :param tuple key:   key of the entry
+        :return:            cached value, or ``None`` if the entry has not been cached
+        """
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def _store(self, key, value):
+        """
+        Put an entry into the cache, evicting the entries used least recently.
+
+        :param tuple key:   key of the entry
+        :param value:       value to be cached
+        """
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        self._evict()
+        self._dirty = True
+        if get_conf('TEMPLATE_CACHE_FILE') and not self._registered:
+            atexit.register(self.save)
+            self._registered = True
+
+    def _compile(self, filename):
+        """
+        Get the compiled template of a file, compiling it unless it has been cached.
+
+        :param str filename:    name of the template file
+        :return:                tuple of the cache key of the file and its format segments
+        :rtype:                 tuple
+        """
+        filename = os.path.abspath(filename)
+        status = os.stat(filename)
+        key = (filename, status.st_mtime_ns, status.st_size)
+        segments = self._lookup(('template', ) + key)
+        if segments is None:
+            with open(filename, 'r') as fp:
+                segments = compile_template(fp.read())
+            self._store(('template', ) + key, segments)
+        return key, segments
+
+    def render(self, filename, conf=None):
+        """
+        Render a template file.
+
+        :param str filename:    name of the template file
+        :param conf:            mapping the replacement fields are resolved against. Defaults to the
+                                configuration settings.
+        :return:                rendered template
+        :rtype:                 str
+        """
+        conf = CbConf.get_instance() if conf is None else conf
+        with self._lock:
+            self._load()
+            key, segments = self._compile(filename)
+        return join_fields(segments, render_fields(segments, conf))
+
+    def parse(self, filename, parser, conf=None):
+        """
+        Render and parse a template file, e. g. a YAML file using Python format strings.
+
+        :param str filename:    name of the template file
+        :param parser:          callable parsing the rendered template, e. g.
+                                :py:func:`~controlbeast.utils.yaml.safe_load`
+        :param conf:            mapping the replacement fields are resolved against. Defaults to the
+                                configuration settings.
+        :return:                result of ``parser``; a copy which may be modified without affecting the cache
+        """
+        conf = CbConf.get_instance() if conf is None else conf
+        with self._lock:
+            self._load()
+            key, segments = self._compile(filename)
+            values = render_fields(segments, conf)
+            fingerprint = hashlib.sha256(repr(values).encode()).hexdigest()
+            key = ('parsed', '{}.{}'.format(parser.__module__, parser.__qualname__)) + key + (fingerprint, )
+            data = self._lookup(key)
+            if data is None:
+                data = (parser(join_fields(segments, values)), )
+                self._store(key, data)
+        return copy.deepcopy(data[0])
+
+    def verbatim(self, filename):
+        """
+        Check whether a template file is to be deployed verbatim.
+
+        Files are deployed verbatim if rendering them cannot change their content, i. e. if they contain no
+        curly braces, or if they cannot be decoded using ``DEFAULT_CHARSET`` and thus are no templates at all.
+
+        :param str filename:    name of the template file
+        :return:                SHA256 digest of the file's content if it is to be deployed verbatim,
+                                otherwise ``None``
+        :rtype:                 bytes
+        """
+        filename = os.path.abspath(filename)
+        status = os.stat(filename)
+        key = ('verbatim', filename, status.st_mtime_ns, status.st_size)
+        with self._lock:
+            self._load()
+            result = self._lookup(key)
+        if result is None:
+            result = (self._inspect(filename), )
+            with self._lock:
+                self._store(key, result)
+        return result[0]
+
+    @staticmethod
+    def _inspect(filename):
+        """
+        Read a template file, determining whether it is to be deployed verbatim.
+
+        :param str filename:    name of the template file
+        :return:                SHA256 digest of the file's content if it is to be deployed verbatim,
+                                otherwise ``None``
+        :rtype:                 bytes
+        """
+        digest = hashlib.sha256()
+        decoder = codecs.getincrementaldecoder(get_conf('DEFAULT_CHARSET'))()
+        braces = False
+        text = True
+        with open(filename, 'rb') as fp:
+            for chunk in iter(lambda: fp.read(_READ_CHUNK), b''):
+                digest.update(chunk)
+                braces = braces or b'{' in chunk or b'}' in chunk
+                if text:
+                    try:
+                        decoder.decode(chunk)
+                    except UnicodeDecodeError:
+                        text = False
+        if text:
+            try:
+                decoder.decode(b'', final=True)
+            except UnicodeDecodeError:
+                text = False
+        return digest.digest() if not braces or not text else None
+
+    def clear(self):
+        """
+        Discard all cache entries, also within the cache file.
+        """
+        with self._lock:
+            self._entries = OrderedDict()
+            self._dirty = True
+            self.save()
@@ -9,8 +9,49 @@
 import os
 import yaml
 from controlbeast.conf import CbConf
+from controlbeast.utils.convert import to_str
 from controlbeast.utils.dynamic import CbDynamicIterable
 from controlbeast.utils.file import CbFile
+from controlbeast.utils.template import CbTemplateCache
+
+
+#: YAML loader class used by :py:func:`safe_load`, preferring the libyaml based implementation
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+#: YAML dumper class used by :py:func:`safe_dump`, preferring the libyaml based implementation
+Dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+
+def safe_load(stream):
+    """
+    Parse a YAML document, restricted to standard YAML tags.
+
+    All YAML input within ControlBeast should be parsed using this function. It uses libyaml's
+    ``CSafeLoader`` if PyYAML has been built with libyaml support, and PyYAML's pure Python
+    ``SafeLoader`` otherwise.
+
+    :param stream:  string, byte sequence or open file containing the YAML document
+    :return:        Python object represented by the YAML document
+    """
+    return yaml.load(stream, Loader=Loader)
+
+
+def safe_dump(data, stream=None, **kwargs):
+    """
+    Serialise a Python object into a YAML document, restricted to standard YAML tags.
+
+    All YAML output within ControlBeast should be generated using this function. It uses libyaml's
+    ``CSafeDumper`` if PyYAML has been built with libyaml support, and PyYAML's pure Python
+    ``SafeDumper`` otherwise. Both produce identical output. Unless specified otherwise, collections
+    are serialised in block style.
+
+    :param data:    Python object to be serialised
+    :param stream:  open file to write the YAML document to. If ``None``, the document is returned.
+    :param kwargs:  further keyword arguments accepted by :py:func:`yaml.dump`
+    :return:        the YAML document if no stream has been passed, otherwise ``None``
+    """
+    kwargs.setdefault('default_flow_style', False)
+    return yaml.dump(data, stream, Dumper=Dumper, **kwargs)
 
 
 class CbYaml(CbDynamicIterable, CbFile):
@@ -19,27 +60,45 @@ class CbYaml(CbDynamicIterable, CbFile):
 
     This wrapper allows using Python format strings within YAML source
     files, referring to any name defined in :py:mod:`~controlbeast.conf.default`.
+
+    YAML files are read through the :py:class:`~controlbeast.utils.template.CbTemplateCache`, so a file is
+    only read and parsed again if it or the settings it refers to have changed.
+
+    Instead of a file name, the YAML source's ``content`` may be passed, e. g. if it has not been read
+    from the working tree (cf. :py:class:`~controlbeast.core.source.CbYamlSource`).
+
+    :param str filename:    file name of the YAML file used as data source
+    :param content:         content of the YAML data source, as string or byte sequence
     """
 
     #: File name of the YAML file used as data source
     _filename = None
 
-    def __init__(self, filename=''):
+    def __init__(self, filename='', content=None):
         """
         CbYaml constructor
         """
         if self._check_file_exists(filename) and self._check_access(filename, os.R_OK):
             self._filename = filename
         if self._filename:
-            conf = CbConf.get_instance()
-            with open(self._filename, 'r') as fp:
-                content = fp.read()
-                content = content.format(**conf)
-                yaml_dict = yaml.safe_load(content)
+            yaml_dict = CbTemplateCache.get_instance().parse(self._filename, safe_load)
+        elif content is not None:
+            yaml_dict = self.parse(content)
         else:
             yaml_dict = None
         super(CbYaml, self).__init__(dict=yaml_dict)
 
+    @staticmethod
+    def parse(content):
+        """
+        Parse the content of a YAML data source, replacing format strings by configuration settings.
+
+        :param content: content of the YAML data source, as string or byte sequence
+        :return:        Python object represented by the YAML data source
+        """
+        conf = CbConf.get_instance()
+        return safe_load(to_str(content).format(**conf))
+
     @property
     def filename(self):
         """
@@ -8,7 +8,10 @@
     :license: ISC, see LICENSE for details.
 """
 import os
-from distutils.core import setup
+try:
+    from setuptools import setup
+except ImportError:
+    from distutils.core import setup
 
 
 def get_packages(path='controlbeast'):
@@ -51,6 +54,7 @@ setup(
     long_description=get_long_description(),
     packages=get_packages(),
     scripts=['scripts/cb.py'],
+    python_requires='>=3.7',
     classifiers=[
         __import__('controlbeast').get_development_status(),
         'Environment :: Console',
@@ -60,8 +64,12 @@ setup(
         'Operating System :: POSIX',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         'Topic :: System :: Installation/Setup',
         'Topic :: System :: Software Distribution',
         'Topic :: System :: Systems Administration',
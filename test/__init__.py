@@ -5,4 +5,9 @@
 
     :copyright: Copyright 2013 by the ControlBeast team, see AUTHORS.
     :license: ISC, see LICENSE for details.
-"""
\ No newline at end of file
+"""
+from controlbeast.conf import CbConf
+
+
+# keep the test suite from reading or writing the user's cache of binaries
+CbConf.get_instance()['BINARY_CACHE_FILE'] = None
\ No newline at end of file
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+    test.t_controlbeast.t_core.test_CbFleetFunctions
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import os
+import tempfile
+from unittest import TestCase
+from controlbeast.conf import CbConf, get_conf
+from controlbeast.core.fleet import CbFleetIndex, create_hosts
+from controlbeast.scm.base import CbSCMBranchError
+from controlbeast.scm.git import Git, GitCatFile
+
+
+class TestCbFleetFunctions(TestCase):
+    """
+    Class providing unit tests for the functions of the fleet module.
+
+    **Covered test cases:**
+
+    ==============  ========================================================================================
+    Test Case       Description
+    ==============  ========================================================================================
+    01              Create several hosts at once.
+    02              Try creating hosts using an identifier already in use.
+    03              Try creating hosts from a source branch which does not exist.
+    04              Create hosts while key stores are configured to be kept within SQLite databases.
+    ==============  ========================================================================================
+    """
+
+    def setUp(self):
+        self.td = tempfile.TemporaryDirectory()
+        self.path = self.td.name
+        self.git = Git()
+        self.git.init(path=self.path)
+        fp = open(os.path.join(self.path, 'README'), 'w')
+        fp.write("Test file content")
+        fp.close()
+        self.git.commit(path=self.path, message="Initial commit")
+
+    def tearDown(self):
+        self.td.cleanup()
+
+    def test_01(self):
+        """
+        Test Case 01:
+        Create several hosts at once.
+
+        Test is passed if a branch with an initial key store has been created for each host, without
+        checking out any branch, and the hosts show up within the fleet index.
+        """
+        names = ['host{:02d}'.format(i) for i in range(20)]
+        hosts = create_hosts(path=self.path, names=names + ['host00'])
+        self.assertListEqual(sorted(hosts), names)
+        self.assertListEqual(self.git.get_branches(path=self.path), names + ['master'])
+        self.assertEqual(self.git.get_active_branch(path=self.path), 'master')
+        self.assertFalse(os.path.exists(os.path.join(self.path, get_conf('HOST_KEY_STORE'))))
+        index = CbFleetIndex(path=self.path)
+        index.refresh()
+        self.assertDictEqual(index.data, dict((name, {'stage': get_conf('STAGE_UNDEFINED')}) for name in names))
+
+    def test_02(self):
+        """
+        Test Case 02:
+        Try creating hosts using an identifier already in use.
+
+        Test is passed if :py:exc:`~controlbeast.scm.base.CbSCMBranchError` is raised and no host is created.
+        """
+        create_hosts(path=self.path, names=['host1'])
+        with self.assertRaises(CbSCMBranchError):
+            create_hosts(path=self.path, names=['host2', 'host1'])
+        self.assertListEqual(self.git.get_branches(path=self.path), ['host1', 'master'])
+
+    def test_03(self):
+        """
+        Test Case 03:
+        Try creating hosts from a source branch which does not exist.
+
+        Test is passed if :py:exc:`~controlbeast.scm.base.CbSCMBranchError` is raised and no host is created.
+        """
+        with self.assertRaises(CbSCMBranchError):
+            create_hosts(path=self.path, names=['host1'], source='template')
+        self.assertListEqual(self.git.get_branches(path=self.path), ['master'])
+
+    def test_04(self):
+        """
+        Test Case 04:
+        Create hosts while key stores are configured to be kept within SQLite databases.
+
+        Test is passed if the committed key stores are plain text key stores holding the initial data.
+        """
+        conf = CbConf.get_instance()
+        self.addCleanup(conf.__setitem__, 'KEY_STORE_LAYOUT', conf['KEY_STORE_LAYOUT'])
+        conf['KEY_STORE_LAYOUT'] = 'sqlite'
+        create_hosts(path=self.path, names=['host1'])
+        with GitCatFile(self.path) as reader:
+            blob = reader.read(['host1:{}'.format(get_conf('HOST_KEY_STORE').replace(os.sep, '/'))])[0]
+        self.assertFalse(blob.content.startswith(b'SQLite format 3'))
+        index = CbFleetIndex(path=self.path)
+        index.refresh()
+        self.assertDictEqual(index.data, {'host1': {'stage': get_conf('STAGE_UNDEFINED')}})
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+    test.t_controlbeast.t_core.test_CbFleetIndex
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import os
+import tempfile
+from unittest import TestCase, skipUnless
+from controlbeast.conf import get_conf
+from controlbeast.core.fleet import CbFleetIndex
+from controlbeast.keystore import CbKeyStore, CbKsPasswordError
+from controlbeast.keystore import cipher
+from controlbeast.scm.git import Git
+
+
+class TestCbFleetIndex(TestCase):
+    """
+    Class providing unit tests for the CbFleetIndex class.
+
+    **Covered test cases:**
+
+    ==============  ========================================================================================
+    Test Case       Description
+    ==============  ========================================================================================
+    01              Index the stages of several hosts without checking out their branches.
+    02              Refresh an index after one host has changed.
+    03              Restore an index from its cache file.
+    04              Index encrypted key stores.
+    05              Try indexing encrypted key stores using a wrong passphrase.
+    06              Index key stores encrypted per entry.
+    ==============  ========================================================================================
+    """
+
+    def setUp(self):
+        self.td = tempfile.TemporaryDirectory()
+        self.path = self.td.name
+        self.git = Git()
+        self.git.init(path=self.path)
+        fp = open(os.path.join(self.path, 'README'), 'w')
+        fp.write("Test file content")
+        fp.close()
+        self.git.commit(path=self.path, message="Initial commit")
+
+    def tearDown(self):
+        self.td.cleanup()
+
+    def _add_host(self, name, stage, passphrase='', layout=None):
+        """
+        Create a host branch with a committed key store, and switch back to the master branch.
+        """
+        self.git.create_branch(path=self.path, name=name)
+        self.git.checkout(path=self.path, name=name)
+        self._set_stage(stage, passphrase, layout)
+        self.git.checkout(path=self.path, name='master')
+
+    def _set_stage(self, stage, passphrase='', layout=None):
+        """
+        Update the key store of the branch checked out, and commit the update.
+        """
+        filename = os.path.join(self.path, get_conf('HOST_KEY_STORE'))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        store = CbKeyStore(file=filename, passphrase=passphrase, layout=layout)
+        store['stage'] = stage
+        store['secret'] = 'confidential'
+        store = None
+        self.git.commit(path=self.path, message="Update stage")
+
+    def test_01(self):
+        """
+        Test Case 01:
+        Index the stages of several hosts without checking out their branches.
+
+        Test is passed if all hosts, but not the master branch, are indexed with their stages only.
+        """
+        self._add_host('host1', get_conf('STAGE_INSTALLED'))
+        self._add_host('host2', get_conf('STAGE_SERVICE'))
+        obj = CbFleetIndex(path=self.path)
+        self.assertListEqual(obj.refresh(), ['host1', 'host2', 'master'])
+        self.assertDictEqual(obj.data, {
+            'host1': {'stage': get_conf('STAGE_INSTALLED')},
+            'host2': {'stage': get_conf('STAGE_SERVICE')},
+        })
+        self.assertEqual(self.git.get_active_branch(path=self.path), 'master')
+
+    def test_02(self):
+        """
+        Test Case 02:
+        Refresh an index after one host has changed.
+
+        Test is passed if only the changed host is read again, and its new stage is indexed.
+        """
+        self._add_host('host1', get_conf('STAGE_INSTALLED'))
+        self._add_host('host2', get_conf('STAGE_INSTALLED'))
+        obj = CbFleetIndex(path=self.path)
+        obj.refresh()
+        self.assertListEqual(obj.refresh(), [])
+        self.git.checkout(path=self.path, name='host2')
+        self._set_stage(get_conf('STAGE_JAILS'))
+        self.assertListEqual(obj.refresh(), ['host2'])
+        self.assertEqual(obj['host1']['stage'], get_conf('STAGE_INSTALLED'))
+        self.assertEqual(obj['host2']['stage'], get_conf('STAGE_JAILS'))
+
+    def test_03(self):
+        """
+        Test Case 03:
+        Restore an index from its cache file.
+
+        Test is passed if a new index object reads nothing but the branches changed since, and the
+        cache file does not contain key store entries which have not been selected.
+        """
+        self._add_host('host1', get_conf('STAGE_INSTALLED'))
+        self._add_host('host2', get_conf('STAGE_INSTALLED'))
+        CbFleetIndex(path=self.path).refresh()
+        with open(os.path.join(self.path, get_conf('FLEET_INDEX_FILE')), 'r') as fp:
+            self.assertNotIn('confidential', fp.read())
+        self._add_host('host3', get_conf('STAGE_PURGED'))
+        obj = CbFleetIndex(path=self.path)
+        self.assertEqual(obj['host1']['stage'], get_conf('STAGE_INSTALLED'))
+        self.assertListEqual(obj.refresh(), ['host3'])
+        self.assertListEqual(sorted(obj), ['host1', 'host2', 'host3'])
+
+    def test_04(self):
+        """
+        Test Case 04:
+        Index encrypted key stores.
+
+        Test is passed if the stages of all hosts are indexed.
+        """
+        for i in range(8):
+            self._add_host('host{}'.format(i), i, passphrase='secret')
+        obj = CbFleetIndex(path=self.path, passphrase='secret')
+        obj.refresh()
+        self.assertDictEqual(obj.data, {'host{}'.format(i): {'stage': i} for i in range(8)})
+
+    def test_05(self):
+        """
+        Test Case 05:
+        Try indexing encrypted key stores using a wrong passphrase.
+
+        Test is passed if a :py:exc:`~controlbeast.keystore.exception.CbKsPasswordError` is raised.
+        """
+        self._add_host('host1', get_conf('STAGE_INSTALLED'), passphrase='secret')
+        obj = CbFleetIndex(path=self.path, passphrase='sacred')
+        with self.assertRaises(CbKsPasswordError):
+            obj.refresh()
+
+    @skipUnless(cipher.is_available(), 'libcrypto not available')
+    def test_06(self):
+        """
+        Test Case 06:
+        Index key stores encrypted per entry.
+
+        Test is passed if the stages of all hosts are indexed.
+        """
+        self._add_host('host1', get_conf('STAGE_INSTALLED'), passphrase='secret', layout='entries')
+        self._add_host('host2', get_conf('STAGE_SERVICE'), passphrase='secret', layout='file')
+        obj = CbFleetIndex(path=self.path, passphrase='secret')
+        obj.refresh()
+        self.assertDictEqual(obj.data, {
+            'host1': {'stage': get_conf('STAGE_INSTALLED')},
+            'host2': {'stage': get_conf('STAGE_SERVICE')},
+        })
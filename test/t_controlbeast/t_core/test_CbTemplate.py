@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+    test.t_controlbeast.t_core.test_CbTemplate
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import errno
+import os
+import stat
+import tempfile
+from unittest import TestCase
+from controlbeast.conf import CbConf, get_conf
+from controlbeast.core.template import CbTemplate
+
+
+class TestCbTemplate(TestCase):
+    """
+    Class providing unit tests for the CbTemplate class.
+
+    **Covered test cases:**
+
+    ==============  ========================================================================================
+    Test Case       Description
+    ==============  ========================================================================================
+    01              Deploy the master template into an empty directory.
+    02              Deploy the master template again without any changes.
+    03              Deploy the master template over modified files.
+    04              Deploy a template containing binary assets and files without format strings.
+    05              Deploy verbatim files over modified files, without kernel-level copies being available.
+    ==============  ========================================================================================
+    """
+
+    def setUp(self):
+        self.td = tempfile.TemporaryDirectory()
+        self.path = self.td.name
+        self.files = sorted([
+            get_conf('HOST_NETWORK_FILE'), get_conf('HOST_RESCUE_FILE'), get_conf('HOST_FS_FILE'),
+            get_conf('HOST_OS_FILE'), get_conf('HOST_SERVICE_FILE'),
+        ])
+
+    def tearDown(self):
+        self.td.cleanup()
+
+    def _create_template(self):
+        """
+        Create a template containing a rendered file, a binary asset and an executable script, make it
+        available, and return the directory containing it.
+        """
+        template_path = os.path.join(self.path, 'templates')
+        root = os.path.join(template_path, 'assets')
+        os.makedirs(os.path.join(root, 'boot'))
+        with open(os.path.join(root, '__init__.yml'), 'w') as fp:
+            fp.write('dirs:\n  - boot\nfiles:\n  - boot/loader.bin\n  - boot/run.sh\n  - boot/loader.conf\n')
+        with open(os.path.join(root, 'boot', 'loader.bin'), 'wb') as fp:
+            fp.write(b'\xff{\xfe}' + os.urandom(256 * 1024))
+        with open(os.path.join(root, 'boot', 'run.sh'), 'w') as fp:
+            fp.write('#!/bin/sh\necho $HOME\n')
+        os.chmod(os.path.join(root, 'boot', 'run.sh'), 0o755)
+        with open(os.path.join(root, 'boot', 'loader.conf'), 'w') as fp:
+            fp.write('charset="{DEFAULT_CHARSET}"\n')
+        conf = CbConf.get_instance()
+        self.addCleanup(conf.__setitem__, 'TEMPLATE_PATH', conf['TEMPLATE_PATH'])
+        conf['TEMPLATE_PATH'] = template_path
+        self.target = os.path.join(self.path, 'target')
+        return root
+
+    def test_01(self):
+        """
+        Test Case 01:
+        Deploy the master template into an empty directory.
+
+        Test is passed if all template files are reported as created, and exist with their placeholders
+        replaced and with the permissions granted by the umask.
+        """
+        umask = os.umask(0o022)
+        os.umask(umask)
+        report = CbTemplate('master', self.path).deploy()
+        self.assertListEqual(sorted(report.created), self.files)
+        self.assertListEqual(report.changed, [])
+        self.assertListEqual(report.unchanged, [])
+        for filename in self.files:
+            with open(os.path.join(self.path, filename), 'r') as fp:
+                self.assertNotIn('{HOST_', fp.read())
+            self.assertEqual(stat.S_IMODE(os.stat(os.path.join(self.path, filename)).st_mode), 0o666 & ~umask)
+        self.assertTrue(os.path.isdir(os.path.join(self.path, 'conf', 'custom')))
+
+    def test_02(self):
+        """
+        Test Case 02:
+        Deploy the master template again without any changes.
+
+        Test is passed if all template files are reported as unchanged, and none of them has been rewritten.
+        """
+        CbTemplate('master', self.path).deploy()
+        for filename in self.files:
+            os.utime(os.path.join(self.path, filename), ns=(0, 0))
+        report = CbTemplate('master', self.path).deploy()
+        self.assertListEqual(sorted(report.unchanged), self.files)
+        self.assertListEqual(report.created + report.changed, [])
+        for filename in self.files:
+            self.assertEqual(os.stat(os.path.join(self.path, filename)).st_mtime_ns, 0)
+
+    def test_03(self):
+        """
+        Test Case 03:
+        Deploy the master template over modified files.
+
+        Test is passed if modified files, no matter whether their size has changed, are reported as changed
+        and restored, and deleted files are reported as created.
+        """
+        CbTemplate('master', self.path).deploy()
+        with open(os.path.join(self.path, self.files[0]), 'r') as fp:
+            original = fp.read()
+        with open(os.path.join(self.path, self.files[0]), 'w') as fp:
+            fp.write(original.swapcase())
+        with open(os.path.join(self.path, self.files[1]), 'a') as fp:
+            fp.write('appended: true\n')
+        os.unlink(os.path.join(self.path, self.files[2]))
+        report = CbTemplate('master', self.path).deploy()
+        self.assertListEqual(sorted(report.changed), self.files[:2])
+        self.assertListEqual(report.created, [self.files[2]])
+        self.assertListEqual(sorted(report.unchanged), self.files[3:])
+        with open(os.path.join(self.path, self.files[0]), 'r') as fp:
+            self.assertEqual(fp.read(), original)
+
+    def test_04(self):
+        """
+        Test Case 04:
+        Deploy a template containing binary assets and files without format strings.
+
+        Test is passed if the binary asset and the script are copied byte by byte, the script keeps being
+        executable, and the remaining file is rendered, being created with the permissions granted by the umask.
+        """
+        root = self._create_template()
+        report = CbTemplate('assets', self.target).deploy(workers=2)
+        self.assertListEqual(report.created, ['boot/loader.bin', 'boot/run.sh', 'boot/loader.conf'])
+        for filename in ('loader.bin', 'run.sh'):
+            with open(os.path.join(root, 'boot', filename), 'rb') as fp:
+                expected = fp.read()
+            with open(os.path.join(self.target, 'boot', filename), 'rb') as fp:
+                self.assertEqual(fp.read(), expected)
+        umask = os.umask(0o022)
+        os.umask(umask)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(self.target, 'boot', 'run.sh')).st_mode), 0o755 & ~umask)
+        self.assertEqual(
+            stat.S_IMODE(os.stat(os.path.join(self.target, 'boot', 'loader.conf')).st_mode), 0o666 & ~umask
+        )
+        with open(os.path.join(self.target, 'boot', 'loader.conf'), 'r') as fp:
+            self.assertEqual(fp.read(), 'charset="{}"\n'.format(get_conf('DEFAULT_CHARSET')))
+
+    def test_05(self):
+        """
+        Test Case 05:
+        Deploy verbatim files over modified files, without kernel-level copies being available.
+
+        Test is passed if only the modified file is reported as changed, and it is restored by copying
+        in user space.
+        """
+        root = self._create_template()
+        CbTemplate('assets', self.target).deploy()
+        with open(os.path.join(self.target, 'boot', 'loader.bin'), 'r+b') as fp:
+            fp.seek(1024)
+            fp.write(b'modified')
+
+        def unavailable(*args):
+            raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+
+        def unsupported(*args):
+            # sendfile of platforms supporting sockets as target only
+            raise TypeError('offset must be an integer')
+
+        replacements = {'copy_file_range': unavailable, 'sendfile': unsupported}
+        methods = dict((name, getattr(os, name)) for name in replacements if hasattr(os, name))
+        try:
+            for name in methods:
+                setattr(os, name, replacements[name])
+            report = CbTemplate('assets', self.target).deploy()
+        finally:
+            for name, method in methods.items():
+                setattr(os, name, method)
+        self.assertListEqual(report.changed, ['boot/loader.bin'])
+        self.assertListEqual(sorted(report.unchanged), ['boot/loader.conf', 'boot/run.sh'])
+        with open(os.path.join(root, 'boot', 'loader.bin'), 'rb') as fp:
+            expected = fp.read()
+        with open(os.path.join(self.target, 'boot', 'loader.bin'), 'rb') as fp:
+            self.assertEqual(fp.read(), expected)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+    test.t_controlbeast.t_core.test_CbYamlSource
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import os
+import tempfile
+from unittest import TestCase
+from controlbeast.conf import get_conf
+from controlbeast.core.source import CbYamlSource
+from controlbeast.scm.git import Git
+from controlbeast.utils.yaml import CbYaml
+
+
+class TestCbYamlSource(TestCase):
+    """
+    Class providing unit tests for the CbYamlSource class.
+
+    **Covered test cases:**
+
+    ==============  ========================================================================================
+    Test Case       Description
+    ==============  ========================================================================================
+    01              Read a file from a branch which is not checked out.
+    02              Read several files from several branches at once.
+    03              Read a file from a commit which has been superseded.
+    04              Read a file shared by several branches.
+    05              Modify a file's content read from a branch.
+    ==============  ========================================================================================
+    """
+
+    def setUp(self):
+        self.td = tempfile.TemporaryDirectory()
+        self.path = self.td.name
+        self.git = Git()
+        self.git.init(path=self.path)
+        self._write(get_conf('HOST_OS_FILE'), "family: FreeBSD\n")
+        self.git.commit(path=self.path, message="Initial commit")
+
+    def tearDown(self):
+        self.td.cleanup()
+
+    def _write(self, filename, content, branch=None):
+        """
+        Write a file into the working tree of a branch, and commit it.
+        """
+        path = self.path
+        if branch:
+            if branch not in self.git.get_branches(path=self.path):
+                self.git.create_branch(path=self.path, name=branch)
+            path = self.git.get_workspace(path=self.path, name=branch)
+        filename = os.path.join(path, filename)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'w') as fp:
+            fp.write(content)
+        if branch:
+            self.git.commit(path=path, message="Update {}".format(filename))
+
+    def test_01(self):
+        """
+        Test Case 01:
+        Read a file from a branch which is not checked out.
+
+        Test is passed if the file's content is returned, with format strings replaced by settings.
+        """
+        self._write(get_conf('HOST_NETWORK_FILE'), "address: 192.0.2.1\nstage: {STAGE_INSTALLED}\n", 'host1')
+        with CbYamlSource(path=self.path) as source:
+            network = source.get('host1', get_conf('HOST_NETWORK_FILE'))
+        self.assertIsInstance(network, CbYaml)
+        self.assertDictEqual(dict(network), {'address': '192.0.2.1', 'stage': get_conf('STAGE_INSTALLED')})
+        self.assertEqual(self.git.get_active_branch(path=self.path), 'master')
+
+    def test_02(self):
+        """
+        Test Case 02:
+        Read several files from several branches at once.
+
+        Test is passed if all files are returned per branch and file name, with ``None`` for missing files
+        and missing branches.
+        """
+        for i in range(5):
+            self._write(get_conf('HOST_NETWORK_FILE'), "address: 192.0.2.{}\n".format(i), 'host{}'.format(i))
+        hosts = ['host{}'.format(i) for i in range(5)] + ['missing']
+        files = [get_conf('HOST_NETWORK_FILE'), get_conf('HOST_OS_FILE'), get_conf('HOST_FS_FILE')]
+        with CbYamlSource(path=self.path) as source:
+            result = source.get_many(hosts, files)
+        for i in range(5):
+            self.assertEqual(result['host{}'.format(i)][get_conf('HOST_NETWORK_FILE')]['address'], '192.0.2.{}'.format(i))
+            self.assertEqual(result['host{}'.format(i)][get_conf('HOST_OS_FILE')]['family'], 'FreeBSD')
+            self.assertIsNone(result['host{}'.format(i)][get_conf('HOST_FS_FILE')])
+        self.assertDictEqual(result['missing'], dict.fromkeys(files))
+
+    def test_03(self):
+        """
+        Test Case 03:
+        Read a file from a commit which has been superseded.
+
+        Test is passed if the file's content is returned as committed back then.
+        """
+        self._write(get_conf('HOST_NETWORK_FILE'), "address: 192.0.2.1\n", 'host1')
+        commit = self.git.get_branch_tips(path=self.path)['host1']
+        self._write(get_conf('HOST_NETWORK_FILE'), "address: 192.0.2.2\n", 'host1')
+        with CbYamlSource(path=self.path) as source:
+            self.assertEqual(source.get(commit, get_conf('HOST_NETWORK_FILE'))['address'], '192.0.2.1')
+            self.assertEqual(source.get('host1', get_conf('HOST_NETWORK_FILE'))['address'], '192.0.2.2')
+
+    def test_04(self):
+        """
+        Test Case 04:
+        Read a file shared by several branches.
+
+        Test is passed if the file is parsed only once, also when read again.
+        """
+        for i in range(3):
+            self.git.create_branch(path=self.path, name='host{}'.format(i))
+        parsed = []
+        parse = CbYaml.parse
+
+        def counting_parse(content):
+            parsed.append(content)
+            return parse(content)
+
+        with CbYamlSource(path=self.path) as source:
+            CbYaml.parse = staticmethod(counting_parse)
+            try:
+                source.get_many(['host0', 'host1', 'host2'], [get_conf('HOST_OS_FILE')])
+                source.get('master', get_conf('HOST_OS_FILE'))
+            finally:
+                CbYaml.parse = staticmethod(parse)
+        self.assertEqual(len(parsed), 1)
+
+    def test_05(self):
+        """
+        Test Case 05:
+        Modify a file's content read from a branch.
+
+        Test is passed if the modification does not affect the content read again.
+        """
+        with CbYamlSource(path=self.path) as source:
+            os_file = source.get('master', get_conf('HOST_OS_FILE'))
+            os_file['family'] = 'Linux'
+            self.assertEqual(source.get('master', get_conf('HOST_OS_FILE'))['family'], 'FreeBSD')
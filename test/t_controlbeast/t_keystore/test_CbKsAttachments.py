@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+    test.t_controlbeast.t_keystore.test_CbKsAttachments
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import hashlib
+import io
+import os
+import tempfile
+from unittest import TestCase, skipUnless
+from controlbeast.conf import get_conf
+from controlbeast.keystore import cipher
+from controlbeast.keystore.attachment import CbKsAttachments
+from controlbeast.keystore.exception import CbKsFormatError, CbKsPasswordError
+
+
+class TestCbKsAttachments(TestCase):
+    """
+    Class providing unit tests for the CbKsAttachments class.
+
+    **Covered test cases:**
+
+    ==============  ========================================================================================
+    Test Case       Description
+    ==============  ========================================================================================
+    01              Store and read an attachment larger than one chunk without encryption.
+    02              Store the same content twice.
+    03              Store and read an encrypted attachment.
+    04              Try reading an encrypted attachment using a wrong passphrase.
+    05              Try reading a tampered encrypted attachment.
+    06              Purge attachments which are not referenced.
+    07              Try reading attachments using references not naming an attachment by its digest.
+    ==============  ========================================================================================
+    """
+
+    def setUp(self):
+        self.td = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.td.name, 'attachments')
+        self.content = os.urandom(get_conf('KEY_STORE_ATTACHMENT_CHUNK') * 3 + 123)
+
+    def tearDown(self):
+        self.td.cleanup()
+
+    def test_01(self):
+        """
+        Test Case 01:
+        Store and read an attachment larger than one chunk without encryption.
+
+        Test is passed if the attachment is named after the SHA-256 hash of its content, and its content
+        is read in several chunks, none of them exceeding the configured chunk size.
+        """
+        obj = CbKsAttachments(self.path)
+        reference = obj.put(io.BytesIO(self.content))
+        self.assertDictEqual(reference, {'attachment': hashlib.sha256(self.content).hexdigest(), 'size': len(self.content)})
+        chunks = list(obj.get(reference))
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= get_conf('KEY_STORE_ATTACHMENT_CHUNK') for chunk in chunks))
+        self.assertEqual(b''.join(chunks), self.content)
+
+    def test_02(self):
+        """
+        Test Case 02:
+        Store the same content twice.
+
+        Test is passed if both references are equal and only one file is stored.
+        """
+        filename = os.path.join(self.td.name, 'source')
+        with open(filename, 'wb') as fp:
+            fp.write(self.content)
+        obj = CbKsAttachments(self.path)
+        self.assertDictEqual(obj.put(filename), obj.put(io.BytesIO(self.content)))
+        self.assertEqual(len([name for name in os.listdir(self.path) if not name.startswith('.')]), 1)
+
+    @skipUnless(cipher.is_available(), 'libcrypto not available')
+    def test_03(self):
+        """
+        Test Case 03:
+        Store and read an encrypted attachment.
+
+        Test is passed if neither the file name nor the file content reveal the attachment's content,
+        and another object using the same passphrase reads the original content.
+        """
+        reference = CbKsAttachments(self.path, 'secret').put(io.BytesIO(self.content))
+        self.assertNotEqual(reference['attachment'], hashlib.sha256(self.content).hexdigest())
+        with open(os.path.join(self.path, reference['attachment']), 'rb') as fp:
+            self.assertNotIn(self.content[:64], fp.read())
+        destination = io.BytesIO()
+        CbKsAttachments(self.path, 'secret').extract(reference, destination)
+        self.assertEqual(destination.getvalue(), self.content)
+
+    @skipUnless(cipher.is_available(), 'libcrypto not available')
+    def test_04(self):
+        """
+        Test Case 04:
+        Try reading an encrypted attachment using a wrong passphrase.
+
+        Test is passed if a :py:exc:`~controlbeast.keystore.exception.CbKsPasswordError` is raised.
+        """
+        reference = CbKsAttachments(self.path, 'secret').put(io.BytesIO(self.content))
+        with self.assertRaises(CbKsPasswordError):
+            list(CbKsAttachments(self.path, 'sacred').get(reference))
+
+    @skipUnless(cipher.is_available(), 'libcrypto not available')
+    def test_05(self):
+        """
+        Test Case 05:
+        Try reading a tampered encrypted attachment.
+
+        Test is passed if a :py:exc:`~controlbeast.keystore.exception.CbKsPasswordError` is raised
+        before any content is returned.
+        """
+        obj = CbKsAttachments(self.path, 'secret')
+        reference = obj.put(io.BytesIO(self.content))
+        with open(obj.filename(reference), 'r+b') as fp:
+            fp.seek(-100, os.SEEK_END)
+            byte = fp.read(1)
+            fp.seek(-100, os.SEEK_END)
+            fp.write(bytes([byte[0] ^ 1]))
+        chunks = []
+        with self.assertRaises(CbKsPasswordError):
+            for chunk in obj.get(reference):
+                chunks.append(chunk)
+        self.assertListEqual(chunks, [])
+
+    def test_06(self):
+        """
+        Test Case 06:
+        Purge attachments which are not referenced.
+
+        Test is passed if only the referenced attachment remains readable.
+        """
+        obj = CbKsAttachments(self.path)
+        keep = obj.put(io.BytesIO(b'keep'))
+        drop = obj.put(io.BytesIO(b'drop'))
+        self.assertEqual(obj.purge([keep]), 1)
+        self.assertEqual(b''.join(obj.get(keep)), b'keep')
+        self.assertFalse(os.path.exists(obj.filename(drop)))
+
+    def test_07(self):
+        """
+        Test Case 07:
+        Try reading attachments using references not naming an attachment by its digest.
+
+        Test is passed if a :py:exc:`~controlbeast.keystore.exception.CbKsFormatError` is raised for each
+        reference, and no file outside the attachment directory is read.
+        """
+        obj = CbKsAttachments(self.path)
+        reference = obj.put(io.BytesIO(b'content'))
+        for name in ('../' + reference['attachment'], '/etc/passwd', reference['attachment'].upper(), '', 42):
+            with self.assertRaises(CbKsFormatError):
+                list(obj.get({'attachment': name, 'size': 7}))
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+    test.t_controlbeast.t_keystore.test_CbKsCrypto
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import asyncio
+import os
+import tempfile
+from unittest import TestCase, skipUnless
+from controlbeast.keystore import cipher
+from controlbeast.keystore.crypto import CbKsCrypto
+from controlbeast.keystore.exception import CbKsPasswordError, CbKsFormatError
+
+
+class TestCbKsCrypto(TestCase):
+    """
+    Class providing unit tests for the CbKsCrypto class.
+
+    **Covered test cases:**
+
+    ==============  ========================================================================================
+    Test Case       Description
+    ==============  ========================================================================================
+    01              Encrypt in process and try decrypting using the openssl command line utility.
+    02              Encrypt using the openssl command line utility and decrypt in process.
+    03              Try decrypting in process using a wrong passphrase.
+    04              Decrypt a ciphertext using MD5 key derivation (OpenSSL < 1.1.0) in process.
+    05              Decrypt a ciphertext not read from the file, both in process and using openssl.
+    06              Update a file written in the legacy openssl format.
+    07              Update a file repeatedly, reusing the derived key.
+    08              Encrypt and decrypt using scrypt for key derivation.
+    09              Try decrypting a tampered ciphertext.
+    10              Encrypt and decrypt several ciphertexts at once using coroutines, in process and using openssl.
+    11              Try decrypting ciphertexts with missing, unexpected or excessive key derivation parameters.
+    ==============  ========================================================================================
+    """
+
+    def setUp(self):
+        with tempfile.NamedTemporaryFile() as tmp:
+            self.filename = tmp.name
+
+    def tearDown(self):
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+
+    @skipUnless(cipher.is_available(), 'libcrypto not available')
+    def test_01(self):
+        """
+        Test Case 01:
+        Encrypt in process and try decrypting using the openssl command line utility.
+
+        Test is passed if a :py:exc:`~controlbeast.keystore.exception.CbKsFormatError` is raised, since
+        the openssl command line utility cannot read the ControlBeast key store format.
+        """
+        obj_1 = CbKsCrypto(file=self.filename, passphrase='secret')
+        obj_1.plaintext = 'My very secret content'
+        obj_2 = CbKsCrypto(file=self.filename, passphrase='secret')
+        obj_2._in_process = False
+        with self.assertRaises(CbKsFormatError):
+            obj_2.reload()
+
+    @skipUnless(cipher.is_available(), 'libcrypto not available')
+    def test_02(self):
+        """
+        Test Case 02:
+        Encrypt using the openssl command line utility and decrypt in process.
+
+        Test is passed if the in-process decryption restores the original plaintext.
+        """
+        obj_1 = CbKsCrypto(file=self.filename, passphrase='secret')
+        obj_1._in_process = False
+        obj_1.plaintext = 'My very secret content'
+        obj_2 = CbKsCrypto(file=self.filename, passphrase='secret')
+        self.assertEqual(obj_2.plaintext, 'My very secret content')
+        self.assertEqual(obj_2.return_code, os.EX_OK)
+
+    @skipUnless(cipher.is_available(), 'libcrypto not available')
+    def test_03(self):
+        """
+        Test Case 03:
+        Try decrypting in process using a wrong passphrase.
+
+        Test is passed if the failure is reported the same way the openssl command line utility would report it.
+        """
+        obj_1 = CbKsCrypto(file=self.filename, passphrase='secret')
+        obj_1.plaintext = 'My very secret content'
+        obj_2 = CbKsCrypto(file=self.filename, passphrase='sacred')
+        self.assertEqual(obj_2.plaintext, '')
+        self.assertNotEqual(obj_2.return_code, os.EX_OK)
+        self.assertIn('bad decrypt', obj_2.stderr)
+
+    @skipUnless(cipher.is_available(), 'libcrypto not available')
+    def test_04(self):
+        """
+        Test Case 04:
+        Decrypt a ciphertext using MD5 key derivation (OpenSSL < 1.1.0) in process.
+
+        Test is passed if the in-process decryption restores the original plaintext.
+        """
+        with open(self.filename, 'wb') as fp:
+            fp.write(cipher.openssl_encrypt(b'My very secret content', b'secret', digest='md5'))
+        obj = CbKsCrypto(file=self.filename, passphrase='secret')
+        self.assertEqual(obj.plaintext, 'My very secret content')
+
+    def test_05(self):
+        """
+        Test Case 05:
+        Decrypt a ciphertext not read from the file, both in process and using openssl.
+
+        Test is passed if the original plaintext is restored, and a wrong passphrase raises
+        :py:exc:`~controlbeast.keystore.exception.CbKsPasswordError`.
+        """
+        with open(self.filename, 'wb') as fp:
+            fp.write(cipher.openssl_encrypt(b'My very secret content', b'secret'))
+        with open(self.filename, 'rb') as fp:
+            ciphertext = fp.read()
+        for in_process in (True, False):
+            if in_process and not cipher.is_available():
+                continue
+            obj_2 = CbKsCrypto(passphrase='secret')
+            obj_2._in_process = in_process
+            self.assertEqual(obj_2.decrypt(ciphertext), 'My very secret content')
+            obj_3 = CbKsCrypto(passphrase='sacred')
+            obj_3._in_process = in_process
+            with self.assertRaises(CbKsPasswordError):
+                obj_3.decrypt(ciphertext)
+
+    @skipUnless(cipher.is_available(), 'libcrypto not available')
+    def test_06(self):
+        """
+        Test Case 06:
+        Update a file written in the legacy openssl format.
+
+        Test is passed if the file is converted into the ControlBeast key store format.
+        """
+        obj_1 = CbKsCrypto(file=self.filename, passphrase='secret')
+        obj_1._in_process = False
+        obj_1.plaintext = 'My very secret content'
+        obj_2 = CbKsCrypto(file=self.filename, passphrase='secret')
+        self.assertEqual(obj_2.plaintext, 'My very secret content')
+        obj_2.plaintext = 'My other secret content'
+        with open(self.filename, 'rb') as fp:
+            self.assertIsNotNone(cipher.parse_header(fp.read()))
+        obj_3 = CbKsCrypto(file=self.filename, passphrase='secret')
+        self.assertEqual(obj_3.plaintext, 'My other secret content')
+
+    @skipUnless(cipher.is_available(), 'libcrypto not available')
+    def test_07(self):
+        """
+        Test Case 07:
+        Update a file repeatedly, reusing the derived key.
+
+        Test is passed if the salt is kept, the key is derived once only, and the ciphertext still changes.
+        """
+        cipher.clear_key_cache()
+        obj = CbKsCrypto(file=self.filename, passphrase='secret')
+        ciphertexts = []
+        for i in range(5):
+            obj.plaintext = 'My very secret content {}'.format(i)
+            with open(self.filename, 'rb') as fp:
+                ciphertexts.append(fp.read())
+        self.assertEqual(len(set(cipher.parse_header(ciphertext)[2] for ciphertext in ciphertexts)), 1)
+        self.assertEqual(len(set(ciphertexts)), 5)
+        self.assertEqual(len(cipher._key_cache), 1)
+
+    @skipUnless(cipher.is_available(), 'libcrypto not available')
+    def test_08(self):
+        """
+        Test Case 08:
+        Encrypt and decrypt using scrypt for key derivation.
+
+        Test is passed if the original plaintext is restored.
+        """
+        ciphertext = cipher.encrypt(b'My very secret content', b'secret', 'scrypt', {'n': 2 ** 10, 'r': 8, 'p': 1})
+        self.assertEqual(cipher.parse_header(ciphertext)[:2], ('scrypt', {'n': 2 ** 10, 'r': 8, 'p': 1}))
+        self.assertEqual(cipher.decrypt(ciphertext, b'secret'), b'My very secret content')
+
+    @skipUnless(cipher.is_available(), 'libcrypto not available')
+    def test_09(self):
+        """
+        Test Case 09:
+        Try decrypting a tampered ciphertext.
+
+        Test is passed if a :py:exc:`~controlbeast.keystore.exception.CbKsPasswordError` is raised.
+        """
+        ciphertext = cipher.encrypt(b'My very secret content', b'secret', 'pbkdf2-sha256', {'i': 1000})
+        tampered = ciphertext.replace(b'i=1000', b'i=1001')
+        with self.assertRaises(CbKsPasswordError):
+            cipher.decrypt(tampered, b'secret')
+        header, body = ciphertext.split(b'\n', 1)
+        body = (b'B' if body[:1] == b'A' else b'A') + body[1:]
+        with self.assertRaises(CbKsPasswordError):
+            cipher.decrypt(header + b'\n' + body, b'secret')
+
+    def test_10(self):
+        """
+        Test Case 10:
+        Encrypt and decrypt several ciphertexts at once using coroutines, in process and using openssl.
+
+        Test is passed if all original plaintexts are restored, and a wrong passphrase raises a
+        :py:exc:`~controlbeast.keystore.exception.CbKsPasswordError`.
+        """
+        plaintexts = ['Secret content {}'.format(i) for i in range(8)]
+        modes = [False]
+        if cipher.is_available():
+            modes.append(True)
+        for in_process in modes:
+            obj = CbKsCrypto(file=self.filename, passphrase='secret')
+            obj._in_process = in_process
+            wrong = CbKsCrypto(file=self.filename, passphrase='sacred')
+            wrong._in_process = in_process
+
+            async def run():
+                ciphertexts = await asyncio.gather(*[obj.encrypt_async(plaintext) for plaintext in plaintexts])
+                results = await asyncio.gather(*[obj.decrypt_async(ciphertext) for ciphertext in ciphertexts])
+                with self.assertRaises(CbKsPasswordError):
+                    await wrong.decrypt_async(ciphertexts[0])
+                return results
+
+            self.assertListEqual(asyncio.run(run()), plaintexts)
+
+    def test_11(self):
+        """
+        Test Case 11:
+        Try decrypting ciphertexts with missing, unexpected or excessive key derivation parameters.
+
+        Test is passed if the headers are rejected without deriving any key, and a
+        :py:exc:`~controlbeast.keystore.exception.CbKsPasswordError` is raised.
+        """
+        ciphertext = cipher.encrypt(b'My very secret content', b'secret', 'pbkdf2-sha256', {'i': 1000})
+        for kdf, params in (
+                (b'pbkdf2-sha256', b'n=1000'), (b'pbkdf2-sha256', b'i=1000,n=2'), (b'pbkdf2-sha256', b'i=0'),
+                (b'pbkdf2-sha256', b'i=1000000000000'), (b'scrypt', b'n=1024,r=8'), (b'scrypt', b'n=1000,p=1,r=8'),
+                (b'scrypt', b'n=1099511627776,p=1,r=8'), (b'scrypt', b'n=1024,p=1000000,r=8'),
+        ):
+            forged = ciphertext.replace(b'pbkdf2-sha256 i=1000', kdf + b' ' + params)
+            self.assertIsNone(cipher.parse_header(forged))
+            with self.assertRaises(CbKsPasswordError):
+                cipher.decrypt(forged, b'secret')
+        with self.assertRaises(ValueError):
+            cipher.derive_key(b'secret', 'scrypt', {'n': 2 ** 40, 'r': 8, 'p': 1}, b'salt')
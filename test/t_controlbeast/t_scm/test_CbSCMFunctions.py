@@ -11,7 +11,7 @@ import tempfile
 from unittest import TestCase
 import controlbeast.scm
 from controlbeast.scm import get_scm, scm_init, scm_commit, scm_get_root, scm_get_branches, scm_create_branch, \
-    scm_get_active_branch, scm_checkout
+    scm_get_active_branch, scm_checkout, scm_get_workspace, scm_prune_workspaces
 from controlbeast.scm.git import Git
 
 
@@ -33,6 +33,7 @@ class TestCbSCMFunctions(TestCase):
     07              Create a branch within an existing git repository by using the SCM function interface.
     08              Detect the active branch of an existing git repository by using the SCM function interface.
     09              Check out an existing branch within an existing git repository by using the SCM function interface.
+    10              Get and prune a work space of an existing branch by using the SCM function interface.
     ==============  ========================================================================================
     """
 
@@ -157,4 +158,26 @@ class TestCbSCMFunctions(TestCase):
             scm_commit(path=td, message='Test message')
             scm_create_branch(path=td, name='test')
             scm_checkout(path=td, name='test')
-            self.assertEqual(scm_get_active_branch(path=td), 'test')
\ No newline at end of file
+            self.assertEqual(scm_get_active_branch(path=td), 'test')
+
+    def test_10(self):
+        """
+        Test Case 10:
+        Get and prune a work space of an existing branch by using the SCM function interface.
+
+        Test is passed if the branch is checked out within the work space while the active branch remains
+        unchanged, and the work space is removed when pruned.
+        """
+        with tempfile.TemporaryDirectory() as td:
+            scm_init(path=td)
+            fp = open(os.path.join(td, 'testfile'), 'w')
+            fp.write("Test file content")
+            fp.close()
+            scm_commit(path=td, message='Test message')
+            scm_create_branch(path=td, name='test')
+            active = scm_get_active_branch(path=td)
+            workspace = scm_get_workspace(path=td, name='test')
+            self.assertEqual(scm_get_active_branch(path=workspace), 'test')
+            self.assertEqual(scm_get_active_branch(path=td), active)
+            self.assertListEqual(scm_prune_workspaces(path=td, idle=0), ['test'])
+            self.assertFalse(os.path.exists(workspace))
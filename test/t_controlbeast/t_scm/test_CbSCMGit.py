@@ -6,12 +6,15 @@
     :copyright: Copyright 2013 by the ControlBeast team, see AUTHORS.
     :license: ISC, see LICENSE for details.
 """
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import os
+import subprocess
 import tempfile
 from unittest import TestCase
 from controlbeast.scm import CbSCMInitError
-from controlbeast.scm.base import CbSCMBranchError, CbSCMCheckoutError
-from controlbeast.scm.git import Git
+from controlbeast.scm.base import CbSCMBranchError, CbSCMCheckoutError, CbSCMCommitError
+from controlbeast.scm.git import Git, GitCatFile
 
 
 class TestCbSCMGit(TestCase):
@@ -35,6 +38,21 @@ class TestCbSCMGit(TestCase):
     10              Detect active branch within an existing git repository.
     11              Check out an existing branch withing an existing git repository.
     12              Try checking out a non-existing branch withing an existing git repository.
+    13              Get the commits the branches of an existing git repository point to.
+    14              Read files committed on several branches without checking them out.
+    15              Try reading a file which has not been committed.
+    16              Operate on several git repositories concurrently using one Git object.
+    17              Try checking out a branch which git refuses to check out.
+    18              Get branches from loose and packed refs without running git.
+    19              Detect branches created by other means than the Git object.
+    20              Commit to several branches concurrently within their work spaces.
+    21              Get a work space for the branch checked out within the main working tree.
+    22              Prune work spaces which are idle, keeping those containing uncommitted changes.
+    23              Commit files to several branches without checking them out.
+    24              Delete files and create a branch by committing files.
+    25              Try committing files to a branch which has been updated in the meantime.
+    26              Create branches and commit to several work spaces at once using coroutines.
+    27              Prune idle work spaces automatically when creating a work space.
     ==============  ========================================================================================
     """
 
@@ -219,3 +237,384 @@ class TestCbSCMGit(TestCase):
             obj.commit(path=td, message="Test message")
             with self.assertRaises(CbSCMCheckoutError):
                 obj.checkout(path=td, name='test')
+
+    def test_13(self):
+        """
+        Test Case 13:
+        Get the commits the branches of an existing git repository point to.
+
+        Test is passed if all branches are listed, pointing to the same commit.
+        """
+        with tempfile.TemporaryDirectory() as td:
+            obj = Git()
+            obj.init(path=td)
+            fp = open(os.path.join(td, 'testfile'), 'w')
+            fp.write("Test file content")
+            fp.close()
+            obj.commit(path=td, message="Test message")
+            obj.create_branch(path=td, name='test')
+            tips = obj.get_branch_tips(path=td)
+            self.assertListEqual(sorted(tips), ['master', 'test'])
+            self.assertEqual(tips['master'], tips['test'])
+            self.assertEqual(len(tips['master']), 40)
+
+    def test_14(self):
+        """
+        Test Case 14:
+        Read files committed on several branches without checking them out.
+
+        Test is passed if the content committed on each branch is returned.
+        """
+        with tempfile.TemporaryDirectory() as td:
+            obj = Git()
+            obj.init(path=td)
+            fp = open(os.path.join(td, 'testfile'), 'w')
+            fp.write("Test file content")
+            fp.close()
+            obj.commit(path=td, message="Test message")
+            obj.create_branch(path=td, name='test')
+            obj.checkout(path=td, name='test')
+            fp = open(os.path.join(td, 'testfile'), 'w')
+            fp.write("Other test file content")
+            fp.close()
+            obj.commit(path=td, message="Test message")
+            with GitCatFile(td) as reader:
+                master, test = reader.read(['master:testfile', 'test:testfile'])
+                self.assertEqual(master.content, b'Test file content')
+                self.assertEqual(test.content, b'Other test file content')
+                self.assertEqual(test.type, 'blob')
+                # the batch process is reused for subsequent reads
+                self.assertEqual(reader.read(['master:testfile'])[0], master)
+
+    def test_15(self):
+        """
+        Test Case 15:
+        Try reading a file which has not been committed.
+
+        Test is passed if ``None`` is returned for the missing files only, also if their names contain spaces.
+        """
+        with tempfile.TemporaryDirectory() as td:
+            obj = Git()
+            obj.init(path=td)
+            fp = open(os.path.join(td, 'testfile'), 'w')
+            fp.write("Test file content")
+            fp.close()
+            obj.commit(path=td, message="Test message")
+            with GitCatFile(td) as reader:
+                missing, present = reader.read(['master:missing', 'master:testfile'])
+                self.assertIsNone(missing)
+                self.assertEqual(present.content, b'Test file content')
+                spaced, other, present = reader.read(['HEAD:my file', 'HEAD:base/my file.yml', 'HEAD:testfile'])
+                self.assertIsNone(spaced)
+                self.assertIsNone(other)
+                self.assertEqual(present.content, b'Test file content')
+            with GitCatFile(td, check=True) as reader:
+                self.assertIsNone(reader.read(['HEAD:my file'])[0])
+
+    def test_16(self):
+        """
+        Test Case 16:
+        Operate on several git repositories concurrently using one Git object.
+
+        Test is passed if each repository gets its own branch and commit, and the current working directory
+        remains unchanged.
+        """
+        obj = Git()
+        cwd = os.getcwd()
+
+        def operate(path, name):
+            obj.init(path=path)
+            with open(os.path.join(path, name), 'w') as fp:
+                fp.write(name)
+            obj.commit(path=path, message=name)
+            obj.create_branch(path=path, name=name)
+            obj.checkout(path=path, name=name)
+            return obj.get_active_branch(path=path), obj.get_branches(path=path)
+
+        with tempfile.TemporaryDirectory() as td:
+            names = ['host{}'.format(i) for i in range(16)]
+            paths = [os.path.join(td, name) for name in names]
+            for path in paths:
+                os.mkdir(path)
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(executor.map(operate, paths, names))
+            for name, (active, branches) in zip(names, results):
+                self.assertEqual(active, name)
+                self.assertListEqual(sorted(branches), sorted([name, 'master']))
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_17(self):
+        """
+        Test Case 17:
+        Try checking out a branch which git refuses to check out.
+
+        Test is passed if :py:exc:`~controlbeast.scm.base.CbSCMCheckoutError` is raised, and the current working
+        directory remains unchanged.
+        """
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as td:
+            obj = Git()
+            obj.init(path=td)
+            fp = open(os.path.join(td, 'testfile'), 'w')
+            fp.write("Test file content")
+            fp.close()
+            obj.commit(path=td, message="Test message")
+            obj.create_branch(path=td, name='test')
+            obj.checkout(path=td, name='test')
+            fp = open(os.path.join(td, 'testfile'), 'w')
+            fp.write("Other test file content")
+            fp.close()
+            obj.commit(path=td, message="Test message")
+            obj.checkout(path=td, name='master')
+            fp = open(os.path.join(td, 'testfile'), 'w')
+            fp.write("Uncommitted content")
+            fp.close()
+            with self.assertRaises(CbSCMCheckoutError):
+                obj.checkout(path=td, name='test')
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_18(self):
+        """
+        Test Case 18:
+        Get branches from loose and packed refs without running git.
+
+        Test is passed if branches, the active branch and the repository's root are reported as by git, and
+        cached lookups do not spawn any process.
+        """
+        with tempfile.TemporaryDirectory() as td:
+            obj = Git()
+            obj.init(path=td)
+            fp = open(os.path.join(td, 'testfile'), 'w')
+            fp.write("Test file content")
+            fp.close()
+            obj.commit(path=td, message="Test message")
+            obj.create_branch(path=td, name='dc1/host1')
+            subprocess.check_call(['git', '-C', td, 'pack-refs', '--all'])
+            obj.create_branch(path=td, name='dc1/host2')
+            obj.checkout(path=td, name='dc1/host2')
+            os.mkdir(os.path.join(td, 'sub'))
+            obj._refs._racy = 0
+            self.assertListEqual(obj.get_branches(path=td), ['dc1/host1', 'dc1/host2', 'master'])
+            obj._invoke = None
+            self.assertListEqual(obj.get_branches(path=os.path.join(td, 'sub')), ['dc1/host1', 'dc1/host2', 'master'])
+            self.assertEqual(obj.get_active_branch(path=td), 'dc1/host2')
+            self.assertEqual(obj.get_root(path=os.path.join(td, 'sub')), os.path.realpath(td))
+
+    def test_19(self):
+        """
+        Test Case 19:
+        Detect branches created by other means than the Git object.
+
+        Test is passed if branches created and checked out by running git are reported after having been cached.
+        """
+        with tempfile.TemporaryDirectory() as td:
+            obj = Git()
+            obj.init(path=td)
+            fp = open(os.path.join(td, 'testfile'), 'w')
+            fp.write("Test file content")
+            fp.close()
+            obj.commit(path=td, message="Test message")
+            obj._refs._racy = 0
+            self.assertListEqual(obj.get_branches(path=td), ['master'])
+            subprocess.check_call(['git', '-C', td, 'checkout', '-q', '-b', 'test'])
+            self.assertListEqual(obj.get_branches(path=td), ['master', 'test'])
+            self.assertEqual(obj.get_active_branch(path=td), 'test')
+
+    def _init_hosts(self, path, names):
+        """
+        Initialise a git repository containing one branch per host name.
+        """
+        obj = Git()
+        obj.init(path=path)
+        fp = open(os.path.join(path, 'testfile'), 'w')
+        fp.write("Test file content")
+        fp.close()
+        obj.commit(path=path, message="Test message")
+        for name in names:
+            obj.create_branch(path=path, name=name)
+        return obj
+
+    def test_20(self):
+        """
+        Test Case 20:
+        Commit to several branches concurrently within their work spaces.
+
+        Test is passed if each branch gets its own commit, the main working tree keeps its branch checked out,
+        and work spaces are reused.
+        """
+        with tempfile.TemporaryDirectory() as td:
+            names = ['dc1/host{}'.format(i) for i in range(8)]
+            obj = self._init_hosts(td, names)
+
+            def operate(name):
+                workspace = obj.get_workspace(path=td, name=name)
+                with open(os.path.join(workspace, 'host'), 'w') as fp:
+                    fp.write(name)
+                obj.commit(path=workspace, message=name)
+                return workspace
+
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                workspaces = list(executor.map(operate, names))
+            self.assertEqual(len(set(workspaces)), len(names))
+            self.assertEqual(obj.get_active_branch(path=td), 'master')
+            self.assertFalse(os.path.exists(os.path.join(td, 'host')))
+            with GitCatFile(td) as reader:
+                for name, blob in zip(names, reader.read(['{}:host'.format(name) for name in names])):
+                    self.assertEqual(blob.content, name.encode())
+            self.assertEqual(obj.get_workspace(path=td, name=names[0]), workspaces[0])
+
+    def test_21(self):
+        """
+        Test Case 21:
+        Get a work space for the branch checked out within the main working tree.
+
+        Test is passed if the main working tree is returned.
+        """
+        with tempfile.TemporaryDirectory() as td:
+            obj = self._init_hosts(td, [])
+            self.assertEqual(obj.get_workspace(path=td, name='master'), os.path.realpath(td))
+
+    def test_22(self):
+        """
+        Test Case 22:
+        Prune work spaces which are idle, keeping those containing uncommitted changes.
+
+        Test is passed if only the idle work space without changes is removed.
+        """
+        with tempfile.TemporaryDirectory() as td:
+            obj = self._init_hosts(td, ['clean', 'dirty', 'busy'])
+            clean = obj.get_workspace(path=td, name='clean')
+            dirty = obj.get_workspace(path=td, name='dirty')
+            busy = obj.get_workspace(path=td, name='busy')
+            with open(os.path.join(dirty, 'testfile'), 'w') as fp:
+                fp.write("Uncommitted content")
+            for workspace in (clean, dirty):
+                os.utime(workspace, (0, 0))
+            self.assertListEqual(obj.prune_workspaces(path=td, idle=60), ['clean'])
+            self.assertFalse(os.path.exists(clean))
+            self.assertTrue(os.path.isdir(dirty))
+            self.assertTrue(os.path.isdir(busy))
+            # removed work spaces are created again on demand
+            self.assertEqual(obj.get_workspace(path=td, name='clean'), clean)
+
+    def test_23(self):
+        """
+        Test Case 23:
+        Commit files to several branches without checking them out.
+
+        Test is passed if each branch points to a new commit containing its files, with the previous commit
+        as parent, while the main working tree remains unchanged.
+        """
+        with tempfile.TemporaryDirectory() as td:
+            obj = self._init_hosts(td, ['host1', 'host2'])
+            previous = obj.get_branch_tips(path=td)
+            tips = dict(previous)
+            commits = obj.commit_files(path=td, message="Update stage", changes={
+                'host1': {os.path.join('store', 'status.db'): b'stage: 1\n'},
+                'host2': {os.path.join('store', 'status.db'): 'stage: 2\n', 'testfile': 'Changed content'},
+            })
+            tips['host1'], tips['host2'] = commits['host1'], commits['host2']
+            self.assertDictEqual(obj.get_branch_tips(path=td), tips)
+            with GitCatFile(td) as reader:
+                host1, host2, testfile, parent = reader.read([
+                    'host1:store/status.db', 'host2:store/status.db', 'host2:testfile', 'host1^'
+                ])
+            self.assertEqual(host1.content, b'stage: 1\n')
+            self.assertEqual(host2.content, b'stage: 2\n')
+            self.assertEqual(testfile.content, b'Changed content')
+            self.assertEqual(parent.sha, previous['host1'])
+            self.assertEqual(obj.get_active_branch(path=td), 'master')
+            self.assertFalse(os.path.exists(os.path.join(td, 'store')))
+            self.assertEqual(subprocess.check_output(['git', '-C', td, 'status', '--porcelain']), b'')
+
+    def test_24(self):
+        """
+        Test Case 24:
+        Delete files and create a branch by committing files.
+
+        Test is passed if the deleted file and its empty directory are gone, the new branch starts from the
+        specified revision, and a branch without changes is left as it is.
+        """
+        with tempfile.TemporaryDirectory() as td:
+            obj = self._init_hosts(td, ['host1'])
+            obj.commit_files(path=td, message="Add", changes={'host1': {'base/os.yml': 'os: FreeBSD', 'host': 'host1'}})
+            tips = obj.get_branch_tips(path=td)
+            commits = obj.commit_files(path=td, message="Delete", parents={'host2': 'host1'}, changes={
+                'host1': {'base/os.yml': None},
+                'host2': {'host': 'host2'},
+                'master': {'testfile': 'Test file content'},
+            })
+            self.assertEqual(commits['master'], tips['master'])
+            with GitCatFile(td) as reader:
+                base, host2, parent = reader.read(['host1:base', 'host2:host', 'host2^'])
+            self.assertIsNone(base)
+            self.assertEqual(host2.content, b'host2')
+            self.assertEqual(parent.sha, tips['host1'])
+            self.assertEqual(subprocess.check_output(['git', '-C', td, 'fsck', '--strict']), b'')
+
+    def test_25(self):
+        """
+        Test Case 25:
+        Try committing files to a branch which has been updated in the meantime.
+
+        Test is passed if :py:exc:`~controlbeast.scm.base.CbSCMCommitError` is raised and no branch is updated.
+        """
+        with tempfile.TemporaryDirectory() as td:
+            obj = self._init_hosts(td, ['host1', 'host2'])
+            stale = obj.get_branch_tips(path=td)
+            obj.commit_files(path=td, message="Update", changes={'host2': {'host': 'host2'}})
+            tips = obj.get_branch_tips(path=td)
+            obj.get_branch_tips = lambda path: dict(stale)
+            with self.assertRaises(CbSCMCommitError):
+                obj.commit_files(path=td, message="Update", changes={'host1': {'host': 'x'}, 'host2': {'host': 'x'}})
+            self.assertDictEqual(Git().get_branch_tips(path=td), tips)
+
+    def test_26(self):
+        """
+        Test Case 26:
+        Create branches and commit to several work spaces at once using coroutines.
+
+        Test is passed if each branch points to a new commit, and a failing checkout raises
+        :py:exc:`~controlbeast.scm.base.CbSCMCheckoutError`.
+        """
+        with tempfile.TemporaryDirectory() as td:
+            obj = self._init_hosts(td, [])
+            names = ['host{}'.format(i) for i in range(6)]
+
+            async def run():
+                await asyncio.gather(*[obj.create_branch_async(path=td, name=name) for name in names])
+                before = await obj.get_branch_tips_async(path=td)
+                workspaces = [obj.get_workspace(path=td, name=name) for name in names]
+                for workspace in workspaces:
+                    with open(os.path.join(workspace, 'testfile'), 'w') as fp:
+                        fp.write(workspace)
+                await asyncio.gather(*[obj.commit_async(path=workspace, message='Update') for workspace in workspaces])
+                with self.assertRaises(CbSCMCheckoutError):
+                    await obj.checkout_async(path=td, name='nonexistent')
+                return before, await obj.get_branch_tips_async(path=td)
+
+            before, after = asyncio.run(run())
+            self.assertListEqual(obj.get_branches(path=td), names + ['master'])
+            for name in names:
+                self.assertEqual(before[name], before['master'])
+                self.assertNotEqual(after[name], before[name])
+
+    def test_27(self):
+        """
+        Test Case 27:
+        Prune idle work spaces automatically when creating a work space.
+
+        Test is passed if an idle work space is removed when another work space gets created, while creating
+        further work spaces within the idle period does not prune again.
+        """
+        with tempfile.TemporaryDirectory() as td:
+            self._init_hosts(td, ['old', 'new', 'newer'])
+            old = Git().get_workspace(path=td, name='old')
+            os.utime(old, (0, 0))
+            obj = Git()
+            obj.get_workspace(path=td, name='new')
+            self.assertFalse(os.path.exists(old))
+            old = obj.get_workspace(path=td, name='old')
+            os.utime(old, (0, 0))
+            obj.get_workspace(path=td, name='newer')
+            self.assertTrue(os.path.isdir(old))
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+    test.t_controlbeast.t_ssh.test_CbSSHAgent
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from unittest import TestCase, skipUnless
+from controlbeast.conf import CbConf
+from controlbeast.ssh import CbSSHKeygen
+from controlbeast.ssh.agent import CbSSHAgent, fingerprint, read_identity
+from controlbeast.ssh.exception import CbSSHAgentError
+
+
+@skipUnless(shutil.which('ssh-agent') and shutil.which('ssh-add'), 'ssh-agent not available')
+class TestCbSSHAgent(TestCase):
+    """
+    Class providing unit tests for the CbSSHAgent class.
+
+    **Covered test cases:**
+
+    ==============  ========================================================================================
+    Test Case       Description
+    ==============  ========================================================================================
+    01              List the identities of an agent not holding any.
+    02              Add several identities of different key types at once.
+    03              Check whether identities are loaded, using the cached list of identities.
+    04              Delete several identities at once, and delete all identities.
+    05              Add and delete an identity which is not in the OpenSSH private key format.
+    06              Try adding an identity without an agent running.
+    07              Try adding, deleting and looking up identity files which cannot be read, or no file at all.
+    ==============  ========================================================================================
+    """
+
+    def setUp(self):
+        self.td = tempfile.TemporaryDirectory()
+        self.socket = os.path.join(self.td.name, 'agent.sock')
+        self.agent = subprocess.Popen(
+            ['ssh-agent', '-D', '-a', self.socket], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        for i in range(100):
+            if os.path.exists(self.socket):
+                break
+            time.sleep(0.01)
+        self.environ = os.environ.get('SSH_AUTH_SOCK')
+        os.environ['SSH_AUTH_SOCK'] = self.socket
+        self.ttl = CbConf.get_instance()['SSH_AGENT_CACHE_TTL']
+
+    def tearDown(self):
+        CbConf.get_instance()['SSH_AGENT_CACHE_TTL'] = self.ttl
+        if self.environ is None:
+            del os.environ['SSH_AUTH_SOCK']
+        else:
+            os.environ['SSH_AUTH_SOCK'] = self.environ
+        self.agent.terminate()
+        self.agent.wait()
+        self.td.cleanup()
+
+    def _keygen(self, names, algorithm='ed25519'):
+        """
+        Create key pairs without passphrase, and return the paths of the private keys.
+        """
+        pairs = CbSSHKeygen().keygen_batch(names, directory=self.td.name, algorithm=algorithm)
+        return [pair.private_key for pair in pairs]
+
+    def _ssh_add_list(self):
+        """
+        List the fingerprints of the identities held by the agent using ssh-add.
+        """
+        result = subprocess.run(['ssh-add', '-l'], stdout=subprocess.PIPE, universal_newlines=True)
+        return sorted(line.split()[1] for line in result.stdout.splitlines() if 'SHA256:' in line)
+
+    def test_01(self):
+        """
+        Test Case 01:
+        List the identities of an agent not holding any.
+
+        Test is passed if the lists of identities and keys are empty.
+        """
+        obj = CbSSHAgent()
+        self.assertListEqual(obj.identities, [])
+        self.assertListEqual(obj.keys, [])
+
+    def test_02(self):
+        """
+        Test Case 02:
+        Add several identities of different key types at once.
+
+        Test is passed if the agent holds all identities, with their comments and fingerprints matching the
+        ones reported by ``ssh-add``.
+        """
+        files = self._keygen(['ed1', 'ed2']) + self._keygen(['rsa1'], 'rsa')
+        files.append(os.path.join(self.td.name, 'ec1'))
+        subprocess.check_call(
+            ['ssh-keygen', '-q', '-t', 'ecdsa', '-b', '256', '-N', '', '-C', 'ec1', '-f', files[-1]]
+        )
+        obj = CbSSHAgent()
+        obj.add_many(files)
+        self.assertListEqual(sorted(obj.keys), ['ec1', 'ed1', 'ed2', 'rsa1'])
+        self.assertListEqual(
+            sorted(identity.key_type for identity in obj.identities),
+            ['ecdsa-sha2-nistp256', 'ssh-ed25519', 'ssh-ed25519', 'ssh-rsa']
+        )
+        self.assertListEqual(sorted(identity.fingerprint for identity in obj.identities), self._ssh_add_list())
+        self.assertEqual(fingerprint(read_identity(files[0])[0]), obj.identities[0].fingerprint)
+
+    def test_03(self):
+        """
+        Test Case 03:
+        Check whether identities are loaded, using the cached list of identities.
+
+        Test is passed if identities added by other clients are only noticed once the cache has been
+        invalidated or has expired, while identities added by the same object are noticed immediately.
+        """
+        first, second, third = self._keygen(['first', 'second', 'third'])
+        obj = CbSSHAgent()
+        obj.add(first)
+        self.assertTrue(obj.has_key(first))
+        self.assertTrue(obj.has_key(first + '.pub'))
+        self.assertFalse(obj.has_key(second))
+        CbSSHAgent().add(second)
+        self.assertFalse(obj.has_key(second))
+        obj.invalidate()
+        self.assertTrue(obj.has_key(second))
+        CbConf.get_instance()['SSH_AGENT_CACHE_TTL'] = 0
+        CbSSHAgent().add(third)
+        self.assertTrue(obj.has_key(third))
+
+    def test_04(self):
+        """
+        Test Case 04:
+        Delete several identities at once, and delete all identities.
+
+        Test is passed if only the deleted identities are removed from the agent, and deleting an identity
+        which is not loaded raises a :py:exc:`~controlbeast.ssh.exception.CbSSHAgentError`.
+        """
+        files = self._keygen(['key{}'.format(i) for i in range(4)])
+        obj = CbSSHAgent()
+        obj.add_many(files)
+        obj.delete_many(files[:2])
+        self.assertListEqual(sorted(obj.keys), ['key2', 'key3'])
+        with self.assertRaises(CbSSHAgentError):
+            obj.delete(files[0])
+        obj.delete_all()
+        self.assertListEqual(obj.keys, [])
+
+    def test_05(self):
+        """
+        Test Case 05:
+        Add and delete an identity which is not in the OpenSSH private key format.
+
+        Test is passed if the identity is added using ``ssh-add``, and deleted by its public key.
+        """
+        filename = os.path.join(self.td.name, 'legacy')
+        subprocess.check_call(
+            ['ssh-keygen', '-q', '-m', 'PEM', '-t', 'rsa', '-b', '2048', '-N', '', '-C', 'legacy', '-f', filename]
+        )
+        self.assertIsNone(read_identity(filename)[1])
+        obj = CbSSHAgent()
+        obj.add(filename)
+        self.assertTrue(obj.has_key(filename))
+        obj.delete(filename)
+        self.assertFalse(obj.has_key(filename))
+
+    def test_06(self):
+        """
+        Test Case 06:
+        Try adding an identity without an agent running.
+
+        Test is passed if a :py:exc:`~controlbeast.ssh.exception.CbSSHAgentError` is raised.
+        """
+        filename = self._keygen(['key'])[0]
+        os.environ['SSH_AUTH_SOCK'] = os.path.join(self.td.name, 'missing.sock')
+        obj = CbSSHAgent()
+        with self.assertRaises(CbSSHAgentError):
+            obj.add(filename)
+
+    def test_07(self):
+        """
+        Test Case 07:
+        Try adding, deleting and looking up identity files which cannot be read, or no file at all.
+
+        Test is passed if a :py:exc:`~controlbeast.ssh.exception.CbSSHAgentError` is raised in each case.
+        """
+        missing = os.path.join(self.td.name, 'missing')
+        obj = CbSSHAgent()
+        for method in (obj.add, obj.delete, obj.has_key):
+            for filename in (missing, self.td.name, ''):
+                with self.assertRaises(CbSSHAgentError):
+                    method(filename)
+        self.assertListEqual(obj.keys, [])
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""
+    test.t_controlbeast.t_utils
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
\ No newline at end of file
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+    test.t_controlbeast.t_utils.test_CbBinary
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import asyncio
+import os
+import tempfile
+import time
+from unittest import TestCase
+from controlbeast.conf import CbConf
+from controlbeast.scm.git import Git
+from controlbeast.utils.binary import CbBinary, CbBinaryCache, CbBinaryStatistics, add_sink, remove_sink, REDACTED
+
+
+class _CbEcho(CbBinary):
+    """
+    Binary wrapper with secret options, for testing redaction.
+    """
+    _secret_options = ('-N', )
+
+
+class TestCbBinary(TestCase):
+    """
+    Class providing unit tests for the CbBinary class and the instrumentation of binary executions.
+
+    **Covered test cases:**
+
+    ==============  ========================================================================================
+    Test Case       Description
+    ==============  ========================================================================================
+    01              Record the execution of a binary.
+    02              Redact secret arguments within records.
+    03              Classify git executions by git command.
+    04              Aggregate records and format a summary.
+    05              Execute binaries after unregistering a sink.
+    06              Execute several binaries at once using coroutines.
+    07              Look up a binary using the cache, also from within a new process.
+    08              Look up a binary which has been replaced after being cached.
+    09              Probe the version of a binary once.
+    10              Stream output of a binary fed by an iterator in chunks of bounded size.
+    11              Pipe the output of one binary into another binary.
+    12              Stream output of a failing binary, truncating its error output.
+    13              Pipe the output of one binary into another binary, without closing the first stream explicitly.
+    14              Record the resource usage and return code of binaries waited for with a timeout.
+    ==============  ========================================================================================
+    """
+
+    def setUp(self):
+        self.records = []
+        add_sink(self.records.append)
+        self.td = tempfile.TemporaryDirectory()
+        self.conf = CbConf.get_instance()
+        self.cache_file = self.conf['BINARY_CACHE_FILE']
+        self.conf['BINARY_CACHE_FILE'] = os.path.join(self.td.name, 'cache', 'binaries.yml')
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = os.pathsep.join([self.td.name, self.path])
+        CbBinaryCache.get_instance().clear()
+
+    def tearDown(self):
+        remove_sink(self.records.append)
+        os.environ['PATH'] = self.path
+        CbBinaryCache.get_instance().clear()
+        self.conf['BINARY_CACHE_FILE'] = self.cache_file
+        self.td.cleanup()
+
+    def _create_binary(self, name, version, directory=None):
+        """
+        Create an executable shell script printing a version, by default within the first directory of the search path.
+        """
+        filename = os.path.join(directory or self.td.name, name)
+        with open(filename, 'w') as fp:
+            fp.write('#!/bin/sh\necho {}\n'.format(version))
+        os.chmod(filename, 0o755)
+        return filename
+
+    def test_01(self):
+        """
+        Test Case 01:
+        Record the execution of a binary.
+
+        Test is passed if one record holding binary, command class, timing, byte counts and return code is emitted.
+        """
+        obj = CbBinary(binary_name='cat')
+        obj.stdin = 'Test content'
+        obj._arguments = ['-']
+        obj._execute()
+        self.assertEqual(obj.stdout, 'Test content')
+        self.assertEqual(len(self.records), 1)
+        record = self.records[0]
+        self.assertEqual(record.binary, 'cat')
+        self.assertEqual(record.command, '-')
+        self.assertTupleEqual(record.arguments, ('-', ))
+        self.assertEqual(record.bytes_in, 12)
+        self.assertEqual(record.bytes_out, 12)
+        self.assertEqual(record.return_code, os.EX_OK)
+        self.assertGreater(record.wall_time, 0)
+        self.assertGreaterEqual(record.cpu_time, 0)
+
+    def test_02(self):
+        """
+        Test Case 02:
+        Redact secret arguments within records.
+
+        Test is passed if the secret argument is passed to the binary, but does not show up within the record.
+        """
+        obj = _CbEcho(binary_name='echo')
+        obj._arguments = ['-N', 'confidential', os.path.join('some', 'file')]
+        obj._execute()
+        self.assertIn('confidential', obj.stdout)
+        self.assertTupleEqual(self.records[0].arguments, ('-N', REDACTED, os.path.join('some', 'file')))
+        self.assertNotIn('confidential', repr(self.records))
+
+    def test_03(self):
+        """
+        Test Case 03:
+        Classify git executions by git command.
+
+        Test is passed if the record's command class is the git command, not the ``-C`` option.
+        """
+        with tempfile.TemporaryDirectory() as td:
+            Git().init(path=td)
+        self.assertEqual([record.command for record in self.records], ['init'])
+
+    def test_04(self):
+        """
+        Test Case 04:
+        Aggregate records and format a summary.
+
+        Test is passed if executions are counted per binary and command class, and the summary lists them.
+        """
+        statistics = CbBinaryStatistics()
+        add_sink(statistics)
+        try:
+            obj = CbBinary(binary_name='true')
+            for __ in range(3):
+                obj._execute()
+            obj = CbBinary(binary_name='false')
+            obj._execute()
+        finally:
+            remove_sink(statistics)
+        totals = statistics.totals
+        self.assertEqual(totals[('true', '')][:2], (3, 0))
+        self.assertEqual(totals[('false', '')][:2], (1, 1))
+        summary = statistics.summary()
+        self.assertIn('true', summary)
+        self.assertIn('false', summary)
+        statistics.clear()
+        self.assertDictEqual(statistics.totals, {})
+
+    def test_05(self):
+        """
+        Test Case 05:
+        Execute binaries after unregistering a sink.
+
+        Test is passed if the unregistered sink does not receive any record.
+        """
+        remove_sink(self.records.append)
+        obj = CbBinary(binary_name='true')
+        obj._execute()
+        self.assertListEqual(self.records, [])
+
+    def test_06(self):
+        """
+        Test Case 06:
+        Execute several binaries at once using coroutines.
+
+        Test is passed if the child processes run at the same time, a child process exceeding the timeout
+        is killed, and each execution is recorded.
+        """
+        obj = CbBinary(binary_name='sleep')
+
+        async def run():
+            return await asyncio.gather(
+                obj._invoke_async(['10'], timeout=0.5), *[obj._invoke_async(['1']) for __ in range(5)]
+            )
+
+        start = time.perf_counter()
+        results = asyncio.run(run())
+        self.assertLess(time.perf_counter() - start, 3)
+        self.assertNotEqual(results[0].return_code, os.EX_OK)
+        self.assertListEqual([result.return_code for result in results[1:]], [os.EX_OK] * 5)
+        self.assertEqual(len(self.records), 6)
+
+    def test_07(self):
+        """
+        Test Case 07:
+        Look up a binary using the cache, also from within a new process.
+
+        Test is passed if the binary is found, and the cache file allows finding it without searching.
+        """
+        filename = self._create_binary('cb-test', '1.0')
+        self.assertEqual(CbBinary(binary_name='cb-test')._binary_path, filename)
+        self.assertTrue(os.path.isfile(self.conf['BINARY_CACHE_FILE']))
+        cache = CbBinaryCache.get_instance()
+        # forget the cache held in memory, as a new process would
+        cache._paths = None
+        cache._check_access = lambda file, mode: self.fail('Binary has been searched')
+        try:
+            self.assertEqual(cache.find('cb-test'), filename)
+        finally:
+            del cache._check_access
+        self.assertIsNone(cache.find('cb-test-nonexistent'))
+
+    def test_08(self):
+        """
+        Test Case 08:
+        Look up a binary which has been replaced after being cached.
+
+        Test is passed if the binary is searched again once the cached binary is gone.
+        """
+        filename = self._create_binary('cb-test', '1.0')
+        cache = CbBinaryCache.get_instance()
+        self.assertEqual(cache.find('cb-test'), filename)
+        os.unlink(filename)
+        directory = os.path.join(self.td.name, 'bin')
+        os.mkdir(directory)
+        os.environ['PATH'] = os.pathsep.join([self.td.name, directory, self.path])
+        replacement = os.path.join(directory, 'cb-test')
+        self.assertEqual(self._create_binary('cb-test', '2.0', directory), replacement)
+        self.assertEqual(cache.find('cb-test'), replacement)
+
+    def test_09(self):
+        """
+        Test Case 09:
+        Probe the version of a binary once.
+
+        Test is passed if the version is probed once, also across processes, and again after the binary has changed
+        or its version could not be determined.
+        """
+        filename = self._create_binary('cb-test', '1.0')
+        probes = []
+
+        def probe(path):
+            obj = CbBinary(binary_name='cb-test')
+            obj._execute()
+            probes.append(path)
+            return obj.stdout.strip()
+
+        cache = CbBinaryCache.get_instance()
+        self.assertEqual(cache.version(filename, probe), '1.0')
+        cache._paths = None
+        self.assertEqual(cache.version(filename, probe), '1.0')
+        self.assertEqual(len(probes), 1)
+        self._create_binary('cb-test', '2.0')
+        os.utime(filename, ns=(0, 0))
+        self.assertEqual(cache.version(filename, probe), '2.0')
+        self.assertEqual(len(probes), 2)
+        versions = [None, '3.0']
+        failing = self._create_binary('cb-fail', '3.0')
+        self.assertIsNone(cache.version(failing, lambda path: versions.pop(0)))
+        self.assertEqual(cache.version(failing, lambda path: versions.pop(0)), '3.0')
+        self.assertEqual(cache.version(failing, lambda path: versions.pop(0)), '3.0')
+
+    def test_10(self):
+        """
+        Test Case 10:
+        Stream output of a binary fed by an iterator in chunks of bounded size.
+
+        Test is passed if all input is passed through in chunks not exceeding the chunk size, and the
+        execution is recorded.
+        """
+        obj = CbBinary(binary_name='cat')
+        chunks = [os.urandom(10000) for __ in range(50)]
+        with obj._stream(['-'], stdin=iter(chunks), chunk_size=4096) as stream:
+            output = list(stream)
+        self.assertEqual(stream.return_code, os.EX_OK)
+        self.assertEqual(b''.join(output), b''.join(chunks))
+        self.assertLessEqual(max(len(chunk) for chunk in output), 4096)
+        self.assertEqual(self.records[-1].bytes_in, 500000)
+        self.assertEqual(self.records[-1].bytes_out, 500000)
+
+    def test_11(self):
+        """
+        Test Case 11:
+        Pipe the output of one binary into another binary.
+
+        Test is passed if the second binary receives the output of the first one, and the first binary is
+        terminated once the second one stops reading.
+        """
+        producer = CbBinary(binary_name='yes')
+        consumer = CbBinary(binary_name='head')
+        output = []
+        with producer._stream([]) as source:
+            with consumer._stream(['-c', '100000'], stdin=source) as stream:
+                self.assertEqual(stream.feed(output.append), os.EX_OK)
+        self.assertEqual(b''.join(output), b'y\n' * 50000)
+        self.assertIsNotNone(source.return_code)
+
+    def test_12(self):
+        """
+        Test Case 12:
+        Stream output of a failing binary, truncating its error output.
+
+        Test is passed if the return code is reported, and the error output is truncated to the limit.
+        """
+        obj = CbBinary(binary_name='sh')
+        with obj._stream(['-c', 'echo output; seq 10000 >&2; exit 3'], stderr_limit=100) as stream:
+            self.assertEqual(b''.join(stream), b'output\n')
+        self.assertEqual(stream.return_code, 3)
+        self.assertEqual(len(stream.stderr), 100)
+        self.assertTrue(stream.stderr.startswith(b'1\n2\n3\n'))
+        self.assertTrue(stream.stderr_truncated)
+
+    def test_13(self):
+        """
+        Test Case 13:
+        Pipe the output of one binary into another binary, without closing the first stream explicitly.
+
+        Test is passed if the first binary is terminated once the second one has terminated.
+        """
+        source = CbBinary(binary_name='yes')._stream([])
+        with CbBinary(binary_name='head')._stream(['-c', '10'], stdin=source) as stream:
+            self.assertEqual(b''.join(stream), b'y\n' * 5)
+        self.assertIsNotNone(source.return_code)
+        self.assertIsNotNone(source._process.poll())
+
+    def test_14(self):
+        """
+        Test Case 14:
+        Record the resource usage and return code of binaries waited for with a timeout.
+
+        Test is passed if the CPU time and the return code are recorded both for a binary terminating in time
+        and for a binary killed after the timeout expired.
+        """
+        obj = CbBinary(binary_name='sh')
+        self.assertEqual(obj._invoke(['-c', 'exit 3'], timeout=5).return_code, 3)
+        self.assertEqual(obj._invoke(['-c', 'exec sleep 5'], timeout=0.1).return_code, -9)
+        self.assertListEqual([record.return_code for record in self.records], [3, -9])
+        self.assertTrue(all(record.cpu_time is not None for record in self.records))
+        self.assertLess(self.records[1].wall_time, 5)
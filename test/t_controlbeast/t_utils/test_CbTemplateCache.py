@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+    test.t_controlbeast.t_utils.test_CbTemplateCache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import os
+import stat
+import tempfile
+from unittest import TestCase
+from controlbeast.conf import CbConf
+from controlbeast.utils.template import CbTemplateCache
+from controlbeast.utils.yaml import safe_load
+
+
+class TestCbTemplateCache(TestCase):
+    """
+    Class providing unit tests for the CbTemplateCache class.
+
+    **Covered test cases:**
+
+    ==============  ========================================================================================
+    Test Case       Description
+    ==============  ========================================================================================
+    01              Render a template file using replacement fields of various kinds.
+    02              Parse a template file repeatedly.
+    03              Parse a template file after the file or a setting it refers to has changed.
+    04              Evict the templates used least recently.
+    05              Persist the cache within a file, and read it again.
+    ==============  ========================================================================================
+    """
+
+    def setUp(self):
+        self.td = tempfile.TemporaryDirectory()
+        self.conf = CbConf.get_instance()
+        self.settings = dict((key, self.conf[key]) for key in ('TEMPLATE_CACHE_SIZE', 'TEMPLATE_CACHE_FILE'))
+        self.conf['TEMPLATE_CACHE_FILE'] = None
+        self.cache = CbTemplateCache.get_instance()
+        self.cache.clear()
+        self.calls = []
+
+    def tearDown(self):
+        self.cache.clear()
+        for key, value in self.settings.items():
+            self.conf[key] = value
+        self.td.cleanup()
+
+    def _write(self, name, content):
+        """
+        Write a template file, and return its path.
+        """
+        filename = os.path.join(self.td.name, name)
+        with open(filename, 'w') as fp:
+            fp.write(content)
+        return filename
+
+    def _parser(self, content):
+        """
+        Parse YAML content, recording the call.
+        """
+        self.calls.append(content)
+        return safe_load(content)
+
+    def test_01(self):
+        """
+        Test Case 01:
+        Render a template file using replacement fields of various kinds.
+
+        Test is passed if the result equals the result of :py:meth:`str.format`.
+        """
+        content = '{{literal}} {STAGE_INSTALLED:#x} {DEFAULT_CHARSET!r} {FLEET_INDEX_KEYS[0]} ' \
+                  '{DEFAULT_CHARSET:>{width}}'
+        filename = self._write('file.txt', content)
+        conf = dict(self.conf, width=12)
+        self.assertEqual(self.cache.render(filename, conf), content.format(**conf))
+        self.assertEqual(self.cache.render(self._write('plain.txt', 'no fields')), 'no fields')
+
+    def test_02(self):
+        """
+        Test Case 02:
+        Parse a template file repeatedly.
+
+        Test is passed if the file is parsed once only, and each call returns a copy of the result.
+        """
+        filename = self._write('stage.yml', 'stage: {STAGE_INSTALLED}\nlist: [1, 2]\n')
+        first = self.cache.parse(filename, self._parser)
+        first['list'].append(3)
+        second = self.cache.parse(filename, self._parser)
+        self.assertDictEqual(second, {'stage': self.conf['STAGE_INSTALLED'], 'list': [1, 2]})
+        self.assertEqual(len(self.calls), 1)
+
+    def test_03(self):
+        """
+        Test Case 03:
+        Parse a template file after the file or a setting it refers to has changed.
+
+        Test is passed if the file is parsed again in either case, while changes to settings it does not refer
+        to have no effect.
+        """
+        filename = self._write('stage.yml', 'stage: {STAGE_INSTALLED}\n')
+        self.cache.parse(filename, self._parser)
+        self._write('stage.yml', 'stage: {STAGE_SERVICE}\n')
+        self.assertDictEqual(self.cache.parse(filename, self._parser), {'stage': self.conf['STAGE_SERVICE']})
+        self.assertEqual(len(self.calls), 2)
+        self.assertDictEqual(self.cache.parse(filename, self._parser, dict(self.conf, STAGE_SERVICE=7)), {'stage': 7})
+        self.assertEqual(len(self.calls), 3)
+        self.cache.parse(filename, self._parser, dict(self.conf, STAGE_INSTALLED=7))
+        self.assertEqual(len(self.calls), 3)
+
+    def test_04(self):
+        """
+        Test Case 04:
+        Evict the templates used least recently.
+
+        Test is passed if only the template used least recently needs to be parsed again.
+        """
+        self.conf['TEMPLATE_CACHE_SIZE'] = 4
+        first = self._write('first.yml', 'a: 1\n')
+        second = self._write('second.yml', 'b: 2\n')
+        third = self._write('third.yml', 'c: 3\n')
+        for filename in (first, second, first, third):
+            self.cache.parse(filename, self._parser)
+        self.assertEqual(len(self.calls), 3)
+        self.cache.parse(first, self._parser)
+        self.assertEqual(len(self.calls), 3)
+        self.cache.parse(second, self._parser)
+        self.assertEqual(len(self.calls), 4)
+
+    def test_05(self):
+        """
+        Test Case 05:
+        Persist the cache within a file, and read it again.
+
+        Test is passed if the cache file is only accessible by its owner, parsed templates are restored from it,
+        and a cache file writeable by others is ignored.
+        """
+        cache_file = os.path.join(self.td.name, 'cache', 'templates.pickle')
+        self.conf['TEMPLATE_CACHE_FILE'] = cache_file
+        filename = self._write('stage.yml', 'stage: {STAGE_INSTALLED}\n')
+        self.cache.parse(filename, self._parser)
+        self.cache.save()
+        self.assertEqual(stat.S_IMODE(os.stat(cache_file).st_mode), 0o600)
+        self.cache._entries = None
+        self.assertDictEqual(self.cache.parse(filename, self._parser), {'stage': self.conf['STAGE_INSTALLED']})
+        self.assertEqual(len(self.calls), 1)
+        os.chmod(cache_file, 0o666)
+        self.cache._entries = None
+        self.cache.parse(filename, self._parser)
+        self.assertEqual(len(self.calls), 2)
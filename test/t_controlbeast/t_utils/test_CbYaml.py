@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+    test.t_controlbeast.t_utils.test_CbYaml
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    :copyright: Copyright 2014 by the ControlBeast team, see AUTHORS.
+    :license: ISC, see LICENSE for details.
+"""
+import glob
+import os
+from unittest import TestCase, skipUnless
+import yaml
+from controlbeast.conf import CbConf, get_conf
+from controlbeast.utils.yaml import CbYaml, safe_dump, safe_load, Dumper, Loader
+
+
+#: list of YAML files bundled with the master template
+_template_files = sorted(glob.glob(os.path.join(get_conf('TEMPLATE_PATH'), 'master', 'base', '*.yml')))
+
+
+class TestCbYaml(TestCase):
+    """
+    Class providing unit tests for the YAML helper functions and the CbYaml class.
+
+    **Covered test cases:**
+
+    ==============  ========================================================================================
+    Test Case       Description
+    ==============  ========================================================================================
+    01              Verify the libyaml based implementation is used if available.
+    02              Compare libyaml based and pure Python parsing of the bundled template files.
+    03              Compare libyaml based and pure Python serialisation of the bundled template files.
+    04              Serialise and parse a key store like dictionary.
+    05              Load a bundled template file using a CbYaml object.
+    06              Load YAML content not read from a file using a CbYaml object.
+    ==============  ========================================================================================
+    """
+
+    def test_01(self):
+        """
+        Test Case 01:
+        Verify the libyaml based implementation is used if available.
+
+        Test is passed if the loader and dumper classes match PyYAML's libyaml support.
+        """
+        if yaml.__with_libyaml__:
+            self.assertIs(Loader, yaml.CSafeLoader)
+            self.assertIs(Dumper, yaml.CSafeDumper)
+        else:
+            self.assertIs(Loader, yaml.SafeLoader)
+            self.assertIs(Dumper, yaml.SafeDumper)
+
+    @skipUnless(yaml.__with_libyaml__, 'PyYAML built without libyaml support')
+    def test_02(self):
+        """
+        Test Case 02:
+        Compare libyaml based and pure Python parsing of the bundled template files.
+
+        Test is passed if both implementations return identical data for every file.
+        """
+        conf = CbConf.get_instance()
+        for filename in _template_files:
+            with open(filename, 'r') as fp:
+                content = fp.read().format(**conf)
+            self.assertEqual(safe_load(content), yaml.load(content, Loader=yaml.SafeLoader))
+
+    @skipUnless(yaml.__with_libyaml__, 'PyYAML built without libyaml support')
+    def test_03(self):
+        """
+        Test Case 03:
+        Compare libyaml based and pure Python serialisation of the bundled template files.
+
+        Test is passed if both implementations generate identical output for every file.
+        """
+        conf = CbConf.get_instance()
+        for filename in _template_files:
+            with open(filename, 'r') as fp:
+                data = safe_load(fp.read().format(**conf))
+            self.assertEqual(
+                safe_dump(data),
+                yaml.dump(data, Dumper=yaml.SafeDumper, default_flow_style=False)
+            )
+
+    def test_04(self):
+        """
+        Test Case 04:
+        Serialise and parse a key store like dictionary.
+
+        Test is passed if the parsed dictionary equals the original one.
+        """
+        data = {
+            'stage': get_conf('STAGE_UNDEFINED'),
+            'hosts': ['host1', 'host2'],
+            'facts': {'os': 'FreeBSD', 'version': 10.0, 'jails': None, 'uptime': 'äöü €'}
+        }
+        self.assertDictEqual(safe_load(safe_dump(data)), data)
+
+    def test_05(self):
+        """
+        Test Case 05:
+        Load a bundled template file using a CbYaml object.
+
+        Test is passed if the CbYaml object equals the parsed file content-wise.
+        """
+        filename = os.path.join(get_conf('TEMPLATE_PATH'), 'master', 'base', 'os.yml')
+        obj = CbYaml(filename)
+        self.assertEqual(obj.filename, filename)
+        self.assertDictEqual(dict(obj), {'os': {'type': 'FreeBSD', 'version': 10.0}})
+
+    def test_06(self):
+        """
+        Test Case 06:
+        Load YAML content not read from a file using a CbYaml object.
+
+        Test is passed if the CbYaml object holds the content, with format strings replaced by settings.
+        """
+        obj = CbYaml(content=b'stage: {STAGE_INSTALLED}\n')
+        self.assertIsNone(obj.filename)
+        self.assertDictEqual(dict(obj), {'stage': get_conf('STAGE_INSTALLED')})